@@ -0,0 +1,206 @@
+# analytics.py - Group 7
+"""Course activity reports served from time-bucketed rollups
+
+Three rollup tables (see migrations.py) count live posts per course and
+hour, per course and day, and per course, day and author. Reports read
+these small tables instead of aggregating over messages, users and
+enrollments.
+
+The rollups are filled incrementally: refresh() counts the messages
+with ids above the high-water mark in analytics_state, one batch per
+transaction, and moves the mark. Below the mark, triggers keep the
+counts right when a post is removed or restored (tombstones are not
+counted, as in course_stats). Archiving counts its batch before it
+leaves the live file and does not uncount it, so the rollups keep
+archived posts. rebuild() recomputes everything from scratch and
+verify() compares the rollups with the raw aggregates.
+"""
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_REFRESH_BATCH = 10000
+REPORT_DAYS = 30
+TOP_CONTRIBUTORS = 10
+
+# (table, key columns, the same computed from a message); posted_at is 'YYYY-MM-DD HH:MM:SS'
+_ROLLUPS = (
+    ("activity_hourly", "course_id, hour", "course_id, substr(posted_at, 1, 13)"),
+    ("activity_daily", "course_id, day", "course_id, substr(posted_at, 1, 10)"),
+    ("activity_user_daily", "course_id, day, user_id", "course_id, substr(posted_at, 1, 10), user_id"),
+)
+
+_LIVE_SQL = "SELECT course_id, user_id, posted_at FROM main.messages WHERE deleted_at IS NULL"
+
+# Archived posts; a batch caught between copy and delete is counted once, from the live file
+_ARCHIVED_SQL = '''
+    SELECT course_id, user_id, posted_at FROM archive.messages
+    WHERE id NOT IN (SELECT id FROM main.messages)
+'''
+
+
+def _source(archived, up_to_mark=False):
+    """The posts the rollups count, as a subquery"""
+    sql = _LIVE_SQL
+    if up_to_mark:
+        sql += " AND id <= (SELECT last_message_id FROM analytics_state)"
+    if archived:
+        sql += " UNION ALL " + _ARCHIVED_SQL
+    return sql
+
+
+def _add_posts(conn, source, params=()):
+    """Add the posts selected by `source` to every rollup"""
+    for table, key, expression in _ROLLUPS:
+        conn.execute(f'''
+            INSERT INTO {table} ({key}, post_count)
+            SELECT {expression}, COUNT(*) FROM ({source}) WHERE true
+            GROUP BY {expression}
+            ON CONFLICT ({key}) DO UPDATE SET post_count = post_count + excluded.post_count
+        ''', params)
+
+
+def high_water_mark(conn):
+    """Id of the last message counted in the rollups"""
+    return conn.execute("SELECT last_message_id FROM analytics_state").fetchone()[0]
+
+
+def refresh_batch(conn, batch_size=DEFAULT_REFRESH_BATCH):
+    """Count up to `batch_size` messages above the high-water mark (all if None), return how many"""
+    last_id = high_water_mark(conn)
+    row = None
+    if batch_size is not None:
+        row = conn.execute(
+            "SELECT id FROM main.messages WHERE id > ? ORDER BY id LIMIT 1 OFFSET ?", (last_id, batch_size - 1)
+        ).fetchone()
+    if row is None:
+        row = conn.execute("SELECT MAX(id) FROM main.messages WHERE id > ?", (last_id,)).fetchone()
+        if row[0] is None:
+            return 0
+    params = (last_id, row[0])
+
+    _add_posts(conn, _LIVE_SQL + " AND id > ? AND id <= ?", params)
+    conn.execute(
+        "UPDATE analytics_state SET last_message_id = ?, refreshed_at = CURRENT_TIMESTAMP", (row[0],)
+    )
+    return conn.execute("SELECT COUNT(*) FROM main.messages WHERE id > ? AND id <= ?", params).fetchone()[0]
+
+
+def refresh(db, batch_size=DEFAULT_REFRESH_BATCH):
+    """Bring the rollups up to the newest message, one batch per transaction
+
+    `db` is a ConnectionManager; the writer is free for posts between
+    batches. Returns how many messages were looked at.
+    """
+    counted = 0
+    while True:
+        with db.writer() as conn:
+            count = refresh_batch(conn, batch_size)
+        if not count:
+            return counted
+        counted += count
+
+
+def rebuild(conn, archived=False):
+    """Recompute the rollups from the raw tables and move the high-water mark to the end
+
+    With archived=True the connection must have the archive attached.
+    """
+    for table, _, _ in _ROLLUPS:
+        conn.execute(f"DELETE FROM {table}")
+    _add_posts(conn, _source(archived))
+
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM main.messages").fetchone()[0]
+    if archived:
+        last_id = max(last_id, conn.execute("SELECT COALESCE(MAX(id), 0) FROM archive.messages").fetchone()[0])
+    conn.execute(
+        "UPDATE analytics_state SET last_message_id = ?, refreshed_at = CURRENT_TIMESTAMP", (last_id,)
+    )
+
+
+def verify(conn, archived=False):
+    """Compare the rollups with the raw aggregates up to the high-water mark, return the mismatches
+
+    Each mismatch is (table, key, stored count, expected count). Rows
+    counted down to zero are the same as missing rows.
+    """
+    mismatches = []
+    for table, key, expression in _ROLLUPS:
+        stored = {row[:-1]: row[-1] for row in conn.execute(
+            f"SELECT {key}, post_count FROM {table} WHERE post_count != 0"
+        )}
+        expected = {row[:-1]: row[-1] for row in conn.execute(
+            f"SELECT {expression}, COUNT(*) FROM ({_source(archived, up_to_mark=True)}) GROUP BY {expression}"
+        )}
+        for bucket in sorted(stored.keys() | expected.keys()):
+            if stored.get(bucket, 0) != expected.get(bucket, 0):
+                mismatches.append((table, bucket, stored.get(bucket, 0), expected.get(bucket, 0)))
+    return mismatches
+
+
+# ---------- reports ----------
+
+def report_period(days=REPORT_DAYS):
+    """(since, until) day strings for the last `days` days, today included (UTC, as posted_at)"""
+    until = datetime.now(timezone.utc).date() + timedelta(days=1)
+    return (until - timedelta(days=days)).isoformat(), until.isoformat()
+
+
+def posts_per_day(conn, course_id, since, until):
+    """[(day, posts), ...] for days with posts, `until` exclusive"""
+    return conn.execute('''
+        SELECT day, post_count FROM activity_daily
+        WHERE course_id = ? AND day >= ? AND day < ? AND post_count > 0
+        ORDER BY day
+    ''', (course_id, since, until)).fetchall()
+
+
+def busiest_hours(conn, course_id, since, until):
+    """[(hour of day 0-23, posts), ...], busiest first"""
+    return conn.execute('''
+        SELECT CAST(substr(hour, 12, 2) AS INTEGER), SUM(post_count) FROM activity_hourly
+        WHERE course_id = ? AND hour >= ? AND hour < ?
+        GROUP BY 1 HAVING SUM(post_count) > 0
+        ORDER BY 2 DESC, 1
+    ''', (course_id, since, until)).fetchall()
+
+
+def top_contributors(conn, course_id, since, until, limit=TOP_CONTRIBUTORS):
+    """[(username, role, posts), ...] of the most active authors"""
+    return conn.execute('''
+        SELECT u.username, u.role, SUM(d.post_count) AS posts
+        FROM activity_user_daily d
+        JOIN users u ON u.id = d.user_id
+        WHERE d.course_id = ? AND d.day >= ? AND d.day < ?
+        GROUP BY d.user_id HAVING posts > 0
+        ORDER BY posts DESC, u.username
+        LIMIT ?
+    ''', (course_id, since, until, limit)).fetchall()
+
+
+def participation(conn, course_id, since, until):
+    """(enrolled students who posted, enrolled students)"""
+    enrolled = conn.execute('''
+        SELECT COUNT(*) FROM enrollments e JOIN users u ON u.id = e.user_id
+        WHERE e.course_id = ? AND u.role = 'student'
+    ''', (course_id,)).fetchone()[0]
+    posted = conn.execute('''
+        SELECT COUNT(*) FROM (
+            SELECT DISTINCT user_id FROM activity_user_daily
+            WHERE course_id = ? AND day >= ? AND day < ? AND post_count > 0
+        ) p
+        JOIN enrollments e ON e.course_id = ? AND e.user_id = p.user_id
+        JOIN users u ON u.id = p.user_id
+        WHERE u.role = 'student'
+    ''', (course_id, since, until, course_id)).fetchone()[0]
+    return posted, enrolled
+
+
+def course_report(conn, course_id, since, until, top=TOP_CONTRIBUTORS):
+    """Every report for one course and period, as a dict"""
+    return {
+        "since": since,
+        "until": until,
+        "posts_per_day": posts_per_day(conn, course_id, since, until),
+        "busiest_hours": busiest_hours(conn, course_id, since, until),
+        "top_contributors": top_contributors(conn, course_id, since, until, top),
+        "participation": participation(conn, course_id, since, until),
+    }
@@ -0,0 +1,769 @@
+# api_server.py - Group 7
+"""JSON over HTTP front end for ForumService, on asyncio and the stdlib only
+
+One event loop thread owns every socket, so hundreds of idle or
+long-polling clients cost a few kilobytes each instead of a thread.
+Anything that blocks runs on one of two bounded thread pools:
+- "db" for SQLite work (sized to the reader pool, as more threads would
+  only queue for a connection)
+- "auth" for registration and login, whose PBKDF2 checks take ~100 ms
+  each and must not hold up cheap page loads
+Each pool accepts at most `max_pending` queued jobs; beyond that the
+server answers 503 with Retry-After instead of letting latency grow
+without bound.
+
+Clients log in once with POST /sessions and send the token back as
+`Authorization: Bearer <token>`. Every request after that costs an HMAC
+check and a dictionary lookup (see sessions.py). GET /feed?wait=N is a
+long poll that parks on the event loop and is woken by ChangeNotifier.
+
+Routes (all bodies are JSON):
+    POST   /users                         register {username, password, full_name, role}
+    POST   /sessions                      log in {username, password} -> {token}
+    DELETE /sessions                      log out
+    GET    /courses                       my courses with activity counters
+    POST   /courses                       create a course (staff) {course_code, course_name}
+    GET    /catalog?prefix=&by=&after=    courses I have not joined yet
+    POST   /courses/<id>/enrollment       join a course (students)
+    GET    /courses/<id>/messages?before=|after=
+    POST   /courses/<id>/messages         post {message, parent_id (optional, to reply)}
+    GET    /courses/<id>/threads?before=|after=   root posts with their replies, depth first
+    GET    /courses/<id>/threads/<message id>     one post and the replies below it
+    GET    /search?q=&page=
+    GET    /feed?cursor=&wait=&course=
+    POST   /courses/<id>/messages/<message id>/attachments?filename=   attach the raw body (own posts)
+    GET    /courses/<id>/attachments/<attachment id>                  download, streamed in chunks
+    POST   /courses/<id>/moderation       soft-delete {message_id|author|since|until|keyword}
+    POST   /courses/<id>/moderation/<action id>/restore   undo a moderation action
+    GET    /health
+
+Usage:
+    python api_server.py --db course_forum.db --port 8080 [--db-workers 8] [--write-behind] [--shards 4]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import math
+import re
+import signal
+import sqlite3
+import sys
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, quote, urlsplit
+
+from attachments import CHUNK_SIZE, MAX_ATTACHMENT_SIZE
+from catalog import CATALOG_PAGE_SIZE
+from feed import FEED_LIMIT
+from passwords import DEFAULT_ITERATIONS
+from service import MESSAGE_PAGE_SIZE, THREAD_PAGE_SIZE, ForumService
+from sharding import ShardedForumService
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_DB_WORKERS = 8
+DEFAULT_MAX_PENDING = 512  # Queued jobs per pool before answering 503
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+MAX_PAGE_SIZE = 100
+MAX_WAIT_SECONDS = 60
+KEEP_ALIVE_SECONDS = 30
+
+log = logging.getLogger("course_forum.api")
+
+Request = namedtuple("Request", ["method", "path", "query", "headers", "body", "keep_alive"])
+# Requests whose body is a file, not JSON
+_UPLOAD_PATH = re.compile(r"/courses/\d+/messages/\d+/attachments")
+# Returned by a handler instead of a JSON payload to stream an attachment
+Download = namedtuple("Download", ["course_id", "attachment_id", "filename", "content_type", "size"])
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class BoundedExecutor:
+    def __init__(self, name, workers, max_pending=DEFAULT_MAX_PENDING):
+        """Thread pool that turns work away once `max_pending` jobs are queued or running"""
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0  # Only touched on the event loop thread
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"api-{name}")
+
+    async def run(self, func, *args, **kwargs):
+        """Run func on the pool and await its result, HTTPError 503 if the pool is full"""
+        if self.pending >= self.max_pending:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, f"Server busy ({self.name}), try again")
+        self.pending += 1
+        try:
+            future = self._pool.submit(func, *args, **kwargs)
+            return await asyncio.wrap_future(future)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def encode_cursor(cursor):
+    """Opaque URL-safe token for a (posted_at, id), catalog or feed cursor"""
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, length=2):
+    """Inverse of encode_cursor; ValueError for anything it did not produce
+
+    `length` is the number of parts expected, None for any number.
+    """
+    if token is None:
+        return None
+    try:
+        value = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Bad cursor") from None
+    if not isinstance(value, list) or length is not None and len(value) != length:
+        raise ValueError("Bad cursor")
+    # Parts are bound as SQL parameters: only scalars, and no booleans (JSON true is not an id)
+    if not all(isinstance(part, (str, int, float)) and not isinstance(part, bool) for part in value):
+        raise ValueError("Bad cursor")
+    return tuple(value)
+
+
+def encode_feed_cursor(cursor):
+    """Feed cursors are one seq, or one seq per shard (see sharding.py)"""
+    return encode_cursor(cursor if isinstance(cursor, tuple) else [cursor])
+
+
+def decode_thread_cursor(token):
+    """Thread pages are keyed on the path of a root post"""
+    cursor = decode_cursor(token, length=1)
+    if cursor is None:
+        return None
+    if not isinstance(cursor[0], str):
+        raise ValueError("Bad cursor")
+    return cursor[0]
+
+
+def decode_feed_cursor(token):
+    cursor = decode_cursor(token, length=None)
+    if cursor is None:
+        return None
+    if not cursor or not all(isinstance(seq, int) and seq >= 0 for seq in cursor):
+        raise ValueError("Bad cursor")
+    return cursor[0] if len(cursor) == 1 else cursor
+
+
+async def read_request(reader):
+    """Parse one HTTP/1.1 request, None when the client closed the connection"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as exc:
+        if not exc.partial:
+            return None
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Incomplete request")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line") from None
+
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Bad Content-Length") from None
+    url = urlsplit(target)
+    if method == "POST" and _UPLOAD_PATH.fullmatch(url.path):
+        # A file upload: spooled to disk in chunks, never held in memory whole
+        if length > MAX_ATTACHMENT_SIZE:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "File too large")
+        body = tempfile.SpooledTemporaryFile(max_size=MAX_BODY_BYTES)
+        try:
+            remaining = length
+            while remaining:
+                chunk = await reader.readexactly(min(CHUNK_SIZE, remaining))
+                body.write(chunk)
+                remaining -= len(chunk)
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+    else:
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body too large")
+        body = await reader.readexactly(length) if length else b""
+
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+    query = {name: values[0] for name, values in parse_qs(url.query).items()}
+    return Request(method, url.path, query, headers, body, keep_alive)
+
+
+def encode_response(status, payload, keep_alive=True):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    status = HTTPStatus(status)
+    head = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        "Content-Type: application/json; charset=utf-8",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    if status == HTTPStatus.SERVICE_UNAVAILABLE:
+        head.append("Retry-After: 1")
+    return ("\r\n".join(head) + "\r\n\r\n").encode() + body
+
+
+def encode_download_head(download, keep_alive=True):
+    """Response head for an attachment; the body follows in chunks"""
+    fallback = download.filename.encode("ascii", "replace").decode().replace("?", "_")
+    head = [
+        "HTTP/1.1 200 OK",
+        f"Content-Type: {download.content_type}",
+        f"Content-Length: {download.size}",
+        f"Content-Disposition: attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(download.filename)}",
+        "X-Content-Type-Options: nosniff",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    return ("\r\n".join(head) + "\r\n\r\n").encode()
+
+
+def _attachments_json(files, message_id):
+    """Attachment metadata of one message from a {message_id: [...]} listing"""
+    return [{"id": attachment_id, "filename": filename, "content_type": content_type, "size": size}
+            for attachment_id, filename, content_type, size in files.get(message_id, ())]
+
+
+def _message_json(row, files):
+    message_id, message, username, posted_at = row
+    return {"id": message_id, "message": message, "username": username, "posted_at": posted_at,
+            "attachments": _attachments_json(files, message_id)}
+
+
+def _thread_json(row, files):
+    message_id, parent_id, depth, reply_count, message, username, posted_at = row
+    return {"id": message_id, "parent_id": parent_id, "depth": depth, "reply_count": reply_count,
+            "message": message, "username": username, "posted_at": posted_at,
+            "removed": message is None, "attachments": _attachments_json(files, message_id)}
+
+
+def _event_json(row):
+    seq, kind, course_id, message_id, username, message, posted_at = row
+    return {"seq": seq, "kind": kind, "course_id": course_id, "message_id": message_id,
+            "username": username, "message": message, "posted_at": posted_at}
+
+
+def _course_json(row, activity):
+    course_id, code, name, creator = row[:4]
+    message_count, member_count, last_posted_at = activity[-3:] if activity else (0, 0, None)
+    return {"id": course_id, "code": code, "name": name, "creator": creator,
+            "message_count": message_count, "member_count": member_count,
+            "last_posted_at": last_posted_at}
+
+
+def _int_param(query, name, default=None, low=None, high=None):
+    value = query.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number") from None
+    if low is not None and value < low or high is not None and value > high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+
+def _float_param(query, name, default=None, low=None, high=None):
+    """Like _int_param; nan and infinities are rejected, out-of-range values clamped"""
+    value = query.get(name)
+    if value is None:
+        return default
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number") from None
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be a number")
+    if low is not None:
+        value = max(value, low)
+    if high is not None:
+        value = min(value, high)
+    return value
+
+
+class ForumAPI:
+    def __init__(self, service, db_workers=DEFAULT_DB_WORKERS, auth_workers=None,
+                 max_pending=DEFAULT_MAX_PENDING):
+        """HTTP handlers for a ForumService; auth_workers defaults to the hasher's threads"""
+        self.service = service
+        self.db = BoundedExecutor("db", db_workers, max_pending)
+        self.auth = BoundedExecutor("auth", auth_workers or service.hasher.workers, max_pending)
+        self._loop = None
+        self._waiters = {}  # course_id -> futures of parked long polls
+        self._connections = {}  # StreamWriter -> task of each open connection
+        self.server = None
+        self.routes = [
+            ("GET", r"/health", self.health, False),
+            ("POST", r"/users", self.register, False),
+            ("POST", r"/sessions", self.login, False),
+            ("DELETE", r"/sessions", self.logout, True),
+            ("GET", r"/courses", self.my_courses, True),
+            ("POST", r"/courses", self.create_course, True),
+            ("GET", r"/catalog", self.catalog, True),
+            ("POST", r"/courses/(\d+)/enrollment", self.join_course, True),
+            ("GET", r"/courses/(\d+)/messages", self.messages, True),
+            ("POST", r"/courses/(\d+)/messages", self.post_message, True),
+            ("GET", r"/courses/(\d+)/threads", self.threads, True),
+            ("GET", r"/courses/(\d+)/threads/(\d+)", self.thread, True),
+            ("POST", r"/courses/(\d+)/messages/(\d+)/attachments", self.attach, True),
+            ("GET", r"/courses/(\d+)/attachments/(\d+)", self.download, True),
+            ("GET", r"/search", self.search, True),
+            ("GET", r"/feed", self.feed, True),
+            ("POST", r"/courses/(\d+)/moderation", self.moderate, True),
+            ("POST", r"/courses/(\d+)/moderation/(\d+)/restore", self.restore, True),
+        ]
+        self.routes = [(method, re.compile(path), handler, auth)
+                       for method, path, handler, auth in self.routes]
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Listen for connections, return the asyncio Server"""
+        self._loop = asyncio.get_running_loop()
+        self.service.notifier.subscribe(self._on_publish)
+        self.server = await asyncio.start_server(self._serve_connection, host, port,
+                                                 limit=MAX_HEADER_BYTES)
+        return self.server
+
+    async def stop(self):
+        """Stop listening, hang up idle keep-alive connections, wait for running jobs"""
+        self.server.close()
+        self._wake(list(self._waiters))  # Answer parked long polls now
+        tasks = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()  # A connection waiting for its next request sees EOF and ends
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.wait_closed()
+        self.db.shutdown()
+        self.auth.shutdown()
+
+    # ---------- connections ----------
+
+    async def _serve_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), KEEP_ALIVE_SECONDS)
+                except HTTPError as exc:
+                    writer.write(encode_response(exc.status, {"error": exc.message}, keep_alive=False))
+                    await writer.drain()
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                if request is None:
+                    break
+
+                try:
+                    status, payload = await self.dispatch(request)
+                finally:
+                    if not isinstance(request.body, bytes):
+                        request.body.close()  # Spooled upload
+                if isinstance(payload, Download):
+                    if not await self._send_download(writer, payload, request.keep_alive):
+                        break
+                else:
+                    writer.write(encode_response(status, payload, request.keep_alive))
+                    await writer.drain()
+                if not request.keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _send_download(self, writer, download, keep_alive):
+        """Stream an attachment, one chunk per job on the db pool; False if it was cut short"""
+        writer.write(encode_download_head(download, keep_alive))
+        offset = 0
+        while offset < download.size:
+            try:
+                chunk = await self.db.run(self.service.read_attachment, download.course_id,
+                                          download.attachment_id, offset)
+            except (HTTPError, LookupError, sqlite3.Error) as exc:
+                chunk = b""
+                log.warning("Download of attachment %s stopped: %s", download.attachment_id, exc)
+            if not chunk:
+                return False  # The promised length cannot be met: the connection must close
+            writer.write(chunk)
+            await writer.drain()
+            offset += len(chunk)
+        return True
+
+    async def dispatch(self, request):
+        """Route one request, return (status, JSON payload)"""
+        try:
+            allowed = []
+            for method, pattern, handler, needs_auth in self.routes:
+                match = pattern.fullmatch(request.path)
+                if match is None:
+                    continue
+                if method != request.method:
+                    allowed.append(method)
+                    continue
+                session = await self._session(request) if needs_auth else None
+                return await handler(request, session, *(int(group) for group in match.groups()))
+            if allowed:
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"Use {' or '.join(allowed)}")
+            raise HTTPError(HTTPStatus.NOT_FOUND, "No such resource")
+        except HTTPError as exc:
+            return exc.status, {"error": exc.message}
+        except PermissionError as exc:
+            return HTTPStatus.FORBIDDEN, {"error": str(exc)}
+        except sqlite3.IntegrityError:
+            return HTTPStatus.CONFLICT, {"error": "Already exists"}
+        except sqlite3.OperationalError as exc:
+            # Usually "database is locked" after busy_timeout: tell the client to retry
+            log.warning("%s %s: %s", request.method, request.path, exc)
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Database busy, try again"}
+        except LookupError as exc:
+            return HTTPStatus.NOT_FOUND, {"error": str(exc)}
+        except ValueError as exc:
+            return HTTPStatus.BAD_REQUEST, {"error": str(exc)}
+        except Exception:
+            log.exception("%s %s failed", request.method, request.path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal error"}
+
+    async def _session(self, request):
+        """The caller's Session from the Bearer token, HTTPError 401 without one"""
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Log in first (Authorization: Bearer <token>)")
+        if self.service.sessions.db is None:
+            session = self.service.session(token)  # Memory only: HMAC and a dict lookup
+        else:
+            session = await self.db.run(self.service.session, token)
+        if session is None:
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Session expired, log in again")
+        return session
+
+    @staticmethod
+    def _json_body(request, *required):
+        try:
+            body = json.loads(request.body or b"{}")
+        except ValueError:
+            raise ValueError("Body must be JSON") from None
+        if not isinstance(body, dict):
+            raise ValueError("Body must be a JSON object")
+        missing = [name for name in required if not isinstance(body.get(name), str) or not body[name].strip()]
+        if missing:
+            raise ValueError(f"Missing {', '.join(missing)}")
+        return body
+
+    @staticmethod
+    def _require_role(session, role):
+        if session.role != role:
+            raise PermissionError(f"Only {role} can do this")
+
+    def _check_enrolled(self, user_id, course_id):
+        """Raise PermissionError unless the user is in the course (cached lookup)"""
+        if not self.service.is_enrolled(user_id, course_id):
+            raise PermissionError("You are not enrolled in this course")
+
+    # ---------- change notifications ----------
+
+    def _on_publish(self, course_ids):
+        """Called on whichever thread committed; hand over to the event loop"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake, list(course_ids))
+
+    def _wake(self, course_ids):
+        for course_id in course_ids:
+            for waiter in self._waiters.get(course_id, ()):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def _wait_for_change(self, course_ids, version, timeout):
+        """Park until one of the courses changes after `version` or the timeout"""
+        waiter = self._loop.create_future()
+        for course_id in course_ids:
+            self._waiters.setdefault(course_id, set()).add(waiter)
+        try:
+            # Registered first, so a publish from here on is not missed
+            if not self.service.notifier.changed(course_ids, version):
+                await asyncio.wait([waiter], timeout=timeout)
+        finally:
+            for course_id in course_ids:
+                waiters = self._waiters.get(course_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[course_id]
+
+    # ---------- handlers ----------
+
+    async def health(self, request, session):
+        return HTTPStatus.OK, {
+            "status": "ok",
+            "pending": {"db": self.db.pending, "auth": self.auth.pending},
+            "waiting": sum(len(waiters) for waiters in self._waiters.values()),
+        }
+
+    async def register(self, request, session):
+        body = self._json_body(request, "username", "password", "full_name", "role")
+        user_id = await self.auth.run(self.service.create_user, body["username"], body["password"],
+                                      body["full_name"], body["role"])
+        return HTTPStatus.CREATED, {"user_id": user_id}
+
+    async def login(self, request, session):
+        body = self._json_body(request, "username", "password")
+        result = await self.auth.run(self.service.open_session, body["username"], body["password"])
+        if result is None:
+            # Same answer for unknown user and bad password
+            raise HTTPError(HTTPStatus.UNAUTHORIZED, "Wrong username or password")
+        token, user_id, role = result
+        return HTTPStatus.CREATED, {"token": token, "user_id": user_id, "role": role}
+
+    async def logout(self, request, session):
+        token = request.headers["authorization"].partition(" ")[2]
+        await self.db.run(self.service.close_session, token)
+        return HTTPStatus.OK, {}
+
+    async def my_courses(self, request, session):
+        def work():
+            courses = self.service.get_my_courses(session.user_id)
+            activity = self.service.course_activity([course[0] for course in courses])
+            return [_course_json(course, activity.get(course[0])) for course in courses]
+        return HTTPStatus.OK, {"courses": await self.db.run(work)}
+
+    async def create_course(self, request, session):
+        self._require_role(session, "staff")
+        body = self._json_body(request, "course_code", "course_name")
+        course_id = await self.db.run(self.service.add_course, session.user_id,
+                                      body["course_code"].strip(), body["course_name"].strip())
+        return HTTPStatus.CREATED, {"course_id": course_id}
+
+    async def catalog(self, request, session):
+        query = request.query
+        page = await self.db.run(
+            self.service.course_catalog, session.user_id, query.get("prefix", ""),
+            query.get("by", "code"), decode_cursor(query.get("after")),
+            _int_param(query, "page_size", CATALOG_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        )
+        return HTTPStatus.OK, {
+            "courses": [_course_json(row, row[4:] if row[4] is not None else None)
+                        for row in page["courses"]],
+            "next": encode_cursor(page["next"]),
+        }
+
+    async def join_course(self, request, session, course_id):
+        self._require_role(session, "student")
+
+        def work():
+            self.service.get_course(course_id)  # 404 rather than a foreign key error
+            self.service.enroll(session.user_id, course_id)
+        await self.db.run(work)
+        return HTTPStatus.CREATED, {"course_id": course_id}
+
+    async def messages(self, request, session, course_id):
+        before = decode_cursor(request.query.get("before"))
+        after = decode_cursor(request.query.get("after"))
+        page_size = _int_param(request.query, "page_size", MESSAGE_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+
+        def work():
+            self._check_enrolled(session.user_id, course_id)
+            return self.service.fetch_message_page(course_id, page_size, before=before, after=after)
+        page = await self.db.run(work)
+        return HTTPStatus.OK, {
+            "messages": [_message_json(row, page["attachments"]) for row in page["messages"]],
+            "older": encode_cursor(page["older"]),
+            "newer": encode_cursor(page["newer"]),
+        }
+
+    async def threads(self, request, session, course_id):
+        before = decode_thread_cursor(request.query.get("before"))
+        after = decode_thread_cursor(request.query.get("after"))
+        page_size = _int_param(request.query, "page_size", THREAD_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+
+        def work():
+            self._check_enrolled(session.user_id, course_id)
+            return self.service.fetch_thread_page(course_id, page_size, before=before, after=after)
+        page = await self.db.run(work)
+        return HTTPStatus.OK, {
+            "messages": [_thread_json(row, page["attachments"]) for row in page["messages"]],
+            "older": encode_cursor(None if page["older"] is None else [page["older"]]),
+            "newer": encode_cursor(None if page["newer"] is None else [page["newer"]]),
+        }
+
+    async def thread(self, request, session, course_id, message_id):
+        def work():
+            self._check_enrolled(session.user_id, course_id)
+            rows = self.service.fetch_thread(course_id, message_id)
+            return rows, self.service.attachment_metadata(course_id, [row[0] for row in rows if row[4] is not None])
+        rows, files = await self.db.run(work)
+        return HTTPStatus.OK, {"messages": [_thread_json(row, files) for row in rows]}
+
+    async def attach(self, request, session, course_id, message_id):
+        filename = request.query.get("filename")
+        if not filename:
+            raise ValueError("Missing filename")
+        size = int(request.headers.get("content-length", 0))
+
+        def work():
+            self._check_enrolled(session.user_id, course_id)
+            return self.service.attach_file(session.user_id, course_id, message_id, filename, request.body,
+                                            size, request.headers.get("content-type"))
+        attachment_id = await self.db.run(work)
+        return HTTPStatus.CREATED, {"attachment_id": attachment_id}
+
+    async def download(self, request, session, course_id, attachment_id):
+        def work():
+            self._check_enrolled(session.user_id, course_id)
+            return self.service.attachment_info(course_id, attachment_id)
+        _, _, filename, content_type, size = await self.db.run(work)
+        return HTTPStatus.OK, Download(course_id, attachment_id, filename, content_type, size)
+
+    async def post_message(self, request, session, course_id):
+        body = self._json_body(request, "message")
+        message = body["message"].strip()
+        parent_id = body.get("parent_id")
+        if parent_id is not None and (not isinstance(parent_id, int) or isinstance(parent_id, bool)):
+            raise ValueError("parent_id must be a message id")
+
+        def work():
+            self._check_enrolled(session.user_id, course_id)
+            return self.service.submit_message(session.user_id, course_id, message, parent_id)
+        # In write-behind mode the id arrives with the group commit; wait for it here, not on a thread
+        message_id = await asyncio.wrap_future(await self.db.run(work))
+        return HTTPStatus.CREATED, {"message_id": message_id}
+
+    async def search(self, request, session):
+        page = _int_param(request.query, "page", 1, 1)
+        results, has_more = await self.db.run(self.service.search_messages, session.user_id,
+                                              request.query.get("q", ""), page)
+        return HTTPStatus.OK, {
+            "results": [dict(zip(("message_id", "course_code", "username", "posted_at", "snippet"), row))
+                        for row in results],
+            "has_more": has_more,
+        }
+
+    async def feed(self, request, session):
+        query = request.query
+        cursor = decode_feed_cursor(query.get("cursor"))
+        wait = _float_param(query, "wait", 0, 0, MAX_WAIT_SECONDS)
+        course_id = _int_param(query, "course")
+
+        def courses():
+            if course_id is not None:
+                self._check_enrolled(session.user_id, course_id)
+                return [course_id]
+            return [course[0] for course in self.service.get_my_courses(session.user_id)]
+        course_ids = await self.db.run(courses)
+        if cursor is None:
+            cursor = await self.db.run(self.service.feed_head)
+
+        deadline = self._loop.time() + wait
+        while True:
+            version = self.service.notifier.version  # Before querying, so no change slips in between
+            page = await self.db.run(self.service.fetch_feed, session.user_id, cursor, FEED_LIMIT,
+                                     course_ids if course_id is not None else None)
+            remaining = deadline - self._loop.time()
+            if page["events"] or remaining <= 0 or not course_ids:
+                break
+            await self._wait_for_change(course_ids, version, remaining)
+
+        return HTTPStatus.OK, {"events": [_event_json(row) for row in page["events"]],
+                               "cursor": encode_feed_cursor(page["cursor"])}
+
+    async def moderate(self, request, session, course_id):
+        body = self._json_body(request)
+        filters = {name: body.get(name) for name in ("message_id", "author", "since", "until", "keyword")}
+        message_id = filters["message_id"]
+        if message_id is not None and (not isinstance(message_id, int) or isinstance(message_id, bool)):
+            raise ValueError("message_id must be a message id")
+        for name in ("author", "since", "until", "keyword"):
+            if filters[name] is not None and not isinstance(filters[name], str):
+                raise ValueError(f"{name} must be a string")
+        action_id, count = await self.db.run(self.service.moderate_messages, session.user_id, course_id,
+                                             **filters)
+        return HTTPStatus.CREATED, {"action_id": action_id, "count": count}
+
+    async def restore(self, request, session, course_id, action_id):
+        count = await self.db.run(self.service.restore_moderation, session.user_id, action_id, course_id)
+        return HTTPStatus.OK, {"restored": count}
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT, **api_options):
+    """Run the API until SIGINT/SIGTERM"""
+    api = ForumAPI(service, **api_options)
+    server = await api.start(host, port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    address = server.sockets[0].getsockname()
+    print(f"Serving on http://{address[0]}:{address[1]} "
+          f"(db workers={api.db.workers}, auth workers={api.auth.workers})", flush=True)
+    try:
+        await stop.wait()
+    finally:
+        await api.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Course forum JSON API")
+    parser.add_argument("--db", default="course_forum.db", help="database file")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="spread courses over this many database files (see sharding.py)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--db-workers", type=int, default=DEFAULT_DB_WORKERS,
+                        help="threads (and read connections) for SQLite work")
+    parser.add_argument("--auth-workers", type=int, default=None,
+                        help="threads for PBKDF2 work (default: one per CPU)")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING,
+                        help="queued jobs per pool before answering 503")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="group-commit posts on a background writer thread")
+    parser.add_argument("--persist-sessions", action="store_true",
+                        help="keep sessions valid across restarts")
+    parser.add_argument("--password-iterations", type=int, default=DEFAULT_ITERATIONS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    service_class, options = ForumService, {}
+    if args.shards > 1:
+        service_class, options = ShardedForumService, {"shards": args.shards}
+    service = service_class(args.db, read_pool_size=args.db_workers,
+                            password_iterations=args.password_iterations,
+                            hash_workers=args.auth_workers, persist_sessions=args.persist_sessions,
+                            write_behind=args.write_behind, **options)
+    try:
+        asyncio.run(serve(service, args.host, args.port, db_workers=args.db_workers,
+                          auth_workers=args.auth_workers, max_pending=args.max_pending))
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# archive.py - Group 7
+"""Hot/cold message archiving into a separate SQLite file
+
+Old messages (posted before a cutoff, or from courses that have ended)
+are moved in batches from course_forum.db into an archive database that
+is ATTACHed as `archive`. The live file keeps only recent posts, so its
+indexes, backups and VACUUM stay small; readers only touch the archive
+when someone pages back past the live data. A cutoff date moves whole
+threads only (a thread stays live while any post in it is recent); the
+archive keeps posts without their thread structure.
+
+Moves are crash-safe and resumable. SQLite does not make a commit across
+two attached files atomic in WAL mode, so every batch is done in two
+steps: copy into the archive and commit, then delete from the live file
+and commit. The copy is idempotent (INSERT OR IGNORE on the same id) and
+the delete only removes ids already present in the archive, so a crash at
+any point loses nothing and re-running the command simply continues.
+A live row is only deleted when the archive holds the same post (id,
+course, author and posting time); a live post whose id is already taken
+in the archive by another post stays live.
+"""
+import logging
+import os
+
+import analytics
+import stats
+
+DEFAULT_BATCH_SIZE = 1000
+
+log = logging.getLogger("course_forum.archive")
+
+# The archived copy `a` is the live message `m`, not an older post with the same id
+_SAME_POST = "(a.course_id = m.course_id AND a.user_id = m.user_id AND a.posted_at IS m.posted_at)"
+
+
+def default_archive_path(db_path):
+    """course_forum.db -> course_forum_archive.db"""
+    if db_path == ":memory:":
+        return None
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_archive{ext or '.db'}"
+
+
+class Archiver:
+    def __init__(self, db, archive_path):
+        """`db` is the ConnectionManager of the live database"""
+        self.db = db
+        self.archive_path = archive_path
+        self._attached = set()  # ids of connections with the archive attached
+
+    def exists(self):
+        """True once anything has been archived"""
+        return self.archive_path is not None and os.path.exists(self.archive_path)
+
+    def _attach_writer(self, conn):
+        """Attach (creating if needed) the archive on the writer connection"""
+        if id(conn) in self._attached:
+            return
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS archive.messages (
+                id INTEGER PRIMARY KEY,
+                course_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                posted_at TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS archive.idx_archive_course_posted
+            ON messages (course_id, posted_at, id)
+        ''')
+        conn.execute("PRAGMA archive.synchronous = FULL")  # Copies must be on disk before deletes
+        conn.commit()
+        self._attached.add(id(conn))
+
+    def reserve_ids(self):
+        """Keep SQLite from handing out the ids of archived messages again
+
+        messages uses AUTOINCREMENT and shards track their last id, so this
+        only matters for archives made before they did (migrations 14 and
+        15): their ids may be above every live one.
+        """
+        if not self.exists():
+            return
+        with self.db.writer() as conn:
+            self._attach_writer(conn)
+            top = conn.execute("SELECT MAX(id) FROM archive.messages").fetchone()[0]
+            if top is None:
+                return
+            updated = conn.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'messages'", (top,)
+            ).rowcount
+            if not updated:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', ?)", (top,))
+            # Shards hand out ids from their own range (see sharding.py)
+            conn.execute('''
+                UPDATE shard_info SET message_id_floor = MAX(message_id_floor, COALESCE(
+                    (SELECT MAX(id) FROM archive.messages WHERE id < (shard_info.shard + 1) << 40), 0))
+            ''')
+
+    def attach_reader(self, conn):
+        """Attach the archive read-only on a reader connection (once)"""
+        if id(conn) in self._attached:
+            return True
+        if not self.exists():
+            return False
+        if conn is self.db.writer_conn:
+            self._attach_writer(conn)
+        else:
+            conn.execute("ATTACH DATABASE ? AS archive", (f"file:{self.archive_path}?mode=ro",))
+            self._attached.add(id(conn))
+        return True
+
+    # ---------- moving data ----------
+
+    def archive_messages(self, before=None, course_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+        """Move messages posted before `before` and/or from `course_ids`, return how many"""
+        if before is None and not course_ids:
+            raise ValueError("Give a cutoff date, course ids, or both")
+
+        conditions, params = ["deleted_at IS NULL"], []  # Tombstones are left for the purge job
+        # A post whose id the archive already holds for a different post can never move
+        conditions.append(f"NOT EXISTS (SELECT 1 FROM archive.messages AS a WHERE a.id = m.id AND NOT {_SAME_POST})")
+        if before is not None:
+            # Whole threads only: nothing in the post's thread may be newer than the cutoff
+            conditions.append("posted_at < ?")
+            conditions.append('''NOT EXISTS (
+                SELECT 1 FROM main.messages AS t
+                WHERE t.course_id = m.course_id
+                  AND t.path >= substr(m.path, 1, 30) AND t.path < substr(m.path, 1, 30) || '~'
+                  AND t.posted_at >= ?
+            )''')
+            params.extend([before, before])
+        if course_ids:
+            conditions.append(f"course_id IN ({', '.join('?' * len(course_ids))})")
+            params.extend(course_ids)
+        select_batch = f'''
+            SELECT id FROM main.messages AS m
+            WHERE {" AND ".join(conditions)}
+            ORDER BY id
+            LIMIT ?
+        '''
+
+        moved = 0
+        while True:
+            with self.db.writer() as conn:
+                self._attach_writer(conn)
+                ids = [row[0] for row in conn.execute(select_batch, params + [batch_size])]
+            if not ids:
+                break
+            self._move_batch(ids)
+            moved += len(ids)
+            log.info("  archived %d messages...", moved)
+        return moved
+
+    def _move_batch(self, ids):
+        placeholders = ", ".join("?" * len(ids))
+
+        # Step 1: copy; committed (and synced) before anything is deleted
+        with self.db.writer() as conn:
+            conn.execute(f'''
+                INSERT OR IGNORE INTO archive.messages (id, course_id, user_id, message, posted_at)
+                SELECT id, course_id, user_id, message, posted_at
+                FROM main.messages WHERE id IN ({placeholders})
+            ''', ids)
+
+        # Step 2: delete only what the archive now holds
+        with self.db.writer() as conn:
+            # The activity rollups keep archived posts: count them before they leave
+            analytics.refresh_batch(conn, batch_size=None)
+
+            # Moving is not deleting: keep the course counters as they were
+            saved_stats = conn.execute(f'''
+                SELECT course_id, message_count, last_posted_at FROM course_stats
+                WHERE course_id IN (SELECT DISTINCT course_id FROM main.messages WHERE id IN ({placeholders}))
+            ''', ids).fetchall()
+
+            conn.execute(f'''
+                DELETE FROM main.messages AS m
+                WHERE id IN ({placeholders})
+                  AND EXISTS (SELECT 1 FROM archive.messages AS a WHERE a.id = m.id AND {_SAME_POST})
+            ''', ids)
+
+            conn.executemany(
+                "UPDATE course_stats SET message_count = ?, last_posted_at = ? WHERE course_id = ?",
+                [(count, last_posted_at, course_id) for course_id, count, last_posted_at in saved_stats]
+            )
+
+    def compact(self):
+        """Give the space freed by archiving back to the file system"""
+        with self.db.writer() as conn:
+            conn.execute("VACUUM main")  # No transaction is open here, as VACUUM requires
+            conn.execute("PRAGMA main.wal_checkpoint(TRUNCATE)")
+
+    # ---------- reading ----------
+
+    def older(self, conn, course_id, cursor, limit):
+        """Archived messages before a (posted_at, id) cursor, newest first"""
+        if cursor is None:
+            return conn.execute('''
+                SELECT m.id, m.message, u.username, m.posted_at
+                FROM archive.messages m
+                JOIN users u ON m.user_id = u.id
+                WHERE m.course_id = ?
+                ORDER BY m.posted_at DESC, m.id DESC
+                LIMIT ?
+            ''', (course_id, limit)).fetchall()
+        return conn.execute('''
+            SELECT m.id, m.message, u.username, m.posted_at
+            FROM archive.messages m
+            JOIN users u ON m.user_id = u.id
+            WHERE m.course_id = ? AND (m.posted_at, m.id) < (?, ?)
+            ORDER BY m.posted_at DESC, m.id DESC
+            LIMIT ?
+        ''', (course_id, cursor[0], cursor[1], limit)).fetchall()
+
+    def newer(self, conn, course_id, cursor, limit):
+        """Archived messages after a (posted_at, id) cursor, oldest first"""
+        return conn.execute('''
+            SELECT m.id, m.message, u.username, m.posted_at
+            FROM archive.messages m
+            JOIN users u ON m.user_id = u.id
+            WHERE m.course_id = ? AND (m.posted_at, m.id) > (?, ?)
+            ORDER BY m.posted_at, m.id
+            LIMIT ?
+        ''', (course_id, cursor[0], cursor[1], limit)).fetchall()
+
+    def verify_stats(self):
+        """stats.verify() with archived messages counted in"""
+        with self.db.writer() as conn:
+            self._attach_writer(conn)
+            return stats.verify(conn, archived=True)
+
+    def backfill_stats(self):
+        """stats.backfill() with archived messages counted in"""
+        with self.db.writer() as conn:
+            self._attach_writer(conn)
+            stats.backfill(conn, archived=True)
+
+    def verify_analytics(self):
+        """analytics.verify() with archived messages counted in"""
+        with self.db.writer() as conn:
+            self._attach_writer(conn)
+            return analytics.verify(conn, archived=True)
+
+    def rebuild_analytics(self):
+        """analytics.rebuild() with archived messages counted in"""
+        with self.db.writer() as conn:
+            self._attach_writer(conn)
+            analytics.rebuild(conn, archived=True)
@@ -0,0 +1,152 @@
+# attachments.py - Group 7
+"""File attachments, stored once per content and streamed in chunks
+
+A file is never held in memory as a whole. store() reserves a blob of
+the right size with zeroblob() and copies the upload into it CHUNK_SIZE
+bytes at a time through sqlite3's incremental blob I/O
+(Connection.blobopen), and downloads read it back the same way.
+
+Identical files share one row of `blobs`, found by SHA-256. Each
+attachments row points at a blob; triggers (see migrations.py) keep the
+blob's ref_count and delete the bytes with the last attachment.
+Listings only read the attachments table (name, type, size), never the
+blobs. Each course has a quota of attachment bytes, in which every
+attachment counts, shared or not.
+"""
+import hashlib
+import os
+import re
+
+CHUNK_SIZE = 64 * 1024
+MAX_ATTACHMENT_SIZE = 10 * 1024 * 1024
+DEFAULT_COURSE_QUOTA = 200 * 1024 * 1024
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+_CONTENT_TYPE = re.compile(r"[\w.+-]+/[\w.+-]+")
+_UNSAFE_NAME_CHARS = re.compile(r'[\x00-\x1f\x7f"\\/]')
+
+
+def clean_filename(filename):
+    """Base name without path parts, quotes or control characters; ValueError if nothing is left"""
+    name = _UNSAFE_NAME_CHARS.sub("_", os.path.basename(filename.replace("\\", "/"))).strip()
+    if not name or name in (".", ".."):
+        raise ValueError("Attachment needs a file name")
+    return name[:255]
+
+
+def clean_content_type(content_type):
+    """A plain type/subtype, anything else becomes application/octet-stream"""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    return content_type if _CONTENT_TYPE.fullmatch(content_type) else DEFAULT_CONTENT_TYPE
+
+
+def course_usage(conn, course_id):
+    """Attachment bytes a course uses (read from the covering index only)"""
+    return conn.execute(
+        "SELECT COALESCE(SUM(size), 0) FROM attachments WHERE course_id = ?", (course_id,)
+    ).fetchone()[0]
+
+
+def _chunks(stream, size, chunk_size):
+    """Read exactly `size` bytes from a binary stream, chunk by chunk"""
+    remaining = size
+    while remaining:
+        chunk = stream.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ValueError(f"File ended {remaining} bytes short of its declared size")
+        remaining -= len(chunk)
+        yield chunk
+    if stream.read(1):
+        raise ValueError(f"File is larger than its declared size of {size} bytes")
+
+
+def store(conn, stream, size, chunk_size=CHUNK_SIZE):
+    """Copy `size` bytes from a binary file object into blobs, return the blob id
+
+    A seekable stream is hashed first, so a file that is already stored
+    is not written a second time. Otherwise the bytes are written while
+    they are hashed and dropped again if they turn out to be a duplicate.
+    Call inside the transaction that also inserts the attachments row.
+    """
+    if stream.seekable():
+        start = stream.tell()
+        digest = hashlib.sha256()
+        for chunk in _chunks(stream, size, chunk_size):
+            digest.update(chunk)
+        row = conn.execute("SELECT id FROM blobs WHERE sha256 = ?", (digest.hexdigest(),)).fetchone()
+        if row is not None:
+            return row[0]
+        stream.seek(start)
+
+    blob_id = conn.execute(
+        "INSERT INTO blobs (size, data) VALUES (?, zeroblob(?))", (size, size)
+    ).lastrowid
+    digest = hashlib.sha256()
+    with conn.blobopen("blobs", "data", blob_id) as blob:
+        for chunk in _chunks(stream, size, chunk_size):
+            digest.update(chunk)
+            blob.write(chunk)
+
+    row = conn.execute("SELECT id FROM blobs WHERE sha256 = ?", (digest.hexdigest(),)).fetchone()
+    if row is not None:
+        conn.execute("DELETE FROM blobs WHERE id = ?", (blob_id,))
+        return row[0]
+    conn.execute("UPDATE blobs SET sha256 = ? WHERE id = ?", (digest.hexdigest(), blob_id))
+    return blob_id
+
+
+def copy_blobs(conn, source, blob_ids, chunk_size=CHUNK_SIZE):
+    """Stream blobs from the attached database `source` into main, return how many were copied
+
+    Contents main already has (same SHA-256) are skipped. The copies
+    start with ref_count 0; inserting their attachments rows counts them.
+    """
+    if not blob_ids:
+        return 0
+    rows = conn.execute(f'''
+        SELECT s.id, s.sha256, s.size FROM {source}.blobs AS s
+        WHERE s.id IN ({', '.join('?' * len(blob_ids))}) AND s.sha256 IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM main.blobs AS t WHERE t.sha256 = s.sha256)
+    ''', list(blob_ids)).fetchall()
+    for source_id, sha256, size in rows:
+        blob_id = conn.execute(
+            "INSERT INTO main.blobs (sha256, size, data) VALUES (?, ?, zeroblob(?))", (sha256, size, size)
+        ).lastrowid
+        with conn.blobopen("blobs", "data", source_id, readonly=True, name=source) as src, \
+                conn.blobopen("blobs", "data", blob_id, name="main") as dst:
+            while chunk := src.read(chunk_size):
+                dst.write(chunk)
+    return len(rows)
+
+
+def read_chunk(conn, blob_id, offset, length=CHUNK_SIZE):
+    """Up to `length` bytes of a blob starting at `offset` (b"" past the end)"""
+    with conn.blobopen("blobs", "data", blob_id, readonly=True) as blob:
+        blob.seek(min(offset, len(blob)))
+        return blob.read(length)
+
+
+def copy_out(conn, blob_id, out, chunk_size=CHUNK_SIZE):
+    """Write a whole blob to a binary file object chunk by chunk, return the bytes written"""
+    written = 0
+    with conn.blobopen("blobs", "data", blob_id, readonly=True) as blob:
+        while chunk := blob.read(chunk_size):
+            out.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def metadata(conn, message_ids):
+    """{message_id: [(attachment_id, filename, content_type, size), ...]} without touching blobs"""
+    found = {}
+    message_ids = list(message_ids)
+    # Stay well below SQLite's limit on ? parameters
+    for start in range(0, len(message_ids), 500):
+        batch = message_ids[start:start + 500]
+        for message_id, *attachment in conn.execute(f'''
+            SELECT message_id, id, filename, content_type, size FROM attachments
+            WHERE message_id IN ({', '.join('?' * len(batch))})
+            ORDER BY id
+        ''', batch):
+            found.setdefault(message_id, []).append(tuple(attachment))
+    return found
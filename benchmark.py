@@ -0,0 +1,433 @@
+# benchmark.py - Group 7
+"""Benchmarks for the main platform operations on synthetic data
+
+Builds a throw-away forum database at the requested scale (10k to 1M
+messages), with a realistic skew: a few courses and a few users produce
+most of the posts (Zipf distribution). Then each operation is timed many
+times and the latency percentiles and throughput are written as JSON so
+runs can be compared across commits.
+
+Usage:
+    python benchmark.py --messages 100000 --output bench_results.json
+    python benchmark.py --messages 20000 --check-analytics
+
+Everything runs offline in a temporary directory unless --db is given.
+"""
+import argparse
+import json
+import os
+import platform as py_platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import migrations
+from passwords import make_hash
+
+BENCH_PASSWORD = "bench-password"
+DEFAULT_SAMPLES = 200
+
+
+def zipf_weights(count, skew=1.1):
+    """Cumulative Zipf weights: item 0 is the most popular"""
+    return list(accumulate(1.0 / (rank + 1) ** skew for rank in range(count)))
+
+
+def pick(rng, items, cum_weights):
+    """Weighted random choice using precomputed cumulative weights"""
+    return items[bisect(cum_weights, rng.random() * cum_weights[-1])]
+
+
+def generate_forum(db_path, messages=10000, courses=None, users=None,
+                   courses_per_student=5, seed=7, batch_size=10000):
+    """Create a forum database with skewed synthetic activity
+
+    Defaults scale with the message count: one course per 1,000 messages
+    and one user per 100 messages (at least 10 courses and 100 users).
+    Every user has the password BENCH_PASSWORD. Returns the scale used.
+    """
+    rng = random.Random(seed)
+    courses = courses or max(10, messages // 1000)
+    users = users or max(100, messages // 100)
+    staff = max(1, courses // 5)
+
+    conn = sqlite3.connect(db_path)
+    migrations.migrate(conn)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")  # Throw-away data, load as fast as possible
+
+    # One real PBKDF2 hash shared by everybody keeps generation fast
+    password_hash = make_hash(BENCH_PASSWORD)
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (id, username, password_hash, role, full_name) VALUES (?, ?, ?, ?, ?)",
+            ((i, f"user{i:07d}", password_hash, "staff" if i <= staff else "student", f"User {i}")
+             for i in range(1, users + 1))
+        )
+        conn.executemany(
+            "INSERT INTO courses (id, course_code, course_name, created_by) VALUES (?, ?, ?, ?)",
+            ((i, f"C{i:06d}", f"Synthetic Course {i}", (i - 1) % staff + 1)
+             for i in range(1, courses + 1))
+        )
+
+    # Popular courses get most members; creators are members of their courses
+    course_ids = list(range(1, courses + 1))
+    course_weights = zipf_weights(courses)
+    members = {course_id: {(course_id - 1) % staff + 1} for course_id in course_ids}
+    for user_id in range(staff + 1, users + 1):
+        for _ in range(courses_per_student):
+            members[pick(rng, course_ids, course_weights)].add(user_id)
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO enrollments (user_id, course_id) VALUES (?, ?)",
+            ((user_id, course_id) for course_id, ids in members.items() for user_id in ids)
+        )
+
+    # Inside a course, low user ids are the chatty ones
+    member_lists = {course_id: sorted(ids) for course_id, ids in members.items()}
+    member_weights = {course_id: zipf_weights(len(ids)) for course_id, ids in member_lists.items()}
+
+    start = datetime.now() - timedelta(days=365)
+    step = timedelta(days=365) / messages
+
+    def message_rows():
+        for i in range(messages):
+            course_id = pick(rng, course_ids, course_weights)
+            user_id = pick(rng, member_lists[course_id], member_weights[course_id])
+            posted_at = (start + step * i).strftime("%Y-%m-%d %H:%M:%S")
+            yield course_id, user_id, f"Synthetic post {i} about assignment {rng.randint(1, 12)}", posted_at
+
+    rows = message_rows()
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        with conn:
+            conn.executemany(
+                "INSERT INTO messages (course_id, user_id, message, posted_at) VALUES (?, ?, ?, ?)",
+                batch
+            )
+
+    conn.execute("ANALYZE")
+    conn.close()
+    return {"messages": messages, "courses": courses, "users": users, "staff": staff}
+
+
+def summarize(latencies, elapsed):
+    """Percentiles (milliseconds) and throughput for a list of latencies"""
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "samples": len(latencies),
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p99_ms": percentile(0.99),
+        "max_ms": latencies[-1] * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(name, operation, samples):
+    """Run operation() `samples` times and print its summary"""
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(samples):
+        begin = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - begin)
+    result = summarize(latencies, time.perf_counter() - start)
+    print(f"{name:<28} p50={result['p50_ms']:8.3f}ms p99={result['p99_ms']:8.3f}ms "
+          f"{result['ops_per_sec']:10.1f} ops/sec")
+    return result
+
+
+def run_operations(system, scale, samples=DEFAULT_SAMPLES, login_samples=10, seed=11):
+    """Time the main ForumService operations"""
+    rng = random.Random(seed)
+    course_ids = list(range(1, scale["courses"] + 1))
+    course_weights = zipf_weights(scale["courses"])
+    with system.db.reader() as conn:
+        course_members = {}
+        for user_id, course_id in conn.execute("SELECT user_id, course_id FROM enrollments"):
+            course_members.setdefault(course_id, []).append(user_id)
+
+    def busy_course():
+        return pick(rng, course_ids, course_weights)
+
+    def random_student():
+        return rng.randint(scale["staff"] + 1, scale["users"])
+
+    def login():
+        assert system.authenticate(f"user{random_student():07d}", BENCH_PASSWORD)
+
+    def post_message():
+        course_id = busy_course()
+        system.add_message(rng.choice(course_members[course_id]), course_id, "Benchmark post")
+
+    def view_course_messages():
+        system.fetch_message_page(busy_course())
+
+    # Random points deep in course histories, picked before timing starts
+    with system.db.reader() as conn:
+        history_cursors = []
+        for _ in range(samples):
+            course_id = busy_course()
+            row = conn.execute(
+                "SELECT posted_at, id FROM messages WHERE course_id = ? AND id >= ? ORDER BY id LIMIT 1",
+                (course_id, rng.randint(1, scale["messages"]))
+            ).fetchone()
+            history_cursors.append((course_id, tuple(row) if row else None))
+    history = iter(history_cursors)
+
+    def view_course_messages_older():
+        course_id, cursor = next(history)
+        system.fetch_message_page(course_id, before=cursor)
+
+    def view_my_courses():
+        system.course_cache.clear()  # Measure the query, not the cache
+        system.get_my_courses(random_student())
+
+    def view_my_courses_cached():
+        system.get_my_courses(random_student() % 50 + scale["staff"] + 1)
+
+    def join_course_catalog():
+        system.course_catalog(random_student())
+
+    def join_course_catalog_search():
+        # First two pages of a course-code prefix search
+        user_id = random_student()
+        prefix = f"C{rng.randint(1, scale['courses']):06d}"[:5]
+        page = system.course_catalog(user_id, prefix=prefix)
+        if page["next"]:
+            system.course_catalog(user_id, prefix=prefix, after=page["next"])
+
+    with system.db.reader() as conn:
+        course_owner = dict(conn.execute("SELECT id, created_by FROM courses"))
+
+    def delete_my_post():
+        # What the moderation menu does: show the newest page, soft-delete one post
+        course_id = busy_course()
+        messages = system.fetch_message_page(course_id)["messages"]
+        if messages:
+            system.moderate_messages(course_owner[course_id], course_id,
+                                     message_id=rng.choice(messages)[0])
+
+    def moderate_by_author():
+        # Bulk soft-delete everything one member wrote in a course, then undo it
+        course_id = busy_course()
+        action_id, _ = system.moderate_messages(course_owner[course_id], course_id,
+                                                author=f"user{rng.choice(course_members[course_id]):07d}")
+        system.restore_moderation(course_owner[course_id], action_id)
+
+    operations = [
+        ("login", login, login_samples),
+        ("post_message", post_message, samples),
+        ("view_course_messages", view_course_messages, samples),
+        ("view_course_messages_older", view_course_messages_older, samples),
+        ("view_my_courses", view_my_courses, samples),
+        ("view_my_courses_cached", view_my_courses_cached, samples),
+        ("join_course_catalog", join_course_catalog, samples),
+        ("join_course_catalog_search", join_course_catalog_search, samples),
+        ("delete_my_post", delete_my_post, max(1, samples // 10)),
+        ("moderate_by_author", moderate_by_author, max(1, samples // 10)),
+    ]
+    return {name: measure(name, operation, count) for name, operation, count in operations}
+
+
+def benchmark_group_commit(db_path, posts=2000, threads=16, synchronous="FULL"):
+    """Posts/sec from concurrent posters, one commit per post vs group commit
+
+    Runs with synchronous=FULL so each commit really waits for the disk,
+    which is the cost group commit is meant to share.
+    """
+    from service import ForumService
+
+    results = {}
+    for mode in ("commit_per_post", "group_commit"):
+        system = ForumService(db_path, synchronous=synchronous,
+                              write_behind=(mode == "group_commit"))
+        per_thread = posts // threads
+        latencies = []
+        lock = threading.Lock()
+
+        def poster(user_id):
+            mine = []
+            for _ in range(per_thread):
+                begin = time.perf_counter()
+                system.add_message(user_id, 1, "Group commit benchmark post")  # Returns once durable
+                mine.append(time.perf_counter() - begin)
+            with lock:
+                latencies.extend(mine)
+
+        workers = [threading.Thread(target=poster, args=(1,)) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        system.close()
+
+        results[mode] = summarize(latencies, elapsed)
+        print(f"{mode:<28} {results[mode]['ops_per_sec']:10.1f} posts/sec "
+              f"p99={results[mode]['p99_ms']:8.3f}ms ({threads} threads, synchronous={synchronous})")
+
+    return results
+
+
+def check_analytics(db_path, messages=20000, seed=7):
+    """Generate a forum and check the activity rollups against raw aggregates after each change
+
+    Counts the generated posts, posts new ones, tombstones and restores a
+    member's posts, purges tombstones, archives the older half of the year
+    and rebuilds; analytics.verify must find no mismatch at any point.
+    """
+    from service import ForumService
+
+    scale = generate_forum(db_path, messages=messages, seed=seed)
+    rng = random.Random(seed)
+    system = ForumService(db_path)
+    try:
+        with system.db.reader() as conn:
+            course_id, staff_id = conn.execute('''
+                SELECT c.id, c.created_by FROM courses c JOIN messages m ON m.course_id = c.id
+                GROUP BY c.id ORDER BY COUNT(*) DESC LIMIT 1
+            ''').fetchone()
+            members = [row[0] for row in conn.execute(
+                "SELECT user_id FROM enrollments WHERE course_id = ? ORDER BY user_id", (course_id,)
+            )]
+
+        def verify(step):
+            mismatches = system.verify_analytics()
+            assert not mismatches, f"Rollups wrong after {step}: {mismatches[:5]}"
+            print(f"✅ {step}")
+
+        print(f"Counted {system.refresh_analytics():,} of {scale['messages']:,} generated posts")
+        verify("refresh of the generated posts")
+
+        for _ in range(200):
+            system.add_message(rng.choice(members), course_id, "Analytics check post")
+        verify("new posts, before a refresh")
+        system.refresh_analytics()
+        verify("refresh of the new posts")
+
+        action_id, count = system.moderate_messages(staff_id, course_id, author=f"user{members[0]:07d}")
+        verify(f"tombstoning {count} posts of one member")
+        system.restore_moderation(staff_id, action_id)
+        verify("restoring them")
+
+        system.moderate_messages(staff_id, course_id, author=f"user{members[1]:07d}")
+        system.purge_tombstones(timedelta(0))
+        verify("purging tombstones")
+
+        before = (datetime.now() - timedelta(days=180)).strftime("%Y-%m-%d")
+        print(f"Archived {system.archive_messages(before):,} posts")
+        verify("archiving")
+
+        system.rebuild_analytics()
+        verify("a full rebuild")
+    finally:
+        system.close()
+
+
+def git_commit():
+    """Current commit of the source tree, if it is a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(db_path, messages, samples=DEFAULT_SAMPLES, login_samples=10, seed=7,
+                  group_commit=False):
+    """Generate a forum at db_path, benchmark it and return the results"""
+    from service import ForumService
+
+    print(f"Generating {messages:,} messages...")
+    start = time.perf_counter()
+    scale = generate_forum(db_path, messages=messages, seed=seed)
+    generate_seconds = time.perf_counter() - start
+    print(f"Generated {scale} in {generate_seconds:.1f}s\n")
+
+    # Cold start on an up-to-date file: schema check only, no DDL
+    startup = measure("startup", lambda: ForumService(db_path).close(), min(samples, 50))
+
+    system = ForumService(db_path)
+    try:
+        operations = run_operations(system, scale, samples, login_samples)
+    finally:
+        system.close()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": py_platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "scale": scale,
+        "generate_seconds": generate_seconds,
+        "startup": startup,
+        "operations": operations,
+    }
+    if group_commit:
+        print("\nGroup commit:")
+        results["group_commit"] = benchmark_group_commit(db_path)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the course discussion platform")
+    parser.add_argument("--messages", type=int, default=10000,
+                        help="number of synthetic messages (10k - 1M)")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES,
+                        help="timed runs per operation")
+    parser.add_argument("--login-samples", type=int, default=10,
+                        help="timed logins (each one is a full PBKDF2 check)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--db", help="keep the generated database at this path")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--group-commit", action="store_true",
+                        help="also compare posts/sec with and without write-behind group commit")
+    parser.add_argument("--check-analytics", action="store_true",
+                        help="only check the activity rollups against raw aggregates on generated data")
+    args = parser.parse_args(argv)
+
+    if args.check_analytics:
+        with tempfile.TemporaryDirectory() as tmp:
+            check_analytics(os.path.join(tmp, "analytics_forum.db"), args.messages, args.seed)
+        return 0
+
+    if args.db:
+        if os.path.exists(args.db):
+            print(f"❌ {args.db} already exists; choose a new path.")
+            return 1
+        results = run_benchmark(args.db, args.messages, args.samples, args.login_samples,
+                                args.seed, args.group_commit)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run_benchmark(os.path.join(tmp, "bench_forum.db"), args.messages,
+                                    args.samples, args.login_samples, args.seed, args.group_commit)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# catalog.py - Group 7
+"""Course catalog for students looking for courses to join
+
+Courses are listed in code or name order, optionally narrowed to a
+prefix, one page at a time. Every part of the query is answered from an
+index:
+- the prefix becomes a range on a NOCASE index (idx_courses_code_nocase
+  or idx_courses_name_nocase), so 'soe' finds 'SOE505' without a scan
+- pages seek to a (sort key, id) cursor instead of skipping an OFFSET
+- "not joined yet" is a NOT EXISTS probe into the enrollments primary key
+
+check_plans() runs EXPLAIN QUERY PLAN over every variant and reports
+any full-table scan or temporary sort.
+"""
+
+CATALOG_PAGE_SIZE = 20
+SORT_COLUMNS = {"code": "course_code", "name": "course_name"}
+
+# Larger than any character a course code or name can contain
+_MAX_CHAR = "\U0010ffff"
+
+
+def catalog_query(user_id, prefix="", by="code", after=None, page_size=CATALOG_PAGE_SIZE):
+    """Build (sql, params) for one catalog page
+
+    Rows are (id, course_code, course_name, creator, message_count,
+    member_count, last_posted_at).
+    """
+    if by not in SORT_COLUMNS:
+        raise ValueError(f"by must be one of {', '.join(SORT_COLUMNS)}")
+    column = f"c.{SORT_COLUMNS[by]} COLLATE NOCASE"
+
+    conditions, params = [], []
+    if after is not None:
+        # Seek to the cursor, then skip rows with the same key it already covered.
+        # (A row value (key, id) > (?, ?) would not be used as an index bound.)
+        conditions.append(f"{column} >= ? AND NOT ({column} = ? AND c.id <= ?)")
+        params += [after[0], after[0], after[1]]
+    elif prefix:
+        conditions.append(f"{column} >= ?")
+        params.append(prefix)
+    if prefix:
+        # Everything that starts with the prefix sorts below prefix + max char
+        conditions.append(f"{column} < ?")
+        params.append(prefix + _MAX_CHAR)
+    conditions.append('''NOT EXISTS (
+            SELECT 1 FROM enrollments e WHERE e.user_id = ? AND e.course_id = c.id
+        )''')
+    params.append(user_id)
+
+    sql = f'''
+        SELECT c.id, c.course_code, c.course_name, u.username,
+               s.message_count, s.member_count, s.last_posted_at
+        FROM courses c
+        JOIN users u ON c.created_by = u.id
+        LEFT JOIN course_stats s ON s.course_id = c.id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY {column}, c.id
+        LIMIT ?
+    '''
+    return sql, params + [page_size + 1]
+
+
+def fetch_page(conn, user_id, prefix="", by="code", after=None, page_size=CATALOG_PAGE_SIZE):
+    """One catalog page: {"courses": rows, "next": cursor or None}"""
+    sql, params = catalog_query(user_id, prefix, by, after, page_size)
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = (last[1] if by == "code" else last[2], last[0])
+    return {"courses": rows, "next": next_cursor}
+
+
+def check_plans(conn):
+    """EXPLAIN QUERY PLAN every catalog variant, return a list of problems
+
+    A problem is a scan of courses other than walking the sort index from
+    the start, a scan of enrollments, a temporary B-tree for the ORDER BY,
+    or a prefix/cursor that is not used as an index bound.
+    """
+    problems = []
+    for by in SORT_COLUMNS:
+        index = f"idx_courses_{by}_nocase"
+        for prefix in ("", "SOE"):
+            for after in (None, ("SOE505", 1)):
+                sql, params = catalog_query(1, prefix, by, after)
+                plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+                label = f"catalog by={by} prefix={prefix!r} after={after}"
+                for step in plan:
+                    walks_sort_index = step.startswith("SCAN c") and index in step
+                    if step.startswith(("SCAN c", "SCAN e")) and not walks_sort_index or "TEMP B-TREE" in step:
+                        problems.append(f"{label}: {step}")
+                if (prefix or after) and not any(step.startswith("SEARCH c") and index in step for step in plan):
+                    problems.append(f"{label}: no index range on courses: {plan}")
+                if not any("enrollments USING" in step and "PRIMARY KEY" in step
+                           or "sqlite_autoindex_enrollments_1" in step for step in plan):
+                    problems.append(f"{label}: enrollments not probed by primary key: {plan}")
+    return problems
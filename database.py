@@ -0,0 +1,226 @@
+# database.py - Group 7
+"""Connection management for the course forum database
+
+SQLite allows many readers but only one writer at a time. The
+ConnectionManager puts the database in WAL mode so readers never wait for
+the writer, hands out read-only connections from a small pool for SELECT
+paths, and serializes every write through a single writer connection.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+class ConnectionManager:
+    def __init__(self, path="course_forum.db", read_pool_size=4,
+                 busy_timeout=5000, synchronous="NORMAL",
+                 connection_factory=sqlite3.Connection, on_connect=None):
+        """Open the writer connection and prepare the reader pool
+
+        busy_timeout is in milliseconds. synchronous is one of
+        OFF, NORMAL, FULL or EXTRA; NORMAL is safe in WAL mode and only
+        gives up durability of the last commits on power loss.
+        connection_factory and on_connect(conn) let instrumentation
+        hook into every connection that is opened.
+        """
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_LEVELS:
+            raise ValueError(f"synchronous must be one of {', '.join(SYNCHRONOUS_LEVELS)}")
+
+        self.path = path
+        self.busy_timeout = int(busy_timeout)
+        self.synchronous = synchronous
+        self.in_memory = path == ":memory:"
+        self.connection_factory = connection_factory
+        self.on_connect = on_connect
+
+        # One writer, shared by every thread but used by one at a time
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self.writer_conn = self._connect(path)
+        if not self.in_memory:
+            self.writer_conn.execute("PRAGMA journal_mode = WAL")
+        self.writer_conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+
+        # Readers are opened lazily, after migrations have created the file
+        self.read_pool_size = 0 if self.in_memory else read_pool_size
+        self._readers = queue.Queue()
+        self._all_readers = []
+        self._pool_lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self, database, uri=False):
+        """Open a connection with our standard settings"""
+        conn = sqlite3.connect(database, uri=uri, check_same_thread=False,
+                               timeout=self.busy_timeout / 1000,
+                               factory=self.connection_factory)
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout}")
+        conn.execute("PRAGMA foreign_keys = ON")
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def _open_reader(self):
+        """Open a new read-only connection to the database file"""
+        conn = self._connect(f"file:{self.path}?mode=ro", uri=True)
+        self._all_readers.append(conn)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection for SELECT statements"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection manager is closed")
+
+        # In-memory databases cannot be shared, so reads use the writer
+        if self.read_pool_size == 0:
+            with self._write_lock:
+                yield self.writer_conn
+            return
+
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                conn = self._open_reader() if len(self._all_readers) < self.read_pool_size else None
+            if conn is None:
+                conn = self._readers.get()  # Pool is full: wait for a free reader
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()  # Never hand back a connection holding a snapshot
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """Hold the writer connection; commit on success, roll back on error
+
+        Nested use from the same thread joins the outer transaction.
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection manager is closed")
+
+        with self._write_lock:
+            self._write_depth += 1
+            try:
+                yield self.writer_conn
+                if self._write_depth == 1:
+                    self.writer_conn.commit()
+            except BaseException:
+                if self._write_depth == 1:
+                    self.writer_conn.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+
+    def close(self):
+        """Close every connection"""
+        if self._closed:
+            return
+        self._closed = True
+        with self._pool_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+        with self._write_lock:
+            self.writer_conn.close()
+
+
+def stress_test(path, readers=8, seconds=5.0, batch=20):
+    """Check that readers keep running while posts are being written
+
+    One thread inserts messages in small transactions while `readers`
+    threads read the newest page of the course over and over. Prints the
+    counts and read latencies and raises AssertionError if any reader
+    saw 'database is locked' or was starved while writes were going on.
+    """
+    import migrations
+
+    manager = ConnectionManager(path, read_pool_size=readers)
+    with manager.writer() as conn:
+        migrations.migrate(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO users (username, password_hash, role, full_name) VALUES (?, ?, ?, ?)",
+            ("stress_user", "x", "staff", "Stress Test")
+        )
+        user_id = conn.execute("SELECT id FROM users WHERE username = 'stress_user'").fetchone()[0]
+        conn.execute(
+            "INSERT OR IGNORE INTO courses (course_code, course_name, created_by) VALUES (?, ?, ?)",
+            ("STRESS1", "Stress Test Course", user_id)
+        )
+        course_id = conn.execute("SELECT id FROM courses WHERE course_code = 'STRESS1'").fetchone()[0]
+
+    stop = threading.Event()
+    errors = []
+    writes = [0]
+    read_times = []
+    read_lock = threading.Lock()
+
+    def write_loop():
+        try:
+            while not stop.is_set():
+                with manager.writer() as conn:
+                    conn.executemany(
+                        "INSERT INTO messages (course_id, user_id, message) VALUES (?, ?, ?)",
+                        [(course_id, user_id, "stress message")] * batch
+                    )
+                writes[0] += 1
+        except sqlite3.Error as exc:
+            errors.append(f"writer: {exc}")
+
+    def read_loop():
+        times = []
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                with manager.reader() as conn:
+                    conn.execute('''
+                        SELECT m.id, m.message, u.username, m.posted_at
+                        FROM messages m
+                        JOIN users u ON m.user_id = u.id
+                        WHERE m.course_id = ?
+                        ORDER BY m.posted_at DESC, m.id DESC
+                        LIMIT 20
+                    ''', (course_id,)).fetchall()
+                times.append(time.perf_counter() - start)
+        except sqlite3.Error as exc:
+            errors.append(f"reader: {exc}")
+        with read_lock:
+            read_times.extend(times)
+
+    threads = [threading.Thread(target=write_loop)]
+    threads += [threading.Thread(target=read_loop) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    manager.close()
+
+    read_times.sort()
+    p99 = read_times[int(len(read_times) * 0.99) - 1] if read_times else 0.0
+    print(f"Write transactions: {writes[0]} ({writes[0] * batch} messages)")
+    print(f"Reads: {len(read_times)} across {readers} readers")
+    if read_times:
+        print(f"Read latency p50={read_times[len(read_times) // 2] * 1000:.2f}ms "
+              f"p99={p99 * 1000:.2f}ms max={read_times[-1] * 1000:.2f}ms")
+
+    assert not errors, f"Errors during stress test: {errors}"
+    assert writes[0] > 0, "Writer made no progress"
+    assert len(read_times) >= readers, "Readers were starved by the writer"
+    print("✅ Readers were not blocked by concurrent writes.")
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stress_test(os.path.join(tmp, "stress_forum.db"))
@@ -0,0 +1,217 @@
+# export.py - Group 7
+"""Streaming export of course transcripts
+
+Each course is written to its own file as JSONL or CSV, optionally
+gzip-compressed (the format follows the file name: .jsonl, .csv, and an
+extra .gz). Rows are read with fetchmany in chunks of `chunk_size` and
+written straight out, so memory stays flat however large the course is.
+Several courses can be exported in parallel, each on its own read-only
+connection from the pool.
+
+Incremental mode only writes messages with an id above the high-water
+mark recorded in export_state by the previous export of that course.
+The mark is only moved once the file is complete, so an interrupted
+export is simply repeated.
+
+Usage:
+    python export.py SOE505 CS101 [--out-dir exports] [--format csv] [--gzip] [--incremental]
+    python export.py --all --workers 4
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import migrations
+from archive import Archiver, default_archive_path
+from database import ConnectionManager
+
+DEFAULT_CHUNK_SIZE = 1000
+FORMATS = ("jsonl", "csv")
+COLUMNS = ("message_id", "course_code", "username", "full_name", "posted_at", "message")
+
+# Full transcript: oldest first, straight off idx_messages_course_posted
+_TRANSCRIPT_SQL = '''
+    SELECT m.id, ?, u.username, u.full_name, m.posted_at, m.message
+    FROM {table} m
+    JOIN users u ON m.user_id = u.id
+    WHERE m.course_id = ? {extra}
+    ORDER BY m.posted_at, m.id
+'''
+
+# Incremental: walk the primary key from the high-water mark; the unary +
+# keeps the planner off the course index, which would need a sort by id
+_INCREMENTAL_SQL = '''
+    SELECT m.id, ?, u.username, u.full_name, m.posted_at, m.message
+    FROM {table} m
+    JOIN users u ON m.user_id = u.id
+    WHERE m.id > ? AND +m.course_id = ? {extra}
+    ORDER BY m.id
+'''
+
+
+def open_output(path, compress=False):
+    """Open a text file for writing, gzip-compressed if asked to"""
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def output_path(out_dir, course_code, fmt, compress, incremental):
+    """exports/SOE505.jsonl.gz, or SOE505.<timestamp>.jsonl for increments"""
+    stamp = time.strftime(".%Y%m%d%H%M%S") if incremental else ""
+    return os.path.join(out_dir, f"{course_code}{stamp}.{fmt}" + (".gz" if compress else ""))
+
+
+class Exporter:
+    def __init__(self, db, archiver=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """`db` is a ConnectionManager; archived messages are included when an Archiver is given"""
+        self.db = db
+        self.archiver = archiver
+        self.chunk_size = chunk_size
+
+    def course_ids(self, course_codes=None):
+        """{course_code: course_id} for the given codes (or every course)"""
+        with self.db.reader() as conn:
+            rows = conn.execute("SELECT course_code, id FROM courses ORDER BY course_code").fetchall()
+        found = dict(rows)
+        if course_codes is None:
+            return found
+        missing = [code for code in course_codes if code not in found]
+        if missing:
+            raise ValueError(f"Unknown course code(s): {', '.join(missing)}")
+        return {code: found[code] for code in course_codes}
+
+    def high_water_mark(self, course_id):
+        """Last message id written by a previous export of the course (0 if none)"""
+        with self.db.reader() as conn:
+            row = conn.execute(
+                "SELECT last_message_id FROM export_state WHERE course_id = ?", (course_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def _record_high_water_mark(self, course_id, last_message_id):
+        with self.db.writer() as conn:
+            conn.execute('''
+                INSERT INTO export_state (course_id, last_message_id) VALUES (?, ?)
+                ON CONFLICT (course_id) DO UPDATE SET
+                    last_message_id = MAX(last_message_id, excluded.last_message_id),
+                    exported_at = CURRENT_TIMESTAMP
+            ''', (course_id, last_message_id))
+
+    def _stream(self, conn, course_code, course_id, since):
+        """Yield chunks of rows: archived messages first, then live ones"""
+        queries = []
+        with_archive = self.archiver is not None and self.archiver.attach_reader(conn)
+        if with_archive:
+            queries.append(("archive.messages", ""))
+        # A batch caught between copy and delete exists in both files: skip the live copy
+        live = "AND m.deleted_at IS NULL"
+        if with_archive:
+            live += " AND m.id NOT IN (SELECT id FROM archive.messages)"
+        queries.append(("main.messages", live))
+
+        for table, extra in queries:
+            if since is None:
+                sql, params = _TRANSCRIPT_SQL, (course_code, course_id)
+            else:
+                sql, params = _INCREMENTAL_SQL, (course_code, since, course_id)
+            cursor = conn.execute(sql.format(table=table, extra=extra), params)
+            while True:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    def export_course(self, course_code, course_id, path, incremental=False):
+        """Write one course to `path`, return (rows written, highest message id)"""
+        fmt = "csv" if path.removesuffix(".gz").endswith(".csv") else "jsonl"
+        since = self.high_water_mark(course_id) if incremental else None
+
+        count, last_id = 0, since or 0
+        tmp_path = f"{path}.tmp"
+        with self.db.reader() as conn, open_output(tmp_path, compress=path.endswith(".gz")) as f:
+            writer = csv.writer(f) if fmt == "csv" else None
+            if writer is not None:
+                writer.writerow(COLUMNS)
+            for rows in self._stream(conn, course_code, course_id, since):
+                if writer is not None:
+                    writer.writerows(rows)
+                else:
+                    f.writelines(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n"
+                                 for row in rows)
+                count += len(rows)
+                last_id = max(last_id, max(row[0] for row in rows))
+        os.replace(tmp_path, path)  # Never leave a half-written transcript under the real name
+
+        if incremental and last_id:
+            self._record_high_water_mark(course_id, last_id)
+        return count, last_id
+
+    def export_courses(self, course_codes=None, out_dir="exports", fmt="jsonl", compress=False,
+                       incremental=False, workers=None):
+        """Export several courses in parallel, print and return {course_code: rows}"""
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        courses = self.course_ids(course_codes)
+        os.makedirs(out_dir, exist_ok=True)
+
+        # One reader connection per worker; more threads would only queue for the pool
+        workers = workers or max(1, self.db.read_pool_size)
+        start = time.perf_counter()
+
+        def run(item):
+            course_code, course_id = item
+            path = output_path(out_dir, course_code, fmt, compress, incremental)
+            count, _ = self.export_course(course_code, course_id, path, incremental)
+            return course_code, count, path
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for course_code, count, path in pool.map(run, courses.items()):
+                results[course_code] = count
+                print(f"  {course_code}: {count} messages -> {path}")
+
+        seconds = time.perf_counter() - start
+        total = sum(results.values())
+        print(f"✅ Exported {total} messages from {len(results)} courses in {seconds:.2f}s")
+        return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export course transcripts")
+    parser.add_argument("courses", nargs="*", help="course codes to export")
+    parser.add_argument("--all", action="store_true", help="export every course")
+    parser.add_argument("--db", default="course_forum.db")
+    parser.add_argument("--out-dir", default="exports")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--gzip", action="store_true", help="compress the output files")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only messages newer than the previous export of each course")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    if not args.courses and not args.all:
+        parser.error("give course codes or --all")
+
+    db = ConnectionManager(args.db, read_pool_size=args.workers or 4)
+    try:
+        with db.writer() as conn:
+            migrations.migrate(conn)
+        exporter = Exporter(db, Archiver(db, default_archive_path(args.db)), chunk_size=args.chunk_size)
+        exporter.export_courses(None if args.all else args.courses, args.out_dir, args.format,
+                                args.gzip, args.incremental, args.workers)
+    except (OSError, ValueError) as exc:
+        print(f"❌ Export failed: {exc}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# feed.py - Group 7
+"""Change feed of new and deleted messages
+
+Triggers (see migrations.py) append one row to message_events for every
+post, soft delete and restore. A client keeps the `seq` of the last event
+it has seen and asks only for events after it in the courses it is
+enrolled in, instead of reloading whole courses.
+
+ChangeNotifier is an in-process publish/subscribe point: the platform
+publishes the affected course ids right after a commit, and clients
+blocked in wait() wake immediately instead of polling on a timer (an
+event loop registers a callback with subscribe() instead). Writes
+made by other processes are not published, so waiters still re-check
+when their timeout runs out.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+FEED_LIMIT = 100
+DEFAULT_WAIT_SECONDS = 30
+# Events are kept this long; a client that was away longer reloads the course
+DEFAULT_EVENT_RETENTION = timedelta(days=30)
+
+
+class ChangeNotifier:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._version = 0
+        self._course_versions = {}  # course_id -> version of its last change
+        self._subscribers = []
+
+    @property
+    def version(self):
+        with self._condition:
+            return self._version
+
+    def publish(self, course_ids):
+        """Announce that these courses have new events (call after commit)"""
+        with self._condition:
+            self._version += 1
+            for course_id in course_ids:
+                self._course_versions[course_id] = self._version
+            self._condition.notify_all()
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(course_ids)
+
+    def subscribe(self, callback):
+        """Call callback(course_ids) after every publish, on the publishing thread"""
+        with self._condition:
+            self._subscribers.append(callback)
+
+    def changed(self, course_ids, since_version):
+        """True if one of the courses changed after `since_version`, without waiting"""
+        with self._condition:
+            return self._changed(course_ids, since_version)
+
+    def _changed(self, course_ids, since_version):
+        return any(self._course_versions.get(course_id, 0) > since_version
+                   for course_id in course_ids)
+
+    def wait(self, course_ids, since_version, timeout=DEFAULT_WAIT_SECONDS):
+        """Block until one of the courses changes after `since_version` or the timeout
+
+        Returns True if there was a change. Taking `version` before
+        querying and passing it here means a change made in between is
+        never missed.
+        """
+        course_ids = set(course_ids)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not self._changed(course_ids, since_version):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+
+def head(conn):
+    """seq of the newest event, where a new client starts"""
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM message_events").fetchone()[0]
+
+
+def fetch_events(conn, user_id, cursor, limit=FEED_LIMIT, course_ids=None):
+    """Events after `cursor` in the user's courses, oldest first
+
+    Each event is (seq, kind, course_id, message_id, username, message,
+    posted_at) where kind is 'post', 'delete' or 'restore'. The message
+    columns are None for deletes and for posts removed since.
+    """
+    course_filter, params = "", [cursor, user_id]
+    if course_ids is not None:
+        course_filter = f"AND e.course_id IN ({', '.join('?' * len(course_ids))})"
+        params += list(course_ids)
+
+    # One (course_id, seq) index range per enrolled course
+    return conn.execute(f'''
+        SELECT ev.seq, ev.kind, ev.course_id, ev.message_id, u.username, m.message, m.posted_at
+        FROM enrollments e
+        JOIN message_events ev ON ev.course_id = e.course_id AND ev.seq > ?
+        LEFT JOIN messages m ON m.id = ev.message_id AND ev.kind != 'delete' AND m.deleted_at IS NULL
+        LEFT JOIN users u ON u.id = m.user_id
+        WHERE e.user_id = ? {course_filter}
+        ORDER BY ev.seq
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+
+
+def prune(db, older_than=DEFAULT_EVENT_RETENTION):
+    """Drop events older than the retention period, return how many"""
+    cutoff = (datetime.now(timezone.utc) - older_than).strftime("%Y-%m-%d %H:%M:%S")
+    with db.writer() as conn:
+        return conn.execute("DELETE FROM message_events WHERE created_at < ?", (cutoff,)).rowcount
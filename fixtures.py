@@ -0,0 +1,220 @@
+# fixtures.py - Group 7
+"""Demo and test databases built once, then cloned with the backup API
+
+Seeding a forum is slow: the demo accounts need two PBKDF2 hashes
+(~100 ms each) and a synthetic forum of 100k messages takes seconds to
+generate. A fixture is built once per schema version and scale, kept in
+FIXTURE_DIR, and copied page by page into a new database file or a
+:memory: database with sqlite3's Connection.backup(), which takes
+milliseconds.
+
+Every fixture holds the demo data (see seed_demo); scaled ones add a
+synthetic forum from benchmark.generate_forum, whose scale is stored
+next to the file as JSON.
+
+Usage:
+    python fixtures.py build [--messages 100000] [--seed 7]
+    python fixtures.py clone new_forum.db [--messages 100000] [--seed 7]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import migrations
+from benchmark import generate_forum
+from service import ForumService
+
+FIXTURE_DIR = os.environ.get("COURSE_FORUM_FIXTURES",
+                             os.path.join(tempfile.gettempdir(), "course_forum_fixtures"))
+
+# (username, password, full name, role)
+DEMO_USERS = [
+    ("prof_smith", "staff123", "Professor Smith", "staff"),
+    ("student_john", "student123", "John Doe", "student"),
+]
+DEMO_COURSE = ("SOE505", "Software Engineering Security")
+# (index into DEMO_USERS, message, index of the demo message it replies to or None)
+DEMO_MESSAGES = [
+    (0, "Welcome to SOE505! This week we'll cover secure coding.", None),
+    (1, "Hello Professor! When is Assignment 1 due?", None),
+    (0, "Assignment 1 is due next Friday. Check the syllabus.", 1),
+    (1, "Thank you! I'll start working on it.", 2),
+]
+
+
+def _demo_user_ids(service):
+    """{username: id} of the demo accounts that exist"""
+    usernames = [user[0] for user in DEMO_USERS]
+    with service.db.reader() as conn:
+        return dict(conn.execute(
+            f"SELECT username, id FROM users WHERE username IN ({', '.join('?' * len(usernames))})",
+            usernames
+        ))
+
+
+def demo_present(service):
+    """True if the demo accounts and course exist and both accounts are enrolled"""
+    user_ids = _demo_user_ids(service)
+    if len(user_ids) < len(DEMO_USERS):
+        return False
+    try:
+        course_id = service.course_ids_by_code([DEMO_COURSE[0]])[0]
+    except LookupError:
+        return False
+    return all(service.is_enrolled(user_id, course_id) for user_id in user_ids.values())
+
+
+def seed_demo(service, report=None):
+    """Create whatever part of the demo data is missing
+
+    Only new accounts are hashed, and the demo posts are only added
+    together with the course, so running this again adds nothing.
+    report(text) is called with a line per step.
+    """
+    report = report or (lambda text: None)
+
+    report("1. Creating demo users...")
+    existing = _demo_user_ids(service)
+    missing = [user for user in DEMO_USERS if user[0] not in existing]
+    # Hash the new passwords in parallel before taking the writer
+    hashes = service.hasher.hash_many([password for _, password, _, _ in missing])
+    with service.db.writer() as conn:
+        for (username, _, full_name, role), password_hash in zip(missing, hashes):
+            conn.execute(
+                "INSERT OR IGNORE INTO users (username, password_hash, role, full_name) VALUES (?, ?, ?, ?)",
+                (username, password_hash, role, full_name)
+            )
+    user_ids = _demo_user_ids(service)
+    user_ids = [user_ids[user[0]] for user in DEMO_USERS]
+
+    report("2. Creating demo course...")
+    try:
+        course_id = service.add_course(user_ids[0], *DEMO_COURSE)
+        new_course = True
+    except sqlite3.IntegrityError:
+        course_id = service.course_ids_by_code([DEMO_COURSE[0]])[0]
+        new_course = False
+
+    report("3. Enrolling users in course...")
+    for user_id in user_ids:
+        if not service.is_enrolled(user_id, course_id):
+            service.enroll(user_id, course_id)
+
+    if new_course:
+        report("4. Adding demo messages...")
+        message_ids = []
+        for author, message, reply_to in DEMO_MESSAGES:
+            parent_id = None if reply_to is None else message_ids[reply_to]
+            message_ids.append(service.add_message(user_ids[author], course_id, message, parent_id))
+
+
+def fixture_path(messages=0, seed=7, directory=FIXTURE_DIR):
+    """Where the fixture for a scale lives; the schema version is part of the name"""
+    name = f"forum-{messages}-seed{seed}" if messages else "demo"
+    return os.path.join(directory, f"{name}-v{migrations.LATEST_VERSION}.db")
+
+
+def ensure_fixture(messages=0, seed=7, directory=FIXTURE_DIR):
+    """Build a fixture unless it exists, return (path, scale)
+
+    messages=0 is the demo data alone. The file is built under a
+    temporary name and renamed when complete, so a crash or a
+    concurrent build never leaves a half-built fixture behind.
+    """
+    path = fixture_path(messages, seed, directory)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        for leftover in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+        scale = {"messages": 0}
+        if messages:
+            scale = generate_forum(tmp_path, messages=messages, seed=seed)
+        service = ForumService(tmp_path)
+        try:
+            seed_demo(service)
+        finally:
+            service.close()
+
+        # Fold the WAL back in so the fixture is one self-contained file
+        conn = sqlite3.connect(tmp_path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+        with open(tmp_path + ".json", "w", encoding="utf-8") as f:
+            json.dump(scale, f)
+        os.replace(tmp_path + ".json", path + ".json")
+        os.replace(tmp_path, path)
+
+    with open(path + ".json", encoding="utf-8") as f:
+        return path, json.load(f)
+
+
+def clone(fixture, target):
+    """Copy a fixture into `target` with the backup API, return the seconds it took
+
+    `target` is the path of a database that does not exist yet, or an
+    open sqlite3 connection (e.g. to :memory:) whose contents are
+    replaced.
+    """
+    start = time.perf_counter()
+    source = sqlite3.connect(f"file:{fixture}?mode=ro", uri=True)
+    try:
+        if isinstance(target, sqlite3.Connection):
+            source.backup(target)
+        else:
+            if os.path.exists(target):
+                raise FileExistsError(f"{target} already exists")
+            destination = sqlite3.connect(target)
+            try:
+                source.backup(destination)
+            finally:
+                destination.close()
+    finally:
+        source.close()
+    return time.perf_counter() - start
+
+
+def open_service(messages=0, seed=7, db_path=":memory:", service_class=ForumService, **options):
+    """A service on a fresh copy of a fixture, in memory unless db_path is given"""
+    fixture, _ = ensure_fixture(messages, seed)
+    if db_path != ":memory:":
+        clone(fixture, db_path)
+        return service_class(db_path, **options)
+
+    service = service_class(db_path, **options)
+    with service.db.writer() as conn:
+        clone(fixture, conn)
+    return service
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and clone demo/test databases")
+    parser.add_argument("command", choices=["build", "clone"])
+    parser.add_argument("target", nargs="?", help="clone: new database file")
+    parser.add_argument("--messages", type=int, default=0, help="synthetic messages (0 = demo data only)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    path, scale = ensure_fixture(args.messages, args.seed)
+    print(f"Fixture {path} ({scale}) ready in {time.perf_counter() - start:.2f}s")
+    if args.command == "clone":
+        if not args.target:
+            parser.error("clone needs a target database file")
+        try:
+            seconds = clone(path, args.target)
+        except FileExistsError as exc:
+            print(f"❌ {exc}.")
+            return 1
+        print(f"✅ Cloned into {args.target} in {seconds * 1000:.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
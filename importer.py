@@ -0,0 +1,232 @@
+# importer.py - Group 7
+"""Bulk import of users, courses, enrollments and messages
+
+Files are streamed row by row (CSV with a header line, or JSONL with one
+object per line) and written with executemany in transactions of at most
+`batch_size` rows, so memory does not grow with the file. Usernames and
+course codes are resolved through in-memory maps loaded once per import
+instead of one SELECT per row.
+
+Expected columns:
+    users        username, password, full_name, role
+    courses      course_code, course_name, created_by (a username)
+    enrollments  username, course_code
+    messages     course_code, username, message, posted_at (optional)
+
+Usage:
+    python importer.py users roster.csv [--db course_forum.db] [--batch-size 1000]
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from itertools import islice
+
+import migrations
+from database import ConnectionManager
+from passwords import PasswordHasher
+
+DEFAULT_BATCH_SIZE = 1000
+KINDS = ("users", "courses", "enrollments", "messages")
+
+
+def read_rows(path):
+    """Yield one dict per record from a .csv or .jsonl file"""
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+    elif path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise ValueError(f"Unsupported file type: {path} (use .csv or .jsonl)")
+
+
+def batches(rows, size):
+    """Group an iterator into lists of at most `size` items"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Importer:
+    def __init__(self, db, hasher, batch_size=DEFAULT_BATCH_SIZE):
+        """`db` is a ConnectionManager, `hasher` a PasswordHasher"""
+        self.db = db
+        self.hasher = hasher
+        self.batch_size = batch_size
+
+    def _load_map(self, sql):
+        """Build a {name: id} map with a single query"""
+        with self.db.reader() as conn:
+            return {name: row_id for row_id, name in conn.execute(sql)}
+
+    def _user_ids(self):
+        return self._load_map("SELECT id, username FROM users")
+
+    def _course_ids(self):
+        return self._load_map("SELECT id, course_code FROM courses")
+
+    def import_file(self, kind, path):
+        """Import one file, print and return the stats"""
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+
+        before = self._count(kind)
+        start = time.perf_counter()
+        stats = getattr(self, f"_import_{kind}")(read_rows(path))
+        stats["seconds"] = time.perf_counter() - start
+        stats["rows_per_sec"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+
+        print(f"✅ Imported {kind}: {stats['inserted']} of {stats['rows']} rows "
+              f"({stats['skipped']} skipped) in {stats['seconds']:.2f}s "
+              f"= {stats['rows_per_sec']:.0f} rows/sec")
+        # The report must match the table (other writers running at the same time also show up here)
+        added = self._count(kind) - before
+        if added != stats["inserted"]:
+            print(f"❌ {kind} grew by {added} rows but {stats['inserted']} were reported")
+        return stats
+
+    def _count(self, table):
+        with self.db.reader() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _write_batch(self, sql, params):
+        """Insert a batch in one transaction, return how many rows were added"""
+        with self.db.writer() as conn:
+            # rowcount sums each statement's own changes; total_changes would add the trigger writes
+            return conn.executemany(sql, params).rowcount
+
+    def _import_users(self, rows):
+        stats = {"rows": 0, "inserted": 0, "skipped": 0}
+        for batch in batches(rows, self.batch_size):
+            stats["rows"] += len(batch)
+            valid = [row for row in batch
+                     if row.get("username") and row.get("password")
+                     and row.get("role") in ("staff", "student")]
+            stats["skipped"] += len(batch) - len(valid)
+
+            # Hash the whole batch in parallel before taking the writer
+            hashes = self.hasher.hash_many([row["password"] for row in valid])
+            params = [(row["username"], password_hash, row["role"],
+                       row.get("full_name") or row["username"])
+                      for row, password_hash in zip(valid, hashes)]
+
+            inserted = self._write_batch(
+                "INSERT OR IGNORE INTO users (username, password_hash, role, full_name) VALUES (?, ?, ?, ?)",
+                params
+            )
+            stats["inserted"] += inserted
+            stats["skipped"] += len(params) - inserted  # Existing usernames
+        return stats
+
+    def _import_courses(self, rows):
+        stats = {"rows": 0, "inserted": 0, "skipped": 0}
+        user_ids = self._user_ids()
+        for batch in batches(rows, self.batch_size):
+            stats["rows"] += len(batch)
+            params = []
+            for row in batch:
+                creator = user_ids.get(row.get("created_by"))
+                if creator is None or not row.get("course_code"):
+                    stats["skipped"] += 1
+                    continue
+                params.append((row["course_code"], row.get("course_name") or row["course_code"], creator))
+
+            with self.db.writer() as conn:
+                inserted = conn.executemany(
+                    "INSERT OR IGNORE INTO courses (course_code, course_name, created_by) VALUES (?, ?, ?)",
+                    params
+                ).rowcount
+                # Creators are enrolled in their own courses, like create_course does
+                conn.executemany('''
+                    INSERT OR IGNORE INTO enrollments (user_id, course_id)
+                    SELECT created_by, id FROM courses WHERE course_code = ?
+                ''', [(code,) for code, _, _ in params])
+
+            stats["inserted"] += inserted
+            stats["skipped"] += len(params) - inserted
+        return stats
+
+    def _import_enrollments(self, rows):
+        stats = {"rows": 0, "inserted": 0, "skipped": 0}
+        user_ids = self._user_ids()
+        course_ids = self._course_ids()
+        for batch in batches(rows, self.batch_size):
+            stats["rows"] += len(batch)
+            params = []
+            for row in batch:
+                user_id = user_ids.get(row.get("username"))
+                course_id = course_ids.get(row.get("course_code"))
+                if user_id is None or course_id is None:
+                    stats["skipped"] += 1
+                    continue
+                params.append((user_id, course_id))
+
+            inserted = self._write_batch(
+                "INSERT OR IGNORE INTO enrollments (user_id, course_id) VALUES (?, ?)",
+                params
+            )
+            stats["inserted"] += inserted
+            stats["skipped"] += len(params) - inserted
+        return stats
+
+    def _import_messages(self, rows):
+        stats = {"rows": 0, "inserted": 0, "skipped": 0}
+        user_ids = self._user_ids()
+        course_ids = self._course_ids()
+        for batch in batches(rows, self.batch_size):
+            stats["rows"] += len(batch)
+            params = []
+            for row in batch:
+                user_id = user_ids.get(row.get("username"))
+                course_id = course_ids.get(row.get("course_code"))
+                if user_id is None or course_id is None or not row.get("message"):
+                    stats["skipped"] += 1
+                    continue
+                params.append((course_id, user_id, row["message"], row.get("posted_at") or None))
+
+            stats["inserted"] += self._write_batch(
+                '''
+                INSERT INTO messages (course_id, user_id, message, posted_at)
+                VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                ''',
+                params
+            )
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import into the course forum database")
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("path", help=".csv or .jsonl file")
+    parser.add_argument("--db", default="course_forum.db")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--hash-workers", type=int, default=None)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")  # Migration progress
+
+    db = ConnectionManager(args.db)
+    hasher = PasswordHasher(workers=args.hash_workers)
+    try:
+        with db.writer() as conn:
+            migrations.migrate(conn)
+        Importer(db, hasher, batch_size=args.batch_size).import_file(args.kind, args.path)
+    except (OSError, ValueError) as exc:
+        print(f"❌ Import failed: {exc}")
+        return 1
+    finally:
+        hasher.close()
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+# loadtest.py - Group 7
+"""Load test for api_server.py with hundreds of concurrent simulated users
+
+Every simulated user keeps one keep-alive connection, logs in once and
+then loops over a weighted mix of what people do on the forum (read a
+course page, post, check the feed, browse the catalog, search), with an
+exponential think time between requests. Logins are measured first and
+separately, because each is a full PBKDF2 check; the timed phase then
+reports requests/sec and latency percentiles per operation.
+
+With no --url a throw-away copy of a generated forum (see fixtures.py)
+is made and an api_server.py process is started on it, so the client
+and the server do not share a GIL.
+
+Usage:
+    python loadtest.py --users 300 --duration 30 [--messages 100000] [--write-behind]
+    python loadtest.py --url http://127.0.0.1:8080 --users 200 --accounts 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+from benchmark import BENCH_PASSWORD, summarize
+from fixtures import clone, ensure_fixture
+
+DEFAULT_USERS = 200
+DEFAULT_DURATION = 30
+DEFAULT_THINK_MS = 100
+
+# Operation -> relative weight in the steady-state mix
+MIX = {
+    "view_messages": 45,
+    "older_page": 10,
+    "feed": 15,
+    "my_courses": 10,
+    "post_message": 8,
+    "catalog": 7,
+    "search": 5,
+}
+
+
+class HTTPClient:
+    """One keep-alive HTTP/1.1 connection speaking JSON"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.token = None
+        self._reader = self._writer = None
+
+    async def request(self, method, path, body=None, query=None):
+        """Send one request, return (status, decoded JSON body)"""
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if query:
+            path += "?" + urlencode({name: value for name, value in query.items() if value is not None})
+        data = json.dumps(body).encode() if body is not None else b""
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(data)}"]
+        if self.token:
+            head.append(f"Authorization: Bearer {self.token}")
+        if data:
+            head.append("Content-Type: application/json")
+        self._writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+        await self._writer.drain()
+
+        try:
+            response_head = await self._reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            self._writer = None  # Server closed the connection; reconnect next time
+            raise ConnectionError("connection closed by server")
+        lines = response_head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ")[1])
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        payload = await self._reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, json.loads(payload) if payload else None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class Recorder:
+    """Latencies and status counts per operation"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.failures = defaultdict(int)
+
+    async def call(self, operation, client, method, path, body=None, query=None):
+        """Time one request; returns the payload, or None if it did not succeed"""
+        begin = time.perf_counter()
+        try:
+            status, payload = await client.request(method, path, body, query)
+        except (OSError, ValueError):
+            self.failures[operation] += 1
+            return None
+        self.latencies[operation].append(time.perf_counter() - begin)
+        self.statuses[operation][status] += 1
+        return payload if status < 300 else None
+
+    def report(self, elapsed):
+        """{operation: summary} plus an "all" row, as printed by print_report"""
+        results = {}
+        everything = []
+        for operation, latencies in sorted(self.latencies.items()):
+            everything += latencies
+            results[operation] = summarize(latencies, elapsed)
+            results[operation]["statuses"] = dict(self.statuses[operation])
+            results[operation]["failures"] = self.failures[operation]
+        if everything:
+            results["all"] = summarize(everything, elapsed)
+            results["all"]["errors"] = sum(count for statuses in self.statuses.values()
+                                           for status, count in statuses.items() if status >= 300)
+            results["all"]["failures"] = sum(self.failures.values())
+        return results
+
+
+def print_report(title, results):
+    print(f"\n{title}")
+    for operation, result in results.items():
+        extra = ""
+        if operation != "all":
+            errors = {status: count for status, count in result["statuses"].items() if status >= 300}
+            extra = f" errors={errors}" if errors else ""
+        else:
+            extra = f" errors={result['errors']} failures={result['failures']}"
+        print(f"  {operation:<16} {result['ops_per_sec']:9.1f} req/s  p50={result['p50_ms']:8.2f}ms "
+              f"p99={result['p99_ms']:8.2f}ms  n={result['samples']}{extra}")
+
+
+async def log_in(client, recorder, username):
+    payload = await recorder.call("login", client, "POST", "/sessions",
+                                  {"username": username, "password": BENCH_PASSWORD})
+    if payload is None:
+        return None
+    client.token = payload["token"]
+    courses = await recorder.call("my_courses", client, "GET", "/courses")
+    feed = await recorder.call("feed", client, "GET", "/feed")
+    return {
+        "courses": [course["id"] for course in courses["courses"]] if courses else [],
+        "feed_cursor": feed["cursor"] if feed else None,
+        "older": {},
+    }
+
+
+async def browse(client, recorder, state, rng, stop_at, think_ms):
+    """Steady-state loop of one logged-in user until stop_at"""
+    operations, weights = list(MIX), list(MIX.values())
+    while time.monotonic() < stop_at and state["courses"]:
+        operation = rng.choices(operations, weights)[0]
+        course_id = rng.choice(state["courses"])
+
+        if operation == "view_messages":
+            page = await recorder.call(operation, client, "GET", f"/courses/{course_id}/messages")
+            if page:
+                state["older"][course_id] = page["older"]
+        elif operation == "older_page":
+            cursor = state["older"].get(course_id)
+            if cursor:
+                page = await recorder.call(operation, client, "GET", f"/courses/{course_id}/messages",
+                                           query={"before": cursor})
+                state["older"][course_id] = page["older"] if page else None
+        elif operation == "feed":
+            page = await recorder.call(operation, client, "GET", "/feed",
+                                       query={"cursor": state["feed_cursor"]})
+            if page:
+                state["feed_cursor"] = page["cursor"]
+        elif operation == "my_courses":
+            await recorder.call(operation, client, "GET", "/courses")
+        elif operation == "post_message":
+            await recorder.call(operation, client, "POST", f"/courses/{course_id}/messages",
+                                {"message": f"Load test post about assignment {rng.randint(1, 12)}"})
+        elif operation == "catalog":
+            await recorder.call(operation, client, "GET", "/catalog", query={"prefix": "C0000"})
+        elif operation == "search":
+            await recorder.call(operation, client, "GET", "/search",
+                                query={"q": f"assignment {rng.randint(1, 12)}"})
+
+        if think_ms:
+            await asyncio.sleep(rng.expovariate(1000 / think_ms))
+
+
+async def run_load(host, port, usernames, duration=DEFAULT_DURATION, think_ms=DEFAULT_THINK_MS, seed=7):
+    """Log every user in, run the mix for `duration` seconds, return both reports"""
+    clients = [HTTPClient(host, port) for _ in usernames]
+
+    login_recorder = Recorder()
+    start = time.perf_counter()
+    states = await asyncio.gather(*(log_in(client, login_recorder, username)
+                                    for client, username in zip(clients, usernames)))
+    login_results = login_recorder.report(time.perf_counter() - start)
+    print_report(f"Login phase ({len(usernames)} users)", login_results)
+
+    recorder = Recorder()
+    stop_at = time.monotonic() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(browse(client, recorder, state, random.Random(seed + i), stop_at, think_ms)
+                           for i, (client, state) in enumerate(zip(clients, states)) if state))
+    results = recorder.report(time.perf_counter() - start)
+    print_report(f"Steady state ({duration}s, think time {think_ms}ms)", results)
+
+    for client in clients:
+        client.close()
+    return {"login": login_results, "steady": results}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        client = HTTPClient(host, port)
+        try:
+            status, _ = await client.request("GET", "/health")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            client.close()
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"API server did not come up on {host}:{port}")
+
+
+def start_server(db_path, port, server_args):
+    """Launch api_server.py on db_path in its own process"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api_server.py")
+    return subprocess.Popen([sys.executable, script, "--db", db_path, "--port", str(port)] + server_args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the course forum JSON API")
+    parser.add_argument("--url", help="server to test (default: start one on a generated forum)")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds of steady load")
+    parser.add_argument("--think-ms", type=float, default=DEFAULT_THINK_MS,
+                        help="mean pause between one user's requests (0 = closed loop, flat out)")
+    parser.add_argument("--messages", type=int, default=10000, help="size of the generated forum")
+    parser.add_argument("--accounts", type=int, default=None,
+                        help="--url only: benchmark accounts user0000001.. to log in as")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--write-behind", action="store_true", help="start the server in write-behind mode")
+    parser.add_argument("--db-workers", type=int, help="passed to the started server")
+    parser.add_argument("--shards", type=int, help="passed to the started server")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    server_args = ["--write-behind"] if args.write_behind else []
+    if args.db_workers:
+        server_args += ["--db-workers", str(args.db_workers)]
+    if args.shards:
+        server_args += ["--shards", str(args.shards)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+            accounts = range(1, (args.accounts or 100) + 1)
+        else:
+            print(f"Preparing a forum with {args.messages:,} messages...")
+            db_path = os.path.join(tmp, "loadtest_forum.db")
+            fixture, scale = ensure_fixture(args.messages, args.seed)
+            clone(fixture, db_path)
+            accounts = range(scale["staff"] + 1, scale["users"] + 1)  # Students only
+            host, port = "127.0.0.1", free_port()
+            server = start_server(db_path, port, server_args)
+
+        # More simulated users than accounts just share accounts
+        usernames = [f"user{accounts[i % len(accounts)]:07d}" for i in range(args.users)]
+        try:
+            asyncio.run(wait_until_up(host, port))
+            results = asyncio.run(run_load(host, port, usernames, args.duration, args.think_ms, args.seed))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    results["users"] = args.users
+    results["think_ms"] = args.think_ms
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
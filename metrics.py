@@ -0,0 +1,375 @@
+# metrics.py - Group 7
+"""Operation and SQL instrumentation with Prometheus text export
+
+Nothing here is active unless a Metrics object is passed to the
+platform: without one no wrappers, cursor factories or trace callbacks
+are installed, so a disabled build pays nothing.
+
+When enabled it records:
+- forum_operation_seconds: latency histogram per platform operation
+- forum_sql_seconds / forum_sql_rows_total: per-statement timing and rows
+- forum_sql_trace_events_total: statements plus trigger programs (trace callback)
+- a slow-query log with EXPLAIN QUERY PLAN for statements over a threshold
+"""
+import functools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+slow_query_log = logging.getLogger("course_forum.slow_query")
+
+# Seconds; covers a cached lookup (~1us) up to a PBKDF2 check (~100ms) and beyond
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DEFAULT_SLOW_QUERY_MS = 100
+
+# Platform method -> operation label
+OPERATIONS = {
+    "authenticate": "login",
+    "create_user": "register_user",
+    "add_course": "create_course",
+    "enroll": "join_course",
+    "course_catalog": "join_course_catalog",
+    "get_my_courses": "view_my_courses",
+    "is_enrolled": "is_enrolled",
+    "add_message": "post_message",
+    "fetch_message_page": "view_course_messages",
+    "fetch_thread_page": "view_course_threads",
+    "fetch_thread": "view_thread",
+    "attach_file": "attach_file",
+    "read_attachment": "download_attachment",
+    "save_attachment": "download_attachment",
+    "fetch_feed": "change_feed",
+    "search_messages": "search_messages",
+    "get_all_course_messages": "moderation_list",
+    "delete_message": "delete_post",
+    "moderate_messages": "moderate",
+    "restore_moderation": "restore_moderation",
+    "course_report": "course_report",
+}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql, limit=160):
+    """One-line statement text used as a metric label (never includes values)"""
+    return _WHITESPACE.sub(" ", sql).strip()[:limit]
+
+
+def _escape(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(label_items):
+    if not label_items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in label_items) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+
+
+class Metrics:
+    def __init__(self, slow_query_ms=DEFAULT_SLOW_QUERY_MS, buckets=DEFAULT_BUCKETS,
+                 slow_log_size=100):
+        """Collect metrics; statements slower than slow_query_ms are logged with their plan"""
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}    # (name, labels) -> number
+        self._gauges = {}      # (name, labels) -> number
+        self._help = {}
+        self._collectors = []
+        self.slow_queries = deque(maxlen=slow_log_size)
+        self._server = None
+
+    # ---------- recording ----------
+
+    def observe(self, name, labels, value, help_text=""):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+                self._help.setdefault(name, help_text)
+            histogram.observe(value)
+
+    def inc(self, name, labels=(), amount=1, help_text=""):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._help.setdefault(name, help_text)
+
+    def set_gauge(self, name, value, labels=(), help_text=""):
+        with self._lock:
+            self._gauges[(name, tuple(labels))] = value
+            self._help.setdefault(name, help_text)
+
+    def add_collector(self, collect):
+        """Register collect() -> [(name, labels, value, help)] gauges read at export time"""
+        self._collectors.append(collect)
+
+    def histogram_snapshot(self, name, labels=()):
+        """(count, sum) of one histogram, or None"""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(labels)))
+            return (histogram.count, histogram.total) if histogram else None
+
+    # ---------- platform operations ----------
+
+    def instrument(self, target, operations=OPERATIONS):
+        """Wrap the listed methods of one object with latency histograms"""
+        for method_name, operation in operations.items():
+            method = getattr(target, method_name, None)
+            if method is not None:
+                setattr(target, method_name, self._timed(method, operation))
+
+    def _timed(self, method, operation):
+        labels = (("operation", operation),)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                self.inc("forum_operation_errors_total", labels,
+                         help_text="Platform operations that raised an exception")
+                raise
+            finally:
+                self.observe("forum_operation_seconds", labels, time.perf_counter() - start,
+                             help_text="Latency of platform operations")
+        return wrapper
+
+    # ---------- SQL ----------
+
+    def connection_factory(self):
+        """sqlite3.Connection subclass whose cursors time every statement"""
+        metrics = self
+
+        class TimedCursor(sqlite3.Cursor):
+            _sql = None
+
+            def _finish(self):
+                # Report the previous statement once its rows have been read
+                if self._sql is not None:
+                    metrics._record_statement(self.connection, self._sql, self._params,
+                                              self._elapsed, self._rows)
+                    self._sql = None
+
+            def _start(self, sql, params, run):
+                self._finish()
+                start = time.perf_counter()
+                try:
+                    run()
+                finally:
+                    self._sql, self._params = sql, params
+                    self._elapsed = time.perf_counter() - start
+                    self._rows = max(self.rowcount, 0)  # DML row count, SELECTs count on fetch
+                return self
+
+            def execute(self, sql, parameters=()):
+                return self._start(sql, parameters,
+                                   lambda: sqlite3.Cursor.execute(self, sql, parameters))
+
+            def executemany(self, sql, seq_of_parameters):
+                return self._start(sql, None,
+                                   lambda: sqlite3.Cursor.executemany(self, sql, seq_of_parameters))
+
+            def _timed_fetch(self, fetch, *args):
+                start = time.perf_counter()
+                result = fetch(self, *args)
+                if self._sql is not None:
+                    self._elapsed += time.perf_counter() - start
+                return result
+
+            def fetchone(self):
+                row = self._timed_fetch(sqlite3.Cursor.fetchone)
+                if row is None:
+                    self._finish()
+                elif self._sql is not None:
+                    self._rows += 1
+                return row
+
+            def fetchmany(self, size=None):
+                size = self.arraysize if size is None else size
+                rows = self._timed_fetch(sqlite3.Cursor.fetchmany, size)
+                if self._sql is not None:
+                    self._rows += len(rows)
+                if len(rows) < size:
+                    self._finish()
+                return rows
+
+            def fetchall(self):
+                rows = self._timed_fetch(sqlite3.Cursor.fetchall)
+                if self._sql is not None:
+                    self._rows += len(rows)
+                self._finish()
+                return rows
+
+            def __next__(self):
+                row = self.fetchone()
+                if row is None:
+                    raise StopIteration
+                return row
+
+            def close(self):
+                self._finish()
+                super().close()
+
+            def __del__(self):
+                self._finish()
+
+        class TimedConnection(sqlite3.Connection):
+            def cursor(self, factory=TimedCursor):
+                return super().cursor(factory)
+
+            def execute(self, sql, parameters=()):
+                return self.cursor().execute(sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                return self.cursor().executemany(sql, seq_of_parameters)
+
+        return TimedConnection
+
+    def on_connect(self, conn):
+        """Count every statement and trigger program SQLite starts
+
+        The trace callback only receives the statement text with values
+        filled in, so it is counted but never used as a label.
+        """
+        def trace(statement):
+            self.inc("forum_sql_trace_events_total",
+                     help_text="Statements and trigger programs started (sqlite3 trace callback)")
+        conn.set_trace_callback(trace)
+
+    def _record_statement(self, conn, sql, params, elapsed, rows):
+        labels = (("statement", normalize_sql(sql)),)
+        self.observe("forum_sql_seconds", labels, elapsed,
+                     help_text="Time spent executing and fetching each SQL statement")
+        self.inc("forum_sql_rows_total", labels, rows,
+                 help_text="Rows returned or changed by each SQL statement")
+        if elapsed >= self.slow_query_seconds:
+            self._log_slow_query(conn, sql, params, elapsed, rows)
+
+    def _log_slow_query(self, conn, sql, params, elapsed, rows):
+        plan = []
+        if params is not None and sql.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")):
+            try:
+                # Plain Cursor: the plan query itself must not be timed
+                cursor = sqlite3.Cursor(conn)
+                plan = [row[3] for row in sqlite3.Cursor.execute(cursor, "EXPLAIN QUERY PLAN " + sql, params)]
+            except sqlite3.Error as exc:
+                plan = [f"(no plan: {exc})"]
+
+        entry = {
+            "time": time.time(),
+            "ms": round(elapsed * 1000, 3),
+            "rows": rows,
+            "statement": normalize_sql(sql, limit=2000),
+            "plan": plan,
+        }
+        self.slow_queries.append(entry)
+        self.inc("forum_slow_queries_total", help_text="Statements slower than the slow-query threshold")
+        slow_query_log.warning("slow query %s", json.dumps(entry))
+
+    # ---------- export ----------
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        gauges = []
+        for collect in self._collectors:
+            gauges.extend(collect())
+
+        lines = []
+        with self._lock:
+            help_text = dict(self._help)
+            seen = set()
+
+            def header(name, kind, text=None):
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f"# HELP {name} {text or help_text.get(name) or name}")
+                    lines.append(f"# TYPE {name} {kind}")
+
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                header(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.total}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name, "counter")
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+            for (name, labels), value in sorted(self._gauges.items()):
+                header(name, "gauge")
+                lines.append(f"{name}{_labels(labels)} {value}")
+
+            for name, labels, value, text in gauges:
+                header(name, "gauge", text)
+                lines.append(f"{name}{_labels(tuple(labels))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the metrics to a file (atomically, for node_exporter's textfile collector)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def serve(self, port=9464, host="127.0.0.1"):
+        """Serve /metrics over HTTP from a background thread, return the server"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes are not worth a line each on the console
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True,
+                         name="metrics-http").start()
+        return self._server
+
+    def close(self):
+        """Stop the HTTP endpoint if it is running"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,694 @@
+# migrations.py - Group 7
+"""Versioned schema migrations for the course forum database
+
+The schema version is kept in SQLite's `PRAGMA user_version`. Each
+migration is a list of steps (SQL strings or functions taking the
+connection) that runs inside one transaction together with the version
+bump, so a database is never left half-migrated.
+"""
+import logging
+import os
+import sqlite3
+
+import stats
+from archive import default_archive_path
+
+log = logging.getLogger("course_forum.migrations")
+
+
+def _rebuild_messages_autoincrement(conn):
+    """Recreate messages with AUTOINCREMENT, keeping every row, index and trigger
+
+    A plain INTEGER PRIMARY KEY hands the id of the newest row out again
+    once that row is archived or purged; the archive, exports and the
+    change feed would take the new post for the old one. SQLite cannot
+    add AUTOINCREMENT in place, so the table is copied and renamed. The
+    indexes and triggers go with the old table and are created again
+    from their stored SQL; no trigger runs during the copy.
+    """
+    objects = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = 'messages' AND type IN ('index', 'trigger')"
+        " AND sql IS NOT NULL ORDER BY type, name"
+    )]
+    conn.execute('''
+        CREATE TABLE messages_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            posted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            deleted_at TIMESTAMP,
+            deleted_by INTEGER REFERENCES users(id),
+            moderation_action_id INTEGER REFERENCES moderation_actions(id),
+            parent_id INTEGER,
+            path TEXT,
+            reply_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (course_id) REFERENCES courses(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    columns = ("id, course_id, user_id, message, posted_at, deleted_at, deleted_by, moderation_action_id, "
+               "parent_id, path, reply_count")
+    # Sets sqlite_sequence to the largest id; see Archiver.reserve_ids for archived ones
+    conn.execute(f"INSERT INTO messages_new ({columns}) SELECT {columns} FROM messages ORDER BY id")
+    conn.execute("DROP TABLE messages")
+    conn.execute("ALTER TABLE messages_new RENAME TO messages")
+    for sql in objects:
+        conn.execute(sql)
+
+
+def _recount_course_stats(conn):
+    """Recount course_stats from the live posts, leaving tombstones out
+
+    Skipped when the database has an archive next to it: the counters
+    include archived posts, and the archive cannot be attached inside
+    the migration transaction (use `program.py backfill-stats` there).
+    """
+    path = next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+    archive_path = default_archive_path(path) if path else None
+    if archive_path and os.path.exists(archive_path):
+        log.info("Kept course_stats of %s, it has an archive (run backfill-stats to recount)", path)
+        return
+    stats.backfill(conn)
+
+
+# (version, description, steps) - append new migrations to the end, never edit old ones
+MIGRATIONS = [
+    (1, "Create base tables", [
+        # Users table
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT CHECK(role IN ('staff', 'student')) NOT NULL,
+            full_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Courses table
+        '''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY,
+            course_code TEXT UNIQUE NOT NULL,
+            course_name TEXT NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users(id)
+        )
+        ''',
+        # Enrollments table (who is in which course)
+        '''
+        CREATE TABLE IF NOT EXISTS enrollments (
+            user_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, course_id),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (course_id) REFERENCES courses(id)
+        )
+        ''',
+        # Messages table
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            course_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            posted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (course_id) REFERENCES courses(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        ''',
+    ]),
+    (2, "Index foreign-key lookups", [
+        # Paginated message feed (course, then time order)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_course_posted
+        ON messages (course_id, posted_at, id)
+        ''',
+        # Course members (the primary key only covers lookups by user)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_enrollments_course
+        ON enrollments (course_id, user_id)
+        ''',
+        # Courses a staff member created (delete post menu)
+        '''
+        CREATE INDEX IF NOT EXISTS idx_courses_created_by
+        ON courses (created_by)
+        ''',
+        # Messages written by a user
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_user
+        ON messages (user_id)
+        ''',
+        # Give the query planner statistics for the new indexes
+        "ANALYZE",
+    ]),
+    (3, "Add persisted login sessions", [
+        # Only a SHA-256 of the session id is stored, never the token
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            token_hash TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_sessions_expires
+        ON sessions (expires_at)
+        ''',
+    ]),
+    (4, "Add full-text search over messages", [
+        # External-content FTS5 index: stores only the index, text stays in messages
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message,
+            content='messages',
+            content_rowid='id'
+        )
+        ''',
+        # Keep the index in sync with every insert, delete and edit
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, message) VALUES (NEW.id, NEW.message);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', OLD.id, OLD.message);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', OLD.id, OLD.message);
+            INSERT INTO messages_fts (rowid, message) VALUES (NEW.id, NEW.message);
+        END
+        ''',
+        # Index the messages that already exist
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+    ]),
+    (5, "Add incrementally maintained course statistics", [
+        '''
+        CREATE TABLE IF NOT EXISTS course_stats (
+            course_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            member_count INTEGER NOT NULL DEFAULT 0,
+            last_posted_at TIMESTAMP,
+            FOREIGN KEY (course_id) REFERENCES courses(id)
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_course_insert AFTER INSERT ON courses BEGIN
+            INSERT OR IGNORE INTO course_stats (course_id) VALUES (NEW.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_message_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO course_stats (course_id, message_count, last_posted_at)
+            VALUES (NEW.course_id, 1, NEW.posted_at)
+            ON CONFLICT (course_id) DO UPDATE SET
+                message_count = message_count + 1,
+                last_posted_at = CASE
+                    WHEN last_posted_at IS NULL OR excluded.last_posted_at > last_posted_at
+                    THEN excluded.last_posted_at ELSE last_posted_at END;
+        END
+        ''',
+        # Newest remaining post comes from idx_messages_course_posted in O(log n)
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_message_delete AFTER DELETE ON messages BEGIN
+            UPDATE course_stats SET
+                message_count = message_count - 1,
+                last_posted_at = (SELECT MAX(posted_at) FROM messages WHERE course_id = OLD.course_id)
+            WHERE course_id = OLD.course_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_enrollment_insert AFTER INSERT ON enrollments BEGIN
+            INSERT INTO course_stats (course_id, member_count) VALUES (NEW.course_id, 1)
+            ON CONFLICT (course_id) DO UPDATE SET member_count = member_count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_enrollment_delete AFTER DELETE ON enrollments BEGIN
+            UPDATE course_stats SET member_count = member_count - 1
+            WHERE course_id = OLD.course_id;
+        END
+        ''',
+        # Fill the table for courses that already exist
+        stats.backfill,
+    ]),
+    (6, "Track transcript export high-water marks", [
+        '''
+        CREATE TABLE IF NOT EXISTS export_state (
+            course_id INTEGER PRIMARY KEY,
+            last_message_id INTEGER NOT NULL,
+            exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (course_id) REFERENCES courses(id)
+        )
+        ''',
+    ]),
+    (7, "Add soft-delete tombstones and moderation actions", [
+        '''
+        CREATE TABLE IF NOT EXISTS moderation_actions (
+            id INTEGER PRIMARY KEY,
+            course_id INTEGER NOT NULL,
+            staff_id INTEGER NOT NULL,
+            criteria TEXT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            restored_at TIMESTAMP,
+            FOREIGN KEY (course_id) REFERENCES courses(id),
+            FOREIGN KEY (staff_id) REFERENCES users(id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_moderation_actions_course ON moderation_actions (course_id, id)",
+        "ALTER TABLE messages ADD COLUMN deleted_at TIMESTAMP",
+        "ALTER TABLE messages ADD COLUMN deleted_by INTEGER REFERENCES users(id)",
+        "ALTER TABLE messages ADD COLUMN moderation_action_id INTEGER REFERENCES moderation_actions(id)",
+        # Live messages only: tombstones drop out of the paging index entirely
+        "DROP INDEX IF EXISTS idx_messages_course_posted",
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_course_posted
+        ON messages (course_id, posted_at, id) WHERE deleted_at IS NULL
+        ''',
+        # Bulk delete by author within a course
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_course_author
+        ON messages (course_id, user_id) WHERE deleted_at IS NULL
+        ''',
+        # Small indexes over the (few) tombstones for purge and undo
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_tombstones
+        ON messages (deleted_at) WHERE deleted_at IS NOT NULL
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_moderation_action
+        ON messages (moderation_action_id) WHERE moderation_action_id IS NOT NULL
+        ''',
+        # Purging a tombstone must not count it a second time
+        "DROP TRIGGER IF EXISTS course_stats_message_delete",
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_message_delete AFTER DELETE ON messages
+        WHEN OLD.deleted_at IS NULL BEGIN
+            UPDATE course_stats SET
+                message_count = message_count - 1,
+                last_posted_at = (SELECT MAX(posted_at) FROM messages
+                                  WHERE course_id = OLD.course_id AND deleted_at IS NULL)
+            WHERE course_id = OLD.course_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_message_tombstone AFTER UPDATE OF deleted_at ON messages
+        WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL BEGIN
+            UPDATE course_stats SET
+                message_count = message_count - 1,
+                last_posted_at = (SELECT MAX(posted_at) FROM messages
+                                  WHERE course_id = OLD.course_id AND deleted_at IS NULL)
+            WHERE course_id = OLD.course_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_message_restore AFTER UPDATE OF deleted_at ON messages
+        WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL BEGIN
+            UPDATE course_stats SET
+                message_count = message_count + 1,
+                last_posted_at = CASE
+                    WHEN last_posted_at IS NULL OR NEW.posted_at > last_posted_at
+                    THEN NEW.posted_at ELSE last_posted_at END
+            WHERE course_id = NEW.course_id;
+        END
+        ''',
+        "ANALYZE",
+    ]),
+    (8, "Index course codes and names for catalog prefix search", [
+        "CREATE INDEX IF NOT EXISTS idx_courses_code_nocase ON courses (course_code COLLATE NOCASE, id)",
+        "CREATE INDEX IF NOT EXISTS idx_courses_name_nocase ON courses (course_name COLLATE NOCASE, id)",
+    ]),
+    (9, "Add the message change feed", [
+        # AUTOINCREMENT: a seq is never handed out twice, even after old events are pruned
+        '''
+        CREATE TABLE IF NOT EXISTS message_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            kind TEXT CHECK(kind IN ('post', 'delete', 'restore')) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_message_events_course ON message_events (course_id, seq)",
+        "CREATE INDEX IF NOT EXISTS idx_message_events_created ON message_events (created_at)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS message_events_post AFTER INSERT ON messages BEGIN
+            INSERT INTO message_events (course_id, message_id, kind) VALUES (NEW.course_id, NEW.id, 'post');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS message_events_delete AFTER UPDATE OF deleted_at ON messages
+        WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL BEGIN
+            INSERT INTO message_events (course_id, message_id, kind) VALUES (NEW.course_id, NEW.id, 'delete');
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS message_events_restore AFTER UPDATE OF deleted_at ON messages
+        WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL BEGIN
+            INSERT INTO message_events (course_id, message_id, kind) VALUES (NEW.course_id, NEW.id, 'restore');
+        END
+        ''',
+    ]),
+    (10, "Add the course directory for sharding", [
+        # Which shard file holds each course (read in the global database)
+        '''
+        CREATE TABLE IF NOT EXISTS course_directory (
+            course_id INTEGER PRIMARY KEY,
+            course_code TEXT UNIQUE NOT NULL,
+            shard INTEGER NOT NULL DEFAULT 0,
+            moved_at TIMESTAMP
+        )
+        ''',
+        # Every course so far lives in this file, which is shard 0
+        "INSERT OR IGNORE INTO course_directory (course_id, course_code) SELECT id, course_code FROM courses",
+        # Per shard: which shard this file is, and where its message ids start
+        '''
+        CREATE TABLE IF NOT EXISTS shard_info (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard INTEGER NOT NULL,
+            message_id_floor INTEGER NOT NULL
+        )
+        ''',
+        # Per shard: courses that were moved away, so stale routers notice
+        '''
+        CREATE TABLE IF NOT EXISTS course_moves (
+            course_id INTEGER PRIMARY KEY,
+            to_shard INTEGER NOT NULL,
+            moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (11, "Add threaded replies with a materialized path", [
+        # No foreign key: archiving and purging may remove a post before its replies
+        "ALTER TABLE messages ADD COLUMN parent_id INTEGER",
+        # The ancestors' segments, then the post's own: 10 digits of posting time
+        # (Unix seconds) + 19 digits of id + '/'. Sorting by path lists threads
+        # oldest first, each depth first; ids alone are not in posting order once
+        # a sharded course has moved.
+        "ALTER TABLE messages ADD COLUMN path TEXT",
+        # Live replies anywhere below this post
+        "ALTER TABLE messages ADD COLUMN reply_count INTEGER NOT NULL DEFAULT 0",
+        # Every existing post starts its own thread
+        '''
+        UPDATE messages
+        SET path = printf('%010d%019d/', CAST(strftime('%s', posted_at) AS INTEGER), id)
+        ''',
+        # A thread, or the subtree below one post, is one range scan: path >= p AND path < p || '~'
+        "CREATE INDEX IF NOT EXISTS idx_messages_course_path ON messages (course_id, path)",
+        # Thread pages walk the root posts only
+        '''
+        CREATE INDEX IF NOT EXISTS idx_messages_course_roots
+        ON messages (course_id, path) WHERE parent_id IS NULL
+        ''',
+        # Rows copied with their path (sharding moves) skip both triggers below
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_reply_check BEFORE INSERT ON messages
+        WHEN NEW.parent_id IS NOT NULL AND NEW.path IS NULL BEGIN
+            SELECT RAISE(ABORT, 'Replies must stay in the course of the post they answer')
+            WHERE NOT EXISTS (SELECT 1 FROM messages WHERE id = NEW.parent_id AND course_id = NEW.course_id);
+        END
+        ''',
+        # Ancestor ids are read back out of the parent's path (primary-key lookups, no recursion)
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_thread_insert AFTER INSERT ON messages
+        WHEN NEW.path IS NULL BEGIN
+            UPDATE messages
+            SET path = COALESCE((SELECT path FROM messages WHERE id = NEW.parent_id), '')
+                       || printf('%010d%019d/', CAST(strftime('%s', NEW.posted_at) AS INTEGER), NEW.id)
+            WHERE id = NEW.id;
+            UPDATE messages SET reply_count = reply_count + 1
+            WHERE NEW.parent_id IS NOT NULL AND id IN (
+                SELECT CAST(substr(value, 11) AS INTEGER) FROM json_each(
+                    '["' || replace(rtrim((SELECT path FROM messages WHERE id = NEW.parent_id), '/'), '/', '","') || '"]'
+                )
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_thread_tombstone AFTER UPDATE OF deleted_at ON messages
+        WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL AND OLD.parent_id IS NOT NULL BEGIN
+            UPDATE messages SET reply_count = reply_count - 1
+            WHERE id IN (
+                SELECT CAST(substr(value, 11) AS INTEGER) FROM json_each(
+                    '["' || replace(rtrim(substr(OLD.path, 1, length(OLD.path) - 30), '/'), '/', '","') || '"]'
+                )
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_thread_restore AFTER UPDATE OF deleted_at ON messages
+        WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL AND OLD.parent_id IS NOT NULL BEGIN
+            UPDATE messages SET reply_count = reply_count + 1
+            WHERE id IN (
+                SELECT CAST(substr(value, 11) AS INTEGER) FROM json_each(
+                    '["' || replace(rtrim(substr(OLD.path, 1, length(OLD.path) - 30), '/'), '/', '","') || '"]'
+                )
+            );
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_thread_delete AFTER DELETE ON messages
+        WHEN OLD.deleted_at IS NULL AND OLD.parent_id IS NOT NULL BEGIN
+            UPDATE messages SET reply_count = reply_count - 1
+            WHERE id IN (
+                SELECT CAST(substr(value, 11) AS INTEGER) FROM json_each(
+                    '["' || replace(rtrim(substr(OLD.path, 1, length(OLD.path) - 30), '/'), '/', '","') || '"]'
+                )
+            );
+        END
+        ''',
+        "ANALYZE",
+    ]),
+    (12, "Add deduplicated file attachments", [
+        # File contents, stored once however many posts attach them. The bytes
+        # go last so reading the other columns never walks the overflow pages.
+        '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            id INTEGER PRIMARY KEY,
+            sha256 TEXT UNIQUE,  -- NULL only while an upload is being written
+            size INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data BLOB NOT NULL
+        )
+        ''',
+        # No foreign key to messages: archived posts keep their attachments here
+        '''
+        CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            course_id INTEGER NOT NULL,
+            blob_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            content_type TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (course_id) REFERENCES courses(id),
+            FOREIGN KEY (blob_id) REFERENCES blobs(id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_attachments_message ON attachments (message_id)",
+        # Covers the per-course quota sum
+        "CREATE INDEX IF NOT EXISTS idx_attachments_course ON attachments (course_id, size)",
+        "CREATE INDEX IF NOT EXISTS idx_attachments_blob ON attachments (blob_id)",
+        '''
+        CREATE TRIGGER IF NOT EXISTS blobs_attachment_insert AFTER INSERT ON attachments BEGIN
+            UPDATE blobs SET ref_count = ref_count + 1 WHERE id = NEW.blob_id;
+        END
+        ''',
+        # The last attachment of a file takes the bytes with it
+        '''
+        CREATE TRIGGER IF NOT EXISTS blobs_attachment_delete AFTER DELETE ON attachments BEGIN
+            UPDATE blobs SET ref_count = ref_count - 1 WHERE id = OLD.blob_id;
+            DELETE FROM blobs WHERE id = OLD.blob_id AND ref_count = 0;
+        END
+        ''',
+        # Purging a tombstone purges its attachments (archiving a live post does not)
+        '''
+        CREATE TRIGGER IF NOT EXISTS attachments_message_purge AFTER DELETE ON messages
+        WHEN OLD.deleted_at IS NOT NULL BEGIN
+            DELETE FROM attachments WHERE message_id = OLD.id;
+        END
+        ''',
+    ]),
+    (13, "Add time-bucketed activity rollups", [
+        # Live posts per course and hour ('YYYY-MM-DD HH'), day, and author and day
+        '''
+        CREATE TABLE IF NOT EXISTS activity_hourly (
+            course_id INTEGER NOT NULL,
+            hour TEXT NOT NULL,
+            post_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (course_id, hour)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS activity_daily (
+            course_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            post_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (course_id, day)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS activity_user_daily (
+            course_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            post_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (course_id, day, user_id)
+        )
+        ''',
+        # Messages with ids up to last_message_id are in the rollups
+        '''
+        CREATE TABLE IF NOT EXISTS analytics_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_message_id INTEGER NOT NULL,
+            refreshed_at TIMESTAMP
+        )
+        ''',
+        "INSERT OR IGNORE INTO analytics_state (id, last_message_id) VALUES (1, 0)",
+        # Below the high-water mark the rollups follow every change. A post can
+        # land there when its course is moved in from another shard.
+        '''
+        CREATE TRIGGER IF NOT EXISTS analytics_message_insert AFTER INSERT ON messages
+        WHEN NEW.deleted_at IS NULL AND NEW.id <= (SELECT last_message_id FROM analytics_state) BEGIN
+            INSERT INTO activity_hourly (course_id, hour, post_count)
+            VALUES (NEW.course_id, substr(NEW.posted_at, 1, 13), 1)
+            ON CONFLICT (course_id, hour) DO UPDATE SET post_count = post_count + 1;
+            INSERT INTO activity_daily (course_id, day, post_count)
+            VALUES (NEW.course_id, substr(NEW.posted_at, 1, 10), 1)
+            ON CONFLICT (course_id, day) DO UPDATE SET post_count = post_count + 1;
+            INSERT INTO activity_user_daily (course_id, day, user_id, post_count)
+            VALUES (NEW.course_id, substr(NEW.posted_at, 1, 10), NEW.user_id, 1)
+            ON CONFLICT (course_id, day, user_id) DO UPDATE SET post_count = post_count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS analytics_message_tombstone AFTER UPDATE OF deleted_at ON messages
+        WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL
+         AND OLD.id <= (SELECT last_message_id FROM analytics_state) BEGIN
+            UPDATE activity_hourly SET post_count = post_count - 1
+            WHERE course_id = OLD.course_id AND hour = substr(OLD.posted_at, 1, 13);
+            UPDATE activity_daily SET post_count = post_count - 1
+            WHERE course_id = OLD.course_id AND day = substr(OLD.posted_at, 1, 10);
+            UPDATE activity_user_daily SET post_count = post_count - 1
+            WHERE course_id = OLD.course_id AND day = substr(OLD.posted_at, 1, 10) AND user_id = OLD.user_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS analytics_message_restore AFTER UPDATE OF deleted_at ON messages
+        WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL
+         AND NEW.id <= (SELECT last_message_id FROM analytics_state) BEGIN
+            INSERT INTO activity_hourly (course_id, hour, post_count)
+            VALUES (NEW.course_id, substr(NEW.posted_at, 1, 13), 1)
+            ON CONFLICT (course_id, hour) DO UPDATE SET post_count = post_count + 1;
+            INSERT INTO activity_daily (course_id, day, post_count)
+            VALUES (NEW.course_id, substr(NEW.posted_at, 1, 10), 1)
+            ON CONFLICT (course_id, day) DO UPDATE SET post_count = post_count + 1;
+            INSERT INTO activity_user_daily (course_id, day, user_id, post_count)
+            VALUES (NEW.course_id, substr(NEW.posted_at, 1, 10), NEW.user_id, 1)
+            ON CONFLICT (course_id, day, user_id) DO UPDATE SET post_count = post_count + 1;
+        END
+        ''',
+        # The rollups start empty; the first refresh counts the existing posts
+    ]),
+    (14, "Never hand out a message id twice", [
+        _rebuild_messages_autoincrement,
+        "ANALYZE messages",
+    ]),
+    (15, "Track the last message id handed out in each shard's range", [
+        # message_id_floor becomes the last id used in this shard's range
+        # [shard << 40, (shard + 1) << 40) (see sharding.ID_BITS), so ids of
+        # archived or purged posts are not handed out again
+        '''
+        UPDATE shard_info SET message_id_floor = MAX(message_id_floor, COALESCE(
+            (SELECT MAX(id) FROM messages WHERE id < (shard_info.shard + 1) << 40), 0))
+        ''',
+        # Posts moved in from other shards' ranges leave it alone
+        '''
+        CREATE TRIGGER IF NOT EXISTS shard_info_message_insert AFTER INSERT ON messages
+        WHEN NEW.id > (SELECT message_id_floor FROM shard_info)
+         AND NEW.id < ((SELECT shard FROM shard_info) + 1) << 40 BEGIN
+            UPDATE shard_info SET message_id_floor = NEW.id;
+        END
+        ''',
+    ]),
+    (16, "Do not count posts inserted as tombstones in course_stats", [
+        # A course moved between shards arrives with its tombstones; as in the
+        # delete trigger, only live posts change the counters
+        "DROP TRIGGER IF EXISTS course_stats_message_insert",
+        '''
+        CREATE TRIGGER IF NOT EXISTS course_stats_message_insert AFTER INSERT ON messages
+        WHEN NEW.deleted_at IS NULL BEGIN
+            INSERT INTO course_stats (course_id, message_count, last_posted_at)
+            VALUES (NEW.course_id, 1, NEW.posted_at)
+            ON CONFLICT (course_id) DO UPDATE SET
+                message_count = message_count + 1,
+                last_posted_at = CASE
+                    WHEN last_posted_at IS NULL OR excluded.last_posted_at > last_posted_at
+                    THEN excluded.last_posted_at ELSE last_posted_at END;
+        END
+        ''',
+    ]),
+    (17, "Recount course statistics without tombstones", [
+        # Counters can hold tombstones counted by the old insert trigger
+        _recount_course_stats,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Read the schema version stored in the database file"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Bring the database up to LATEST_VERSION, return the versions applied"""
+    version = get_schema_version(conn)
+    if version == LATEST_VERSION:
+        return []  # Schema is current: no DDL at all
+    if version > LATEST_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this program ({LATEST_VERSION})"
+        )
+
+    applied = []
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if get_schema_version(conn) >= number:
+                conn.rollback()
+                continue
+
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+
+            # PRAGMA does not accept ? placeholders; number is our own int
+            conn.execute(f"PRAGMA user_version = {int(number)}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+        applied.append(number)
+        log.info("Applied migration %d: %s", number, description)
+
+    return applied
@@ -0,0 +1,212 @@
+# moderation.py - Group 7
+"""Bulk moderation with soft-delete tombstones
+
+Moderation never removes rows directly. One UPDATE marks every matching
+message in a course (a single post, everything by an author, a time
+range, or posts containing a keyword) with deleted_at, deleted_by and
+the id of a moderation_actions row describing the request. Undoing the
+action clears those columns again.
+
+Read paths filter on `deleted_at IS NULL`, which is also the condition of
+the partial indexes created in migrations.py, so filtering costs nothing
+and tombstones do not even appear in those indexes. Triggers keep
+course_stats in step when messages are tombstoned or restored.
+
+Tombstones older than a grace period are hard-deleted by purge(), a few
+hundred rows per transaction, either from the command line or from a
+PurgeJob thread.
+"""
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Tombstones can be undone for this long before they are purged
+DEFAULT_PURGE_AFTER = timedelta(days=7)
+DEFAULT_PURGE_BATCH = 500
+
+log = logging.getLogger("course_forum.moderation")
+
+
+def soft_delete(conn, staff_id, course_id, message_id=None, author_id=None,
+                since=None, until=None, match=None):
+    """Tombstone the live messages of one course matching every given filter
+
+    `since`/`until` bound posted_at (until is exclusive) and `match` is an
+    FTS5 query. Returns (action_id, messages tombstoned).
+    """
+    conditions = ["course_id = ?", "deleted_at IS NULL"]
+    params = [course_id]
+    criteria = {}
+    if message_id is not None:
+        conditions.append("id = ?")
+        params.append(message_id)
+        criteria["message_id"] = message_id
+    if author_id is not None:
+        conditions.append("user_id = ?")
+        params.append(author_id)
+        criteria["author_id"] = author_id
+    if since is not None:
+        conditions.append("posted_at >= ?")
+        params.append(since)
+        criteria["since"] = since
+    if until is not None:
+        conditions.append("posted_at < ?")
+        params.append(until)
+        criteria["until"] = until
+    if match is not None:
+        conditions.append("id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+        params.append(match)
+        criteria["match"] = match
+    if not criteria:
+        raise ValueError("Refusing to delete a whole course: give at least one filter")
+
+    action_id = conn.execute(
+        "INSERT INTO moderation_actions (course_id, staff_id, criteria) VALUES (?, ?, ?)",
+        (course_id, staff_id, json.dumps(criteria))
+    ).lastrowid
+    count = conn.execute(f'''
+        UPDATE messages
+        SET deleted_at = CURRENT_TIMESTAMP, deleted_by = ?, moderation_action_id = ?
+        WHERE {" AND ".join(conditions)}
+    ''', [staff_id, action_id] + params).rowcount
+    conn.execute("UPDATE moderation_actions SET message_count = ? WHERE id = ?", (count, action_id))
+    return action_id, count
+
+
+def restore(conn, action_id):
+    """Bring back the messages of one moderation action, return how many"""
+    replies = [row[0] for row in conn.execute(
+        "SELECT id FROM messages WHERE moderation_action_id = ? AND parent_id IS NOT NULL ORDER BY path",
+        (action_id,)
+    )]
+    count = conn.execute('''
+        UPDATE messages
+        SET deleted_at = NULL, deleted_by = NULL, moderation_action_id = NULL
+        WHERE moderation_action_id = ?
+    ''', (action_id,)).rowcount
+    for message_id in replies:
+        _reroot_if_orphaned(conn, message_id)
+    conn.execute(
+        "UPDATE moderation_actions SET restored_at = CURRENT_TIMESTAMP WHERE id = ?", (action_id,)
+    )
+    return count
+
+
+def _reroot_if_orphaned(conn, message_id):
+    """Make a reply's subtree a thread of its own if a post above it no longer exists
+
+    Archiving (and purges before tombstones waited for their replies) can
+    remove a post while replies stay behind. The subtree below the lowest
+    missing ancestor becomes a thread: its paths lose the missing part,
+    and the posts still above it are recounted.
+    """
+    course_id, path = conn.execute("SELECT course_id, path FROM messages WHERE id = ?", (message_id,)).fetchone()
+    segments = [path[i:i + 30] for i in range(0, len(path), 30)]
+    ancestor_ids = [int(segment[10:29]) for segment in segments[:-1]]
+    if not ancestor_ids:
+        return
+    present = {row[0] for row in conn.execute(
+        f"SELECT id FROM messages WHERE id IN ({', '.join('?' * len(ancestor_ids))})", ancestor_ids
+    )}
+    missing = [depth for depth, ancestor_id in enumerate(ancestor_ids) if ancestor_id not in present]
+    if not missing:
+        return
+
+    old_prefix = "".join(segments[:missing[-1] + 2])
+    new_root = segments[missing[-1] + 1]
+    conn.execute('''
+        UPDATE messages SET path = ? || substr(path, ?)
+        WHERE course_id = ? AND path >= ? AND path < ? || '~'
+    ''', (new_root, len(old_prefix) + 1, course_id, old_prefix, old_prefix))
+    conn.execute("UPDATE messages SET parent_id = NULL WHERE id = ?", (int(new_root[10:29]),))
+
+    above = [ancestor_id for ancestor_id in ancestor_ids[:missing[-1]] if ancestor_id in present]
+    if above:
+        conn.execute(f'''
+            UPDATE messages SET reply_count = (
+                SELECT COUNT(*) FROM messages AS d
+                WHERE d.course_id = messages.course_id AND d.deleted_at IS NULL
+                  AND d.path > messages.path AND d.path < messages.path || '~'
+            )
+            WHERE id IN ({', '.join('?' * len(above))})
+        ''', above)
+
+
+def recent_actions(conn, course_id, limit=10):
+    """Latest moderation actions of a course, newest first
+
+    Each row is (action_id, staff username, criteria, message_count,
+    created_at, restored_at).
+    """
+    return conn.execute('''
+        SELECT a.id, u.username, a.criteria, a.message_count, a.created_at, a.restored_at
+        FROM moderation_actions a
+        JOIN users u ON u.id = a.staff_id
+        WHERE a.course_id = ?
+        ORDER BY a.id DESC
+        LIMIT ?
+    ''', (course_id, limit)).fetchall()
+
+
+def purge(db, older_than=DEFAULT_PURGE_AFTER, batch_size=DEFAULT_PURGE_BATCH, stop=None):
+    """Hard-delete tombstones older than `older_than`, one batch per transaction
+
+    A tombstone with any replies below it (live or removed) stays, so the
+    thread keeps its shape and a restored reply still has its parent; it
+    goes in a later batch once its replies are gone. Short transactions
+    keep the writer free for posts between batches.
+    Freed pages are reused by new rows; with auto_vacuum=INCREMENTAL they
+    are also handed back to the file system. Returns how many rows went.
+    """
+    cutoff = (datetime.now(timezone.utc) - older_than).strftime("%Y-%m-%d %H:%M:%S")
+    purged = 0
+    while stop is None or not stop.is_set():
+        with db.writer() as conn:
+            count = conn.execute('''
+                DELETE FROM messages WHERE id IN (
+                    SELECT id FROM messages AS t
+                    WHERE deleted_at IS NOT NULL AND deleted_at < ?
+                      AND NOT EXISTS (
+                          SELECT 1 FROM messages AS r
+                          WHERE r.course_id = t.course_id AND r.path > t.path AND r.path < t.path || '~'
+                      )
+                    LIMIT ?
+                )
+            ''', (cutoff, batch_size)).rowcount
+        purged += count
+        if not count:  # Parents come free once their last replies went in an earlier batch
+            break
+
+    if purged:
+        with db.writer() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                conn.execute("PRAGMA incremental_vacuum").fetchall()
+    return purged
+
+
+class PurgeJob:
+    def __init__(self, db, interval=3600, older_than=DEFAULT_PURGE_AFTER,
+                 batch_size=DEFAULT_PURGE_BATCH):
+        """Run purge() every `interval` seconds on a background thread"""
+        self.db = db
+        self.interval = interval
+        self.older_than = older_than
+        self.batch_size = batch_size
+        self.purged = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tombstone-purge", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.purged += purge(self.db, self.older_than, self.batch_size, stop=self._stop)
+            except sqlite3.Error:
+                log.exception("Tombstone purge failed, will retry")
+
+    def close(self):
+        """Stop the job (a batch in progress finishes first)"""
+        self._stop.set()
+        self._thread.join()
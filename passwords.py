@@ -0,0 +1,133 @@
+# passwords.py - Group 7
+"""PBKDF2 password hashing off the calling thread
+
+hashlib releases the GIL while it runs PBKDF2, so a plain thread pool is
+enough to spread logins and registrations across every core. Hashes are
+stored as
+
+    pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+
+so the cost can be raised later; older `salt:hash` strings from the
+first version of the platform are still accepted (100,000 rounds).
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HASH_SCHEME = "pbkdf2_sha256"
+DEFAULT_ITERATIONS = 100000
+LEGACY_ITERATIONS = 100000  # Rounds used by the original salt:hash format
+SALT_BYTES = 32
+
+
+def _pbkdf2(password, salt, iterations):
+    """Run PBKDF2-SHA256 (releases the GIL while it works)"""
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+
+def parse_hash(stored_hash):
+    """Split a stored hash into (iterations, salt, digest)"""
+    if stored_hash.startswith(HASH_SCHEME + "$"):
+        _, iterations, salt_hex, hash_hex = stored_hash.split("$")
+        return int(iterations), bytes.fromhex(salt_hex), bytes.fromhex(hash_hex)
+
+    # Legacy format: salt:hash with a fixed number of rounds
+    salt_hex, hash_hex = stored_hash.split(':')
+    return LEGACY_ITERATIONS, bytes.fromhex(salt_hex), bytes.fromhex(hash_hex)
+
+
+def make_hash(password, iterations=DEFAULT_ITERATIONS):
+    """Hash a password with a fresh salt (runs on the calling thread)"""
+    salt = os.urandom(SALT_BYTES)
+    digest = _pbkdf2(password, salt, iterations)
+    return f"{HASH_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_hash(stored_hash, password):
+    """Check a password against a stored hash (runs on the calling thread)"""
+    try:
+        iterations, salt, expected = parse_hash(stored_hash)
+    except ValueError:
+        return False  # Corrupt or unknown hash format never matches
+    return hmac.compare_digest(_pbkdf2(password, salt, iterations), expected)
+
+
+class PasswordHasher:
+    def __init__(self, iterations=DEFAULT_ITERATIONS, workers=None):
+        """Start a pool of hashing threads (defaults to one per CPU)"""
+        self.iterations = iterations
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix="pbkdf2")
+
+    # ---------- sync entry points ----------
+
+    def hash(self, password):
+        """Hash a password on the pool and wait for the result"""
+        return self.executor.submit(make_hash, password, self.iterations).result()
+
+    def verify(self, stored_hash, password):
+        """Verify a password on the pool and wait for the result"""
+        return self.executor.submit(verify_hash, stored_hash, password).result()
+
+    def hash_many(self, passwords):
+        """Hash several passwords in parallel, results in the same order"""
+        futures = [self.executor.submit(make_hash, password, self.iterations)
+                   for password in passwords]
+        return [future.result() for future in futures]
+
+    # ---------- asyncio entry points ----------
+
+    async def hash_async(self, password):
+        """Hash a password without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, make_hash, password, self.iterations)
+
+    async def verify_async(self, stored_hash, password):
+        """Verify a password without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, verify_hash, stored_hash, password)
+
+    # ---------- upgrades ----------
+
+    def needs_rehash(self, stored_hash):
+        """True when a hash was made with a different cost or the old format"""
+        if not stored_hash.startswith(HASH_SCHEME + "$"):
+            return True
+        try:
+            return parse_hash(stored_hash)[0] != self.iterations
+        except ValueError:
+            return True
+
+    def close(self):
+        """Stop the hashing threads"""
+        self.executor.shutdown(wait=True)
+
+
+def benchmark_logins(worker_counts=(1, 2, 4, 8), logins=64, iterations=DEFAULT_ITERATIONS):
+    """Measure login verifications per second for each pool size"""
+    stored = make_hash("benchmark-password", iterations)
+    results = {}
+
+    print(f"{'workers':>8} {'logins/sec':>12} {'speedup':>8}")
+    for workers in worker_counts:
+        hasher = PasswordHasher(iterations=iterations, workers=workers)
+        start = time.perf_counter()
+        futures = [hasher.executor.submit(verify_hash, stored, "benchmark-password")
+                   for _ in range(logins)]
+        assert all(future.result() for future in futures)
+        elapsed = time.perf_counter() - start
+        hasher.close()
+
+        results[workers] = logins / elapsed
+        speedup = results[workers] / results[worker_counts[0]]
+        print(f"{workers:>8} {results[workers]:>12.1f} {speedup:>7.2f}x")
+
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_logins()
@@ -0,0 +1,932 @@
+# service.py - Group 7
+"""Headless course discussion service
+
+ForumService holds every operation of the platform without any input()
+or print(): methods take the acting user as an argument, return plain
+data and report failures by raising
+- PermissionError when the user may not do this,
+- LookupError when a user, course or moderation action does not exist,
+- ValueError for bad arguments,
+- sqlite3.IntegrityError when a username or course code is taken.
+
+It is safe to call from many threads at once (reads go to the reader
+pool, writes are serialized on the single writer), which is what
+api_server.py does. program.py puts the interactive menus on top.
+"""
+import sqlite3
+import time
+from concurrent.futures import Future
+
+import analytics
+import attachments
+import catalog
+import feed
+import migrations
+import moderation
+import stats
+from analytics import DEFAULT_REFRESH_BATCH, TOP_CONTRIBUTORS
+from archive import DEFAULT_BATCH_SIZE, Archiver, default_archive_path
+from attachments import CHUNK_SIZE, DEFAULT_COURSE_QUOTA, MAX_ATTACHMENT_SIZE
+from cache import LRUCache
+from catalog import CATALOG_PAGE_SIZE
+from database import ConnectionManager
+from feed import DEFAULT_WAIT_SECONDS, FEED_LIMIT, ChangeNotifier
+from passwords import DEFAULT_ITERATIONS, PasswordHasher
+from moderation import DEFAULT_PURGE_AFTER, PurgeJob
+from sessions import DEFAULT_SESSION_TTL, SessionStore, load_secret
+from write_queue import DEFAULT_MAX_BATCH, DEFAULT_MAX_DELAY_MS, GroupCommitWriter
+
+# How many messages are shown per page when reading a course
+MESSAGE_PAGE_SIZE = 20
+
+# How many threads (root posts with all their replies) are shown per page
+THREAD_PAGE_SIZE = 10
+
+# Deepest reply allowed (a root post has depth 0); each level adds 30 bytes to the path
+MAX_REPLY_DEPTH = 50
+
+# How many users' course lists / enrollment checks are kept in memory
+COURSE_CACHE_SIZE = 4096
+
+_MY_COURSES_SQL = '''
+    SELECT c.id, c.course_code, c.course_name, u.username
+    FROM courses c
+    JOIN enrollments e ON c.id = e.course_id
+    JOIN users u ON c.created_by = u.id
+    WHERE e.user_id = ?
+    ORDER BY c.course_code
+'''
+
+# Enrollment join keeps results inside the user's own courses
+_SEARCH_SQL = '''
+    SELECT m.id, c.course_code, u.username, m.posted_at,
+           snippet(messages_fts, 0, '[', ']', '...', 12), rank, m.course_id
+    FROM messages_fts
+    JOIN messages m ON m.id = messages_fts.rowid
+    JOIN enrollments e ON e.course_id = m.course_id AND e.user_id = ?
+    JOIN courses c ON c.id = m.course_id
+    JOIN users u ON u.id = m.user_id
+    WHERE messages_fts MATCH ? AND m.deleted_at IS NULL
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+'''
+
+# Posts of a path range, depth first. Each path segment is 30 characters
+# (see migration 11); tombstones only show up, without text or author,
+# while live replies hang below them.
+_THREAD_SQL = '''
+    SELECT m.id, m.parent_id, length(m.path) / 30 - 1, m.reply_count,
+           CASE WHEN m.deleted_at IS NULL THEN m.message END,
+           CASE WHEN m.deleted_at IS NULL THEN u.username END,
+           m.posted_at
+    FROM messages m
+    JOIN users u ON m.user_id = u.id
+    WHERE m.course_id = ? AND m.path >= ? AND m.path < ?
+      AND (m.deleted_at IS NULL OR m.reply_count > 0)
+    ORDER BY m.path
+'''
+
+
+class ForumService:
+    def __init__(self, db_path='course_forum.db', read_pool_size=4,
+                 busy_timeout=5000, synchronous="NORMAL",
+                 password_iterations=DEFAULT_ITERATIONS, hash_workers=None,
+                 session_ttl=DEFAULT_SESSION_TTL, persist_sessions=False,
+                 cache_size=COURSE_CACHE_SIZE, metrics=None,
+                 write_behind=False, group_commit_size=DEFAULT_MAX_BATCH,
+                 group_commit_ms=DEFAULT_MAX_DELAY_MS, purge_interval=None,
+                 purge_after=DEFAULT_PURGE_AFTER, attachment_quota=DEFAULT_COURSE_QUOTA):
+        """Open the database and start the service's worker threads"""
+        started = time.perf_counter()
+        self.db_path = db_path
+        self.attachment_quota = attachment_quota  # Attachment bytes allowed per course
+        self.hasher = PasswordHasher(iterations=password_iterations, workers=hash_workers)
+
+        # Read-through caches for "my courses" and "am I enrolled" lookups
+        self.course_cache = LRUCache(maxsize=cache_size)
+        self.enrollment_cache = LRUCache(maxsize=cache_size)
+        self._cache_generation = 0
+
+        # Instrumentation is only installed when a Metrics object is given
+        self.metrics = metrics
+        self.setup_database(read_pool_size, busy_timeout, synchronous)
+
+        # Cold messages live in a second file, attached only when needed
+        self.archive = Archiver(self.db, default_archive_path(db_path))
+        self.archive.reserve_ids()
+
+        # Persisted sessions need a signing key that survives restarts
+        key_path = db_path + ".key" if persist_sessions and db_path != ":memory:" else None
+        self.sessions = SessionStore(
+            load_secret(key_path),
+            ttl=session_ttl,
+            db=self.db if persist_sessions else None
+        )
+
+        # Wakes change-feed waiters as soon as a change is committed
+        self.notifier = ChangeNotifier()
+
+        # Optional write-behind mode: posts share commits on a writer thread
+        self.write_queue = None
+        if write_behind:
+            self.write_queue = GroupCommitWriter(
+                self.db,
+                max_batch=group_commit_size,
+                max_delay_ms=group_commit_ms,
+                on_commit=lambda posts: self.notifier.publish({course_id for _, course_id, _ in posts})
+            )
+
+        # Optional background purge of old soft-deleted posts (seconds between runs)
+        self.purge_job = None
+        if purge_interval:
+            self.purge_job = PurgeJob(self.db, interval=purge_interval, older_than=purge_after)
+
+        if self.metrics is not None:
+            self.metrics.instrument(self)
+            self.metrics.add_collector(self._cache_metrics)
+        self._record_startup(started)
+
+    def _record_startup(self, started):
+        """Remember how long opening the service took (also a gauge with metrics on)"""
+        self.startup_seconds = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.set_gauge("forum_startup_seconds", self.startup_seconds,
+                                   help_text="Seconds it took to open the service")
+
+    def setup_database(self, read_pool_size=4, busy_timeout=5000, synchronous="NORMAL"):
+        """Open the database and bring its schema up to date, return the migrations applied"""
+        self.db, applied = self._open_database(self.db_path, read_pool_size, busy_timeout, synchronous)
+        return applied
+
+    def _open_database(self, path, read_pool_size=4, busy_timeout=5000, synchronous="NORMAL"):
+        """Open and migrate one database file, return (ConnectionManager, migrations applied)"""
+        hooks = {}
+        if self.metrics is not None:
+            hooks = {
+                "connection_factory": self.metrics.connection_factory(),
+                "on_connect": self.metrics.on_connect,
+            }
+
+        db = ConnectionManager(
+            path,
+            read_pool_size=read_pool_size,
+            busy_timeout=busy_timeout,
+            synchronous=synchronous,
+            **hooks
+        )
+
+        # Only runs DDL when the stored schema version is behind
+        with db.writer() as conn:
+            return db, migrations.migrate(conn)
+
+    def _db_for(self, course_id):
+        """ConnectionManager of the database holding a course (see sharding.py)"""
+        return self.db
+
+    def _course_writer(self, course_id):
+        """Writer transaction for changes to one course's rows
+
+        Sharding makes sure the course is still held by that database.
+        """
+        return self._db_for(course_id).writer()
+
+    def _archive_for(self, course_id):
+        """Archiver of the database holding a course"""
+        return self.archive
+
+    def close(self):
+        """Close all database connections and worker threads"""
+        if self.write_queue is not None:
+            self.write_queue.close()  # Commits any posts still queued
+        if self.purge_job is not None:
+            self.purge_job.close()
+        self.hasher.close()
+        self.db.close()
+
+    # ================= USERS AND SESSIONS =================
+
+    def hash_password(self, password):
+        """Scramble password for security"""
+        return self.hasher.hash(password)
+
+    def check_password(self, stored_hash, password):
+        """Check if password is correct"""
+        return self.hasher.verify(stored_hash, password)
+
+    def create_user(self, username, password, full_name, role):
+        """Hash the password and save a new user, return the user id
+
+        Raises sqlite3.IntegrityError if the username is taken.
+        """
+        if role not in ("staff", "student"):
+            raise ValueError("role must be 'staff' or 'student'")
+
+        # Hash password
+        password_hash = self.hash_password(password)
+
+        # Save to database (SAFE: using ? placeholders)
+        with self.db.writer() as conn:
+            cursor = conn.execute(
+                "INSERT INTO users (username, password_hash, role, full_name) VALUES (?, ?, ?, ?)",
+                (username, password_hash, role, full_name)
+            )
+            return cursor.lastrowid
+
+    def authenticate(self, username, password):
+        """Check a username and password, return (user_id, role) or None"""
+        # Get user from database (SAFE: using ? placeholder)
+        with self.db.reader() as conn:
+            user = conn.execute(
+                "SELECT id, password_hash, role FROM users WHERE username = ?",
+                (username,)
+            ).fetchone()
+
+        if not user:
+            return None
+
+        user_id, stored_hash, role = user
+        if not self.check_password(stored_hash, password):
+            return None
+
+        # Upgrade old-format or old-cost hashes now that we know the password
+        if self.hasher.needs_rehash(stored_hash):
+            with self.db.writer() as conn:
+                conn.execute(
+                    "UPDATE users SET password_hash = ? WHERE id = ?",
+                    (self.hash_password(password), user_id)
+                )
+
+        return user_id, role
+
+    def open_session(self, username, password):
+        """Check the password once and start a session
+
+        Returns (token, user_id, role), or None for an unknown user or a
+        wrong password (the two are not told apart).
+        """
+        result = self.authenticate(username, password)
+        if not result:
+            return None
+        user_id, role = result
+        return self.sessions.create(user_id, username, role), user_id, role
+
+    def session(self, token):
+        """The Session (user_id, username, role, expires_at) of a valid token, else None"""
+        return self.sessions.validate(token)
+
+    def close_session(self, token):
+        """End a session (logout)"""
+        self.sessions.revoke(token)
+
+    # ================= COURSES =================
+
+    def add_course(self, user_id, course_code, course_name):
+        """Save a new course and enroll its creator, return the course id
+
+        Raises sqlite3.IntegrityError if the course code is taken.
+        """
+        with self.db.writer() as conn:
+            # Create course (SAFE: using ? placeholders)
+            cursor = conn.execute(
+                "INSERT INTO courses (course_code, course_name, created_by) VALUES (?, ?, ?)",
+                (course_code, course_name, user_id)
+            )
+
+            # Auto-enroll staff in their own course
+            course_id = cursor.lastrowid
+            conn.execute(
+                "INSERT INTO enrollments (user_id, course_id) VALUES (?, ?)",
+                (user_id, course_id)
+            )
+
+        self.invalidate_enrollment(user_id, course_id)
+        return course_id
+
+    def get_course(self, course_id):
+        """(course_code, course_name) of a course; LookupError if there is none"""
+        with self._db_for(course_id).reader() as conn:
+            row = conn.execute(
+                "SELECT course_code, course_name FROM courses WHERE id = ?",
+                (course_id,)
+            ).fetchone()
+        if row is None:
+            raise LookupError(f"No course {course_id}")
+        return row
+
+    def owned_courses(self, staff_id):
+        """(id, course_code) of the courses a staff member created"""
+        with self.db.reader() as conn:
+            return conn.execute(
+                "SELECT id, course_code FROM courses WHERE created_by = ? ORDER BY course_code",
+                (staff_id,)
+            ).fetchall()
+
+    def course_ids_by_code(self, course_codes):
+        """Course ids for a list of codes, in the same order; LookupError for an unknown code"""
+        course_ids = []
+        with self.db.reader() as conn:
+            for code in course_codes:
+                row = conn.execute("SELECT id FROM courses WHERE course_code = ?", (code,)).fetchone()
+                if row is None:
+                    raise LookupError(f"No course with code {code}")
+                course_ids.append(row[0])
+        return course_ids
+
+    def course_activity(self, course_ids):
+        """{course_id: (course_id, message_count, member_count, last_posted_at)}"""
+        # Activity counters are one primary-key lookup per course
+        with self.db.reader() as conn:
+            return stats.get_stats(conn, course_ids)
+
+    def course_catalog(self, user_id, prefix="", by="code", after=None, page_size=CATALOG_PAGE_SIZE):
+        """One page of courses a user has not joined yet, with their activity counters
+
+        `prefix` narrows the list to codes (by="code") or names (by="name")
+        starting with it, ignoring case. Returns {"courses": rows,
+        "next": cursor}; pass the cursor back as `after` for the next page.
+        """
+        with self.db.reader() as conn:
+            return catalog.fetch_page(conn, user_id, prefix, by, after, page_size)
+
+    def check_query_plans(self):
+        """Problems found in the catalog query plans (empty when they use their indexes)"""
+        with self.db.reader() as conn:
+            return catalog.check_plans(conn)
+
+    def enroll(self, user_id, course_id):
+        """Add a user to a course"""
+        # Join course (SAFE: using ? placeholders)
+        with self._course_writer(course_id) as conn:
+            conn.execute(
+                "INSERT INTO enrollments (user_id, course_id) VALUES (?, ?)",
+                (user_id, course_id)
+            )
+        self.invalidate_enrollment(user_id, course_id)
+
+    def get_my_courses(self, user_id):
+        """Courses a user is enrolled in as (id, code, name, creator) rows, cached"""
+        courses = self.course_cache.get(user_id)
+        if courses is not None:
+            return courses
+
+        generation = self._cache_generation
+        courses = self._load_my_courses(user_id)
+
+        # Don't cache a result an enrollment change may have made stale meanwhile
+        if generation == self._cache_generation:
+            self.course_cache.set(user_id, courses)
+        return courses
+
+    def _load_my_courses(self, user_id):
+        """get_my_courses without the cache"""
+        # Get user's courses (SAFE: using ? placeholder)
+        with self.db.reader() as conn:
+            return tuple(conn.execute(_MY_COURSES_SQL, (user_id,)).fetchall())
+
+    def is_enrolled(self, user_id, course_id):
+        """Check if a user is enrolled in a course, cached"""
+        key = (user_id, course_id)
+        enrolled = self.enrollment_cache.get(key)
+        if enrolled is not None:
+            return enrolled
+
+        generation = self._cache_generation
+
+        courses = self.course_cache.get(user_id)
+        if courses is not None:
+            enrolled = any(course[0] == course_id for course in courses)
+        else:
+            # Primary key lookup on enrollments (user_id, course_id)
+            with self._db_for(course_id).reader() as conn:
+                enrolled = conn.execute(
+                    "SELECT 1 FROM enrollments WHERE user_id = ? AND course_id = ?",
+                    (user_id, course_id)
+                ).fetchone() is not None
+
+        if generation == self._cache_generation:
+            self.enrollment_cache.set(key, enrolled)
+        return enrolled
+
+    def invalidate_enrollment(self, user_id, course_id):
+        """Forget cached data after a user joins or leaves a course
+
+        Must be called after the enrollment change is committed, by every
+        path that adds or removes enrollments.
+        """
+        self._cache_generation += 1
+        self.course_cache.pop(user_id)
+        self.enrollment_cache.pop((user_id, course_id))
+
+    def _cache_metrics(self):
+        """Cache and session counters as gauges for the metrics export"""
+        samples = []
+        for cache_name, cache_stats in self.cache_stats().items():
+            for field in ("hits", "misses", "evictions", "size"):
+                samples.append((f"forum_cache_{field}", [("cache", cache_name)], cache_stats[field],
+                                f"Course cache {field}"))
+        samples.append(("forum_sessions_active", [], self.sessions.stats()["size"],
+                        "Sessions held in memory"))
+        return samples
+
+    def cache_stats(self):
+        """Hit/miss counters of the course caches"""
+        return {
+            "courses": self.course_cache.stats(),
+            "enrollments": self.enrollment_cache.stats(),
+        }
+
+    # ================= MESSAGES =================
+
+    def submit_message(self, user_id, course_id, message, parent_id=None):
+        """Save a message, return a Future for its id that resolves once it is durable
+
+        `parent_id` makes the message a reply to a live post of the same
+        course (LookupError otherwise). In write-behind mode the post is
+        queued for the next group commit; otherwise it is committed right
+        away and the Future is already done.
+        """
+        if parent_id is not None:
+            self._check_parent(course_id, parent_id)
+        if self.write_queue is not None:
+            return self.write_queue.submit(course_id, user_id, message, parent_id)
+
+        future = Future()
+        # Save message (SAFE: using ? placeholders)
+        with self.db.writer() as conn:
+            cursor = conn.execute(
+                "INSERT INTO messages (course_id, user_id, message, parent_id) VALUES (?, ?, ?, ?)",
+                (course_id, user_id, message, parent_id)
+            )
+        future.set_result(cursor.lastrowid)
+        self.notifier.publish([course_id])
+        return future
+
+    def _check_parent(self, course_id, parent_id):
+        """A reply needs a live post of the same course that is not too deep"""
+        with self._db_for(course_id).reader() as conn:
+            row = conn.execute(
+                "SELECT length(path) / 30 - 1 FROM messages WHERE id = ? AND course_id = ? AND deleted_at IS NULL",
+                (parent_id, course_id)
+            ).fetchone()
+        if row is None:
+            raise LookupError(f"No message {parent_id} in this course")
+        if row[0] >= MAX_REPLY_DEPTH:
+            raise ValueError(f"Replies can only be nested {MAX_REPLY_DEPTH} levels deep")
+
+    def add_message(self, user_id, course_id, message, parent_id=None):
+        """Save a message and return its id once it is committed"""
+        return self.submit_message(user_id, course_id, message, parent_id).result()
+
+    def fetch_message_page(self, course_id, page_size=MESSAGE_PAGE_SIZE, before=None, after=None):
+        """Get one page of course messages using a (posted_at, id) cursor
+
+        With no cursor the newest page is returned. `before` gives the page
+        of older messages and `after` the page of newer ones. Messages come
+        back oldest first, together with the cursors for the next pages
+        (None when there is nothing more in that direction) and
+        "attachments": {message_id: [(attachment_id, filename,
+        content_type, size), ...]}, metadata only.
+
+        Archived messages continue the same timeline: the archive is only
+        read once a page runs past the oldest message still in the live
+        database.
+        """
+        archive = self._archive_for(course_id)
+        with self._db_for(course_id).reader() as conn:
+            if after is not None:
+                # Newer page: start in the archive if the cursor points into it
+                rows = []
+                if self._cursor_in_archive(conn, archive, course_id, after):
+                    rows = archive.newer(conn, course_id, after, page_size + 1)
+                if len(rows) <= page_size:
+                    cursor = (rows[-1][3], rows[-1][0]) if rows else after
+                    rows += conn.execute('''
+                        SELECT m.id, m.message, u.username, m.posted_at
+                        FROM messages m
+                        JOIN users u ON m.user_id = u.id
+                        WHERE m.course_id = ? AND m.deleted_at IS NULL AND (m.posted_at, m.id) > (?, ?)
+                        ORDER BY m.posted_at, m.id
+                        LIMIT ?
+                    ''', (course_id, cursor[0], cursor[1], page_size + 1 - len(rows))).fetchall()
+                has_older, has_newer = True, len(rows) > page_size
+                rows = rows[:page_size]
+            else:
+                if before is not None:
+                    # Older page: walk the index backwards from the cursor
+                    rows = conn.execute('''
+                        SELECT m.id, m.message, u.username, m.posted_at
+                        FROM messages m
+                        JOIN users u ON m.user_id = u.id
+                        WHERE m.course_id = ? AND m.deleted_at IS NULL AND (m.posted_at, m.id) < (?, ?)
+                        ORDER BY m.posted_at DESC, m.id DESC
+                        LIMIT ?
+                    ''', (course_id, before[0], before[1], page_size + 1)).fetchall()
+                else:
+                    # Newest page
+                    rows = conn.execute('''
+                        SELECT m.id, m.message, u.username, m.posted_at
+                        FROM messages m
+                        JOIN users u ON m.user_id = u.id
+                        WHERE m.course_id = ? AND m.deleted_at IS NULL
+                        ORDER BY m.posted_at DESC, m.id DESC
+                        LIMIT ?
+                    ''', (course_id, page_size + 1)).fetchall()
+
+                # Ran out of live messages: carry on into the archive
+                if len(rows) <= page_size and archive.attach_reader(conn):
+                    cursor = (rows[-1][3], rows[-1][0]) if rows else before
+                    rows += archive.older(conn, course_id, cursor, page_size + 1 - len(rows))
+                has_older, has_newer = len(rows) > page_size, before is not None
+                rows = rows[:page_size][::-1]
+            files = attachments.metadata(conn, [row[0] for row in rows])
+
+        older = (rows[0][3], rows[0][0]) if rows and has_older else None
+        newer = (rows[-1][3], rows[-1][0]) if rows and has_newer else None
+        return {"messages": rows, "attachments": files, "older": older, "newer": newer}
+
+    @staticmethod
+    def _cursor_in_archive(conn, archive, course_id, cursor):
+        """True if a cursor is older than every live message of the course"""
+        if not archive.exists():
+            return False
+        oldest = conn.execute('''
+            SELECT posted_at, id FROM messages
+            WHERE course_id = ? AND deleted_at IS NULL
+            ORDER BY posted_at, id
+            LIMIT 1
+        ''', (course_id,)).fetchone()
+        if oldest is not None and tuple(cursor) >= oldest:
+            return False
+        return archive.attach_reader(conn)
+
+    def fetch_thread_page(self, course_id, page_size=THREAD_PAGE_SIZE, before=None, after=None):
+        """Get one page of threads: `page_size` root posts with all their replies
+
+        Works like fetch_message_page, but the cursors are root-post paths
+        and each page is read with one range scan of the path index.
+        "attachments" maps message ids to attachment metadata.
+        Messages come back depth first as (id, parent_id, depth,
+        reply_count, message, username, posted_at); message and username
+        are None for a removed post that still has live replies. Archived
+        posts are only in the flat timeline of fetch_message_page.
+        """
+        with self._db_for(course_id).reader() as conn:
+            # Root posts that have something to show (a live root, or live replies)
+            roots_sql = '''
+                SELECT path FROM messages
+                WHERE course_id = ? AND parent_id IS NULL {}
+                  AND (deleted_at IS NULL OR reply_count > 0)
+                ORDER BY path {}
+                LIMIT ?
+            '''
+            if after is not None:
+                roots = conn.execute(roots_sql.format("AND path > ?", "ASC"),
+                                     (course_id, after, page_size + 1)).fetchall()
+                has_older, has_newer = True, len(roots) > page_size
+                roots = roots[:page_size]
+            else:
+                if before is not None:
+                    roots = conn.execute(roots_sql.format("AND path < ?", "DESC"),
+                                         (course_id, before, page_size + 1)).fetchall()
+                else:
+                    roots = conn.execute(roots_sql.format("", "DESC"),
+                                         (course_id, page_size + 1)).fetchall()
+                has_older, has_newer = len(roots) > page_size, before is not None
+                roots = roots[:page_size][::-1]
+
+            rows = []
+            if roots:
+                rows = conn.execute(_THREAD_SQL, (course_id, roots[0][0], roots[-1][0] + "~")).fetchall()
+            files = attachments.metadata(conn, [row[0] for row in rows if row[4] is not None])
+
+        older = roots[0][0] if roots and has_older else None
+        newer = roots[-1][0] if roots and has_newer else None
+        return {"messages": rows, "attachments": files, "older": older, "newer": newer}
+
+    def fetch_thread(self, course_id, message_id):
+        """One post and every reply below it, depth first (rows as in fetch_thread_page)
+
+        LookupError if the post is not in the course or has been removed
+        with no live replies left.
+        """
+        with self._db_for(course_id).reader() as conn:
+            row = conn.execute(
+                "SELECT path FROM messages WHERE id = ? AND course_id = ?", (message_id, course_id)
+            ).fetchone()
+            rows = conn.execute(_THREAD_SQL, (course_id, row[0], row[0] + "~")).fetchall() if row else []
+        if not rows:
+            raise LookupError(f"No message {message_id} in this course")
+        return rows
+
+    def get_all_course_messages(self, course_id):
+        """Every live message in a course, newest first"""
+        with self._db_for(course_id).reader() as conn:
+            return conn.execute('''
+                SELECT m.id, m.message, u.username, m.posted_at
+                FROM messages m
+                JOIN users u ON m.user_id = u.id
+                WHERE m.course_id = ? AND m.deleted_at IS NULL
+                ORDER BY m.posted_at DESC, m.id DESC
+            ''', (course_id,)).fetchall()
+
+    def flush_writes(self):
+        """Wait until every queued post is committed (write-behind mode)"""
+        if self.write_queue is not None:
+            self.write_queue.flush()
+
+    # ================= ATTACHMENTS =================
+
+    def attach_file(self, user_id, course_id, message_id, filename, stream, size, content_type=None):
+        """Attach a file to one of the user's own live posts, return the attachment id
+
+        The bytes are streamed from `stream` (a binary file object holding
+        exactly `size` bytes) in chunks. ValueError for a file larger than
+        MAX_ATTACHMENT_SIZE or one that would take the course over its
+        quota, PermissionError for someone else's post.
+        """
+        filename = attachments.clean_filename(filename)
+        content_type = attachments.clean_content_type(content_type)
+        if not 0 <= size <= MAX_ATTACHMENT_SIZE:
+            raise ValueError(f"Attachments are limited to {MAX_ATTACHMENT_SIZE // (1024 * 1024)} MB")
+
+        with self._course_writer(course_id) as conn:
+            # Quota check and insert in one transaction, even across processes
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT user_id FROM messages WHERE id = ? AND course_id = ? AND deleted_at IS NULL",
+                (message_id, course_id)
+            ).fetchone()
+            if row is None:
+                raise LookupError(f"No message {message_id} in this course")
+            if row[0] != user_id:
+                raise PermissionError("You can only attach files to your own posts")
+            free = self.attachment_quota - attachments.course_usage(conn, course_id)
+            if size > free:
+                raise ValueError(f"Not enough attachment space left in this course ({max(free, 0)} bytes free)")
+
+            blob_id = attachments.store(conn, stream, size)
+            return conn.execute('''
+                INSERT INTO attachments (message_id, course_id, blob_id, filename, content_type, size)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (message_id, course_id, blob_id, filename, content_type, size)).lastrowid
+
+    def attachment_metadata(self, course_id, message_ids):
+        """{message_id: [(attachment_id, filename, content_type, size), ...]} for some posts"""
+        with self._db_for(course_id).reader() as conn:
+            return attachments.metadata(conn, message_ids)
+
+    @staticmethod
+    def _attachment_row(conn, course_id, attachment_id):
+        """(id, message_id, filename, content_type, size, blob_id); hidden while its post is removed"""
+        row = conn.execute('''
+            SELECT a.id, a.message_id, a.filename, a.content_type, a.size, a.blob_id
+            FROM attachments a
+            WHERE a.id = ? AND a.course_id = ? AND NOT EXISTS (
+                SELECT 1 FROM messages m WHERE m.id = a.message_id AND m.deleted_at IS NOT NULL
+            )
+        ''', (attachment_id, course_id)).fetchone()
+        if row is None:
+            raise LookupError(f"No attachment {attachment_id} in this course")
+        return row
+
+    def attachment_info(self, course_id, attachment_id):
+        """(attachment_id, message_id, filename, content_type, size) of one attachment"""
+        with self._db_for(course_id).reader() as conn:
+            return self._attachment_row(conn, course_id, attachment_id)[:5]
+
+    def read_attachment(self, course_id, attachment_id, offset=0, length=CHUNK_SIZE):
+        """One chunk of an attachment's bytes (b"" past the end)"""
+        with self._db_for(course_id).reader() as conn:
+            blob_id = self._attachment_row(conn, course_id, attachment_id)[5]
+            return attachments.read_chunk(conn, blob_id, offset, length)
+
+    def save_attachment(self, course_id, attachment_id, out):
+        """Stream an attachment into a binary file object, return the bytes written"""
+        with self._db_for(course_id).reader() as conn:
+            blob_id = self._attachment_row(conn, course_id, attachment_id)[5]
+            return attachments.copy_out(conn, blob_id, out)
+
+    # ================= CHANGE FEED =================
+
+    def feed_head(self):
+        """Cursor for a client that only wants changes from now on"""
+        with self.db.reader() as conn:
+            return feed.head(conn)
+
+    def fetch_feed(self, user_id, cursor, limit=FEED_LIMIT, course_ids=None):
+        """Changes in a user's courses after `cursor`
+
+        Returns {"events": [(seq, kind, course_id, message_id, username,
+        message, posted_at)...], "cursor": seq to pass next time}. kind is
+        'post', 'delete' or 'restore'.
+        """
+        with self.db.reader() as conn:
+            events = feed.fetch_events(conn, user_id, cursor, limit, course_ids)
+        return {"events": events, "cursor": events[-1][0] if events else cursor}
+
+    def wait_for_feed(self, user_id, cursor, timeout=DEFAULT_WAIT_SECONDS, course_ids=None):
+        """Like fetch_feed, but wait up to `timeout` seconds for something to happen"""
+        deadline = time.monotonic() + timeout
+        if course_ids is None:
+            course_ids = [course[0] for course in self.get_my_courses(user_id)]
+        while True:
+            version = self.notifier.version  # Before querying, so no change slips in between
+            page = self.fetch_feed(user_id, cursor, course_ids=course_ids)
+            remaining = deadline - time.monotonic()
+            if page["events"] or remaining <= 0:
+                return page
+            self.notifier.wait(course_ids, version, remaining)
+
+    # ================= SEARCH =================
+
+    @staticmethod
+    def _fts_query(text):
+        """Turn user input into a safe FTS5 query
+
+        Every word is quoted so FTS5 operators in the input are treated as
+        plain text. A trailing * on a word is kept as a prefix search.
+        """
+        terms = []
+        for word in text.split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*")
+            if word:
+                terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+        return " ".join(terms)
+
+    def search_messages(self, user_id, query, page=1, page_size=MESSAGE_PAGE_SIZE):
+        """Full-text search in a user's courses, best matches first
+
+        Returns (results, has_more). Each result is
+        (message_id, course_code, username, posted_at, snippet).
+        """
+        match = self._fts_query(query)
+        if not match or not user_id:
+            return [], False
+
+        with self.db.reader() as conn:
+            rows = conn.execute(_SEARCH_SQL, (user_id, match, page_size + 1, (page - 1) * page_size)).fetchall()
+
+        return [row[:5] for row in rows[:page_size]], len(rows) > page_size
+
+    # ================= MODERATION =================
+
+    def _check_course_owner(self, conn, staff_id, course_id):
+        """Staff may only moderate the courses they created"""
+        row = conn.execute("SELECT created_by FROM courses WHERE id = ?", (course_id,)).fetchone()
+        if row is None or row[0] != staff_id:
+            raise PermissionError("You can only moderate your own courses")
+
+    def moderate_messages(self, staff_id, course_id, message_id=None, author=None,
+                          since=None, until=None, keyword=None):
+        """Soft-delete the posts in a course matching every given filter
+
+        `author` is a username, `since`/`until` bound the post time
+        (until is exclusive) and `keyword` is searched like search_messages.
+        Everything happens in one UPDATE. Returns (action_id, count); the
+        action can be undone with restore_moderation until it is purged.
+        """
+        author_id = match = None
+        if keyword is not None:
+            match = self._fts_query(keyword)
+            if not match:
+                raise ValueError("Keyword cannot be empty")
+
+        with self._course_writer(course_id) as conn:
+            self._check_course_owner(conn, staff_id, course_id)
+            if author is not None:
+                row = conn.execute("SELECT id FROM users WHERE username = ?", (author,)).fetchone()
+                if row is None:
+                    raise LookupError(f"No user named {author}")
+                author_id = row[0]
+            action_id, count = moderation.soft_delete(conn, staff_id, course_id, message_id=message_id,
+                                                      author_id=author_id, since=since, until=until,
+                                                      match=match)
+        if count:
+            self.notifier.publish([course_id])
+        return action_id, count
+
+    def restore_moderation(self, staff_id, action_id, course_id=None):
+        """Undo a moderation action, return how many posts came back
+
+        `course_id` is where the action was taken; it is needed to find
+        the action once courses are spread over several databases.
+        """
+        with self._course_writer(course_id) as conn:
+            row = conn.execute("SELECT course_id FROM moderation_actions WHERE id = ?", (action_id,)).fetchone()
+            if row is None or course_id is not None and row[0] != course_id:
+                raise LookupError(f"No moderation action {action_id}")
+            self._check_course_owner(conn, staff_id, row[0])
+            count = moderation.restore(conn, action_id)
+        if count:
+            self.notifier.publish([row[0]])
+        return count
+
+    def moderation_history(self, course_id, limit=10):
+        """Latest moderation actions of a course, see moderation.recent_actions"""
+        with self._db_for(course_id).reader() as conn:
+            return moderation.recent_actions(conn, course_id, limit)
+
+    def delete_message(self, message_id, staff_id):
+        """Soft-delete one message, return the moderation action id (None if not found)"""
+        with self.db.reader() as conn:
+            row = conn.execute(
+                "SELECT course_id FROM messages WHERE id = ? AND deleted_at IS NULL", (message_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        action_id, _ = self.moderate_messages(staff_id, row[0], message_id=message_id)
+        return action_id
+
+    # ================= ANALYTICS =================
+
+    def course_report(self, staff_id, course_id, since=None, until=None, top=TOP_CONTRIBUTORS):
+        """Activity reports of a course for the staff who created it
+
+        `since`/`until` are 'YYYY-MM-DD' (until exclusive) and default to
+        the last analytics.REPORT_DAYS days. The rollups are brought up to
+        date first, so new posts are in. Returns analytics.course_report().
+        """
+        if since is None or until is None:
+            since, until = analytics.report_period()
+        db = self._db_for(course_id)
+        with db.reader() as conn:
+            row = conn.execute("SELECT created_by FROM courses WHERE id = ?", (course_id,)).fetchone()
+            if row is None or row[0] != staff_id:
+                raise PermissionError("You can only see reports of your own courses")
+        analytics.refresh(db)
+        with db.reader() as conn:
+            return analytics.course_report(conn, course_id, since, until, top)
+
+    # ================= MAINTENANCE =================
+
+    def rebuild_search_index(self):
+        """Re-index every message (for databases changed outside the app)"""
+        with self.db.writer() as conn:
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+    def archive_messages(self, before=None, course_codes=(), batch_size=DEFAULT_BATCH_SIZE, compact=False):
+        """Move old messages, or those of closed courses, to the archive database
+
+        Returns how many messages moved; LookupError for an unknown course code.
+        """
+        course_ids = self.course_ids_by_code(course_codes)
+        moved = self.archive.archive_messages(before=before, course_ids=course_ids, batch_size=batch_size)
+        if compact:
+            self.archive.compact()
+        return moved
+
+    def verify_course_stats(self, repair=False):
+        """Check course_stats against raw aggregates, optionally rebuild it
+
+        Returns the mismatches found (before any repair) as
+        (course_id, stored row, expected row).
+        """
+        if self.archive.exists():
+            # Counters include archived messages, so check against both files
+            mismatches = self.archive.verify_stats()
+        else:
+            with self.db.reader() as conn:
+                mismatches = stats.verify(conn)
+
+        if mismatches and repair:
+            if self.archive.exists():
+                self.archive.backfill_stats()
+            else:
+                with self.db.writer() as conn:
+                    stats.backfill(conn)
+        return mismatches
+
+    def refresh_analytics(self, batch_size=DEFAULT_REFRESH_BATCH):
+        """Count the posts made since the last refresh into the rollups, return how many"""
+        return analytics.refresh(self.db, batch_size)
+
+    def verify_analytics(self, repair=False):
+        """Check the activity rollups against raw aggregates, optionally rebuild them
+
+        Returns the mismatches found (before any repair), see analytics.verify.
+        """
+        if self.archive.exists():
+            mismatches = self.archive.verify_analytics()
+        else:
+            with self.db.reader() as conn:
+                mismatches = analytics.verify(conn)
+        if mismatches and repair:
+            self.rebuild_analytics()
+        return mismatches
+
+    def rebuild_analytics(self):
+        """Recompute the activity rollups from scratch (archived messages included)"""
+        if self.archive.exists():
+            self.archive.rebuild_analytics()
+        else:
+            with self.db.writer() as conn:
+                analytics.rebuild(conn)
+
+    def purge_tombstones(self, older_than=DEFAULT_PURGE_AFTER):
+        """Hard-delete soft-deleted posts older than the grace period, prune old feed events
+
+        Returns (posts purged, feed events pruned).
+        """
+        return moderation.purge(self.db, older_than), feed.prune(self.db)
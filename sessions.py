@@ -0,0 +1,160 @@
+# sessions.py - Group 7
+"""Signed session tokens backed by an in-memory TTL/LRU store
+
+A token is issued once after a full password check. Later requests only
+need an HMAC check and a dictionary lookup instead of 100k PBKDF2 rounds.
+Tokens look like `<session id>.<signature>`; only a SHA-256 of the
+session id is ever written to the database.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from collections import namedtuple
+
+from cache import LRUCache
+
+DEFAULT_SESSION_TTL = 8 * 60 * 60  # 8 hours
+DEFAULT_MAX_SESSIONS = 10000
+PURGE_INTERVAL = 60 * 60  # Expired rows are deleted on login at most this often
+
+Session = namedtuple("Session", ["user_id", "username", "role", "expires_at"])
+
+
+def load_secret(key_path):
+    """Read the signing key from COURSE_FORUM_SECRET or a private key file
+
+    The key file is created (readable by the owner only) on first use,
+    so persisted sessions stay valid across restarts.
+    """
+    env_secret = os.environ.get("COURSE_FORUM_SECRET")
+    if env_secret:
+        return env_secret.encode()
+    if key_path is None:
+        return secrets.token_bytes(32)  # Throwaway key, sessions die with the process
+
+    try:
+        with open(key_path, "rb") as key_file:
+            return key_file.read()
+    except FileNotFoundError:
+        secret = secrets.token_bytes(32)
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as key_file:
+            key_file.write(secret)
+        return secret
+
+
+class SessionStore:
+    def __init__(self, secret, ttl=DEFAULT_SESSION_TTL,
+                 max_sessions=DEFAULT_MAX_SESSIONS, db=None):
+        """Keep sessions in memory, and in the sessions table when `db` is given
+
+        `db` is a ConnectionManager; without it sessions end on restart
+        or when they are evicted from the in-memory store.
+        """
+        self._secret = secret
+        self.ttl = ttl
+        self.db = db
+        self._sessions = LRUCache(maxsize=max_sessions)
+        self._next_purge = 0.0
+
+    def _sign(self, session_id):
+        """HMAC-SHA256 signature for a session id"""
+        digest = hmac.new(self._secret, session_id.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    @staticmethod
+    def _storage_key(session_id):
+        """What we store instead of the session id itself"""
+        return hashlib.sha256(session_id.encode()).hexdigest()
+
+    def _session_id(self, token):
+        """Return the session id if the token signature is valid"""
+        if not token or token.count(".") != 1:
+            return None
+        session_id, signature = token.split(".")
+        # As bytes: compare_digest refuses str with non-ASCII characters
+        if not hmac.compare_digest(signature.encode(), self._sign(session_id).encode()):
+            return None
+        return session_id
+
+    def create(self, user_id, username, role):
+        """Start a session and return its token"""
+        session_id = secrets.token_urlsafe(32)
+        session = Session(user_id, username, role, time.time() + self.ttl)
+        key = self._storage_key(session_id)
+        self._sessions.set(key, session, ttl=self.ttl)
+
+        if self.db is not None:
+            with self.db.writer() as conn:
+                conn.execute(
+                    "INSERT INTO sessions (token_hash, user_id, expires_at) VALUES (?, ?, ?)",
+                    (key, user_id, session.expires_at)
+                )
+            if time.time() >= self._next_purge:
+                self._next_purge = time.time() + PURGE_INTERVAL
+                self.purge_expired()
+
+        return f"{session_id}.{self._sign(session_id)}"
+
+    def validate(self, token):
+        """Return the Session for a valid, unexpired token, else None"""
+        session_id = self._session_id(token)
+        if session_id is None:
+            return None
+
+        key = self._storage_key(session_id)
+        session = self._sessions.get(key)
+        if session is None and self.db is not None:
+            session = self._load(key)
+
+        if session is None or session.expires_at <= time.time():
+            return None
+        return session
+
+    def _load(self, key):
+        """Fetch a persisted session after a restart or eviction"""
+        with self.db.reader() as conn:
+            row = conn.execute('''
+                SELECT s.user_id, u.username, u.role, s.expires_at
+                FROM sessions s
+                JOIN users u ON s.user_id = u.id
+                WHERE s.token_hash = ?
+            ''', (key,)).fetchone()
+
+        if not row:
+            return None
+        session = Session(*row)
+        remaining = session.expires_at - time.time()
+        if remaining > 0:
+            self._sessions.set(key, session, ttl=remaining)
+        return session
+
+    def revoke(self, token):
+        """End a session (logout)"""
+        session_id = self._session_id(token)
+        if session_id is None:
+            return
+        key = self._storage_key(session_id)
+        self._sessions.pop(key)
+        if self.db is not None:
+            with self.db.writer() as conn:
+                conn.execute("DELETE FROM sessions WHERE token_hash = ?", (key,))
+
+    def purge_expired(self):
+        """Delete expired sessions from the database, return how many
+
+        create() calls this every PURGE_INTERVAL, so the table only holds
+        sessions that expired since the last login.
+        """
+        if self.db is None:
+            return 0
+        with self.db.writer() as conn:
+            cursor = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
+
+    def stats(self):
+        """In-memory store counters"""
+        return self._sessions.stats()
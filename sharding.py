@@ -0,0 +1,1001 @@
+# sharding.py - Group 7
+"""Horizontal sharding of courses across several SQLite files
+
+One SQLite file has one writer, so a busy forum is limited by how fast a
+single file can commit. Sharding gives every course a home in one of N
+files, each with its own writer, WAL, reader pool and archive:
+- course_forum.db is the global database: users, sessions and the
+  course directory (course_id -> shard). It is also shard 0, so an
+  existing single-file forum is a one-shard forum as it stands.
+- course_forum_shard1.db ... hold the other courses with their
+  enrollments, messages, moderation actions, feed events and counters,
+  plus stub rows (no password) for the users who appear in them.
+
+New courses go to shard hash(course_code) % N. After that the directory
+is authoritative, so a course keeps its shard until it is moved.
+Course-scoped operations (post, read, moderate) touch only the owning
+shard; "my courses", the catalog, search and the change feed ask every
+shard in parallel and merge. The feed cursor becomes a tuple with one
+seq per shard.
+
+Message ids stay unique across shards: shard k hands out ids from its
+own range k * 2**40 + 1 ... (see Shard.insert_message), and a moved
+course keeps its message ids. Moderation actions and attachments are
+numbered per shard and get new ids when their course moves. Activity
+rollups are kept per shard; the target counts a moved course's posts as
+they arrive (see analytics.py).
+
+Moving a course (move_course, or `python sharding.py move`) is online:
+the messages are copied to the target in batches while the course stays
+writable, then the source is locked for a short final catch-up, the
+directory is switched and a course_moves marker is left in the source.
+Every course write (posts, enrollments, moderation, attachments) that
+reaches the old shard through a stale directory hits the marker, raises
+CourseMoved, and is retried on the new shard. The old
+copy is deleted in batches afterwards. Other processes re-read the
+directory every DIRECTORY_TTL seconds. Run one moving tool at a time.
+
+Usage:
+    python sharding.py status [--db course_forum.db] [--shards 4]
+    python sharding.py move SOE505 2 [--shards 4]
+    python sharding.py rebalance [--shards 8] [--dry-run]
+    python sharding.py cleanup [--shards 4]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import analytics
+import attachments
+import catalog
+import feed
+import stats
+from analytics import DEFAULT_REFRESH_BATCH
+from archive import DEFAULT_BATCH_SIZE, Archiver, default_archive_path
+from catalog import CATALOG_PAGE_SIZE
+from feed import FEED_LIMIT
+from moderation import DEFAULT_PURGE_AFTER, PurgeJob, purge
+from service import _MY_COURSES_SQL, _SEARCH_SQL, MESSAGE_PAGE_SIZE, ForumService
+from write_queue import DEFAULT_MAX_BATCH, DEFAULT_MAX_DELAY_MS, GroupCommitWriter
+
+DEFAULT_SHARDS = 4
+# Each shard owns the message ids [k << ID_BITS, (k + 1) << ID_BITS)
+ID_BITS = 40
+# Seconds a router trusts its copy of the directory (other processes may move courses)
+DIRECTORY_TTL = 5
+DEFAULT_MOVE_BATCH = 1000
+
+log = logging.getLogger("course_forum.sharding")
+
+# Next id of this shard's range, and only if the course has not moved away.
+# message_id_floor is the last id handed out (a trigger moves it, see migration 15).
+_INSERT_SQL = '''
+    INSERT INTO messages (id, course_id, user_id, message, parent_id)
+    SELECT (SELECT message_id_floor FROM shard_info) + 1, :course_id, :user_id, :message, :parent_id
+    WHERE NOT EXISTS (SELECT 1 FROM course_moves WHERE course_id = :course_id)
+'''
+
+# Stub rows for users: enough for joins and foreign keys, but no password
+_COPY_USERS_SQL = '''
+    INSERT OR IGNORE INTO main.users (id, username, password_hash, role, full_name, created_at)
+    SELECT id, username, '!', role, full_name, created_at FROM move_source.users
+    WHERE id IN ({})
+'''
+
+# Search hits in an order every shard agrees on (bm25 ranks are per index)
+_SHARD_SEARCH_SQL = _SEARCH_SQL.replace("ORDER BY rank", "ORDER BY m.posted_at DESC, m.id DESC")
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def shard_path(db_path, index):
+    """course_forum.db -> course_forum.db (shard 0), course_forum_shard1.db, ..."""
+    if db_path == ":memory:":
+        raise ValueError("Sharding needs database files, not :memory:")
+    if index == 0:
+        return db_path
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_shard{index}{ext or '.db'}"
+
+
+def home_shard(course_code, shard_count):
+    """Shard a new course is created in (stable: does not depend on Python's hash seed)"""
+    digest = hashlib.sha1(course_code.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def merge_sorted(results, key, limit):
+    """Merge per-shard pages into one page of `limit` rows, return (rows, has_more)
+
+    `results` holds (rows, last) per shard, where rows are already sorted
+    by `key` and `last` is the last row the shard returned if it returned
+    more than `limit` rows (so it has more), else None. Rows past the
+    smallest such `last` are dropped: that shard's next rows, which were
+    not fetched, could sort before them.
+    """
+    bounds = [key(last) for _, last in results if last is not None]
+    rows = sorted((row for shard_rows, _ in results for row in shard_rows), key=key)
+    if bounds:
+        bound = min(bounds)
+        rows = [row for row in rows if key(row) <= bound]
+    return rows[:limit], len(rows) > limit or bool(bounds)
+
+
+def _copy_future(source, target):
+    """Resolve `target` like the finished `source`"""
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class CourseMoved(sqlite3.IntegrityError):
+    """A post reached a shard its course has left; reload the directory and retry"""
+
+
+class Shard:
+    def __init__(self, index, db, archive):
+        """One shard file; `db` is its migrated ConnectionManager"""
+        self.index = index
+        self.db = db
+        self.archive = archive
+        self.id_base = index << ID_BITS
+        self.id_top = ((index + 1) << ID_BITS) - 1
+        self.write_queue = None
+        self.purge_job = None
+        self.known_users = set()  # Users with a stub row here (filled by the service)
+
+        with db.writer() as conn:
+            # A file used unsharded before already has ids in its range
+            conn.execute('''
+                INSERT OR IGNORE INTO shard_info (id, shard, message_id_floor)
+                VALUES (1, :index, MAX(
+                    :base,
+                    COALESCE((SELECT MAX(id) FROM messages WHERE id BETWEEN :base AND :top), 0),
+                    COALESCE((SELECT seq FROM sqlite_sequence
+                              WHERE name = 'messages' AND seq BETWEEN :base AND :top), 0)
+                ))
+            ''', {"index": index, "base": self.id_base, "top": self.id_top})
+            stored = conn.execute("SELECT shard FROM shard_info").fetchone()[0]
+        if stored != index:
+            raise RuntimeError(f"{db.path} is shard {stored}, not shard {index}")
+        archive.reserve_ids()
+
+    def check_holds(self, conn, course_id):
+        """Raise CourseMoved if the course has been moved away (call holding the write lock)"""
+        if conn.execute("SELECT 1 FROM course_moves WHERE course_id = ?", (course_id,)).fetchone():
+            raise CourseMoved(f"Course {course_id} has moved off shard {self.index}")
+
+    def insert_message(self, conn, course_id, user_id, message, parent_id=None):
+        """INSERT one post with the next id of this shard's range, return the id
+
+        Raises CourseMoved if the course has been moved to another shard.
+        """
+        cursor = conn.execute(_INSERT_SQL, {
+            "course_id": course_id, "user_id": user_id, "message": message, "parent_id": parent_id,
+        })
+        if cursor.rowcount == 0:
+            raise CourseMoved(f"Course {course_id} has moved off shard {self.index}")
+        return cursor.lastrowid
+
+
+class ShardRouter:
+    def __init__(self, global_db, db_path, shard_count, open_database, global_archive=None):
+        """Open every shard and load the course directory
+
+        `global_db` is the ConnectionManager of db_path, which is shard 0.
+        open_database(path) opens and migrates another shard file. New
+        courses are spread over `shard_count` shards; files of higher
+        shards that still hold courses are opened too, so they can be
+        emptied by rebalancing.
+        """
+        if shard_count < 1:
+            raise ValueError("Need at least one shard")
+        self.global_db = global_db
+        self.shard_count = shard_count
+        self._move_lock = threading.Lock()
+
+        # Courses created before sharding are all in the global file
+        with global_db.writer() as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO course_directory (course_id, course_code)
+                SELECT id, course_code FROM courses
+            ''')
+            highest = conn.execute("SELECT COALESCE(MAX(shard), 0) FROM course_directory").fetchone()[0]
+
+        archive = global_archive or Archiver(global_db, default_archive_path(db_path))
+        self.shards = [Shard(0, global_db, archive)]
+        for index in range(1, max(shard_count, highest + 1)):
+            db = open_database(shard_path(db_path, index))
+            self.shards.append(Shard(index, db, Archiver(db, default_archive_path(db.path))))
+
+        self._pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="shard")
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the course directory from the global database"""
+        with self.global_db.reader() as conn:
+            directory = dict(conn.execute("SELECT course_id, shard FROM course_directory"))
+        self._directory = directory  # Swapped whole, so readers never see it half built
+        self._loaded_at = time.monotonic()
+
+    def shard_of(self, course_id):
+        """The Shard holding a course; LookupError if there is no such course"""
+        if time.monotonic() - self._loaded_at > DIRECTORY_TTL:
+            self.refresh()
+        index = self._directory.get(course_id)
+        if index is None:
+            self.refresh()  # Maybe created by another process just now
+            index = self._directory.get(course_id)
+            if index is None:
+                raise LookupError(f"No course {course_id}")
+        return self.shards[index]
+
+    def holds(self, shard, course_id):
+        """True if the directory places the course on this shard
+
+        Fan-out reads drop rows of courses that are only passing through
+        (half-copied by a move, or left behind until cleanup).
+        """
+        return self._directory.get(course_id) == shard.index
+
+    def fan_out(self, func, shards=None):
+        """[func(shard) for each shard], run in parallel"""
+        return list(self._pool.map(func, self.shards if shards is None else shards))
+
+    def new_course(self, course_code):
+        """Reserve a course id and pick its shard, return (course_id, Shard)
+
+        Raises sqlite3.IntegrityError if the course code is taken.
+        """
+        index = home_shard(course_code, self.shard_count)
+        with self.global_db.writer() as conn:
+            course_id = conn.execute(
+                "INSERT INTO course_directory (course_code, shard) VALUES (?, ?)",
+                (course_code, index)
+            ).lastrowid
+        self._directory[course_id] = index
+        return course_id, self.shards[index]
+
+    def forget_course(self, course_id):
+        """Give back an id from new_course whose course could not be created"""
+        with self.global_db.writer() as conn:
+            conn.execute("DELETE FROM course_directory WHERE course_id = ?", (course_id,))
+        self._directory.pop(course_id, None)
+
+    def close(self):
+        """Close the shard files (the global database belongs to the caller)"""
+        self._pool.shutdown(wait=True)
+        for shard in self.shards[1:]:
+            shard.db.close()
+
+    # ---------- moving courses ----------
+
+    def misplaced(self):
+        """(course_id, course_code, shard, home shard) of courses not on their home shard"""
+        with self.global_db.reader() as conn:
+            rows = conn.execute("SELECT course_id, course_code, shard FROM course_directory ORDER BY course_id")
+            return [(course_id, code, index, home_shard(code, self.shard_count))
+                    for course_id, code, index in rows
+                    if index != home_shard(code, self.shard_count)]
+
+    def move_course(self, course_id, target_index, batch_size=DEFAULT_MOVE_BATCH, cleanup_delay=DIRECTORY_TTL):
+        """Move a course to another shard while it stays in use, return how many messages moved
+
+        Messages are copied in batches without blocking the source; only
+        the final catch-up holds the source writer. The source copy is
+        deleted after `cleanup_delay` seconds, once other processes have
+        re-read the directory (None leaves it for finish_moves).
+        """
+        if not 0 <= target_index < len(self.shards):
+            raise ValueError(f"No shard {target_index}")
+
+        with self._move_lock:
+            self.refresh()
+            source = self.shard_of(course_id)
+            target = self.shards[target_index]
+            if source is target:
+                return 0
+            with source.db.reader() as conn:
+                if source.archive.attach_reader(conn) and conn.execute(
+                    "SELECT 1 FROM archive.messages WHERE course_id = ? LIMIT 1", (course_id,)
+                ).fetchone():
+                    raise ValueError(f"Course {course_id} has archived messages, which are not moved")
+
+            self._remove_course(target, course_id, batch_size)  # Leftovers of an earlier attempt
+            with target.db.writer() as conn:
+                events_before = feed.head(conn)
+                conn.execute("ATTACH DATABASE ? AS move_source", (source.db.path,))
+            try:
+                # Bulk copy while the course stays writable, then once more to catch up
+                copied = self._copy_messages(target, course_id, 0, batch_size)
+                copied = self._copy_messages(target, course_id, copied, batch_size)
+                moved = self._switch(source, target, course_id, copied, events_before, batch_size)
+            finally:
+                with target.db.writer() as conn:
+                    conn.execute("DETACH DATABASE move_source")
+
+            self._directory[course_id] = target.index
+            if cleanup_delay is not None:
+                time.sleep(cleanup_delay)
+                self._remove_course(source, course_id, batch_size)
+            return moved
+
+    def _copy_course_rows(self, conn, course_id):
+        """Copy the course row, its enrollments and the users they need"""
+        conn.execute(_COPY_USERS_SQL.format('''
+            SELECT created_by FROM move_source.courses WHERE id = :course_id
+            UNION SELECT user_id FROM move_source.enrollments WHERE course_id = :course_id
+            UNION SELECT staff_id FROM move_source.moderation_actions WHERE course_id = :course_id
+        '''), {"course_id": course_id})
+        conn.execute('''
+            INSERT OR IGNORE INTO main.courses (id, course_code, course_name, created_by, created_at)
+            SELECT id, course_code, course_name, created_by, created_at FROM move_source.courses
+            WHERE id = ?
+        ''', (course_id,))
+        conn.execute('''
+            INSERT OR IGNORE INTO main.enrollments (user_id, course_id, enrolled_at)
+            SELECT user_id, course_id, enrolled_at FROM move_source.enrollments
+            WHERE course_id = ?
+        ''', (course_id,))
+
+    def _copy_messages(self, target, course_id, after_id, batch_size):
+        """Copy the course's messages with ids above `after_id`, return the last id copied
+
+        Walks the source in id order, one batch per target transaction.
+        """
+        while True:
+            with target.db.writer() as conn:
+                self._copy_course_rows(conn, course_id)
+                last_id = self._copy_batch(conn, course_id, after_id, batch_size)
+            if last_id is None:
+                return after_id
+            after_id = last_id
+            log.info("  copied messages up to id %d...", after_id)
+
+    def _copy_batch(self, conn, course_id, after_id, batch_size):
+        """Copy one batch of messages into the target, return its last id (None when done)"""
+        ids = [row[0] for row in conn.execute('''
+            SELECT id FROM move_source.messages
+            WHERE id > ? AND +course_id = ?
+            ORDER BY id
+            LIMIT ?
+        ''', (after_id, course_id, batch_size))]
+        if not ids:
+            return None
+        params = {"course_id": course_id, "first": ids[0], "last": ids[-1]}
+        conn.execute(_COPY_USERS_SQL.format('''
+            SELECT user_id FROM move_source.messages
+            WHERE id BETWEEN :first AND :last AND course_id = :course_id
+            UNION SELECT deleted_by FROM move_source.messages
+            WHERE id BETWEEN :first AND :last AND course_id = :course_id
+        '''), params)
+        # Moderation action ids are only mapped in the final phase. The path
+        # comes along (ids are kept), so the thread triggers leave these rows alone.
+        conn.execute('''
+            INSERT OR IGNORE INTO main.messages
+                (id, course_id, user_id, message, posted_at, deleted_at, deleted_by, parent_id, path, reply_count)
+            SELECT id, course_id, user_id, message, posted_at, deleted_at, deleted_by, parent_id, path, reply_count
+            FROM move_source.messages
+            WHERE id BETWEEN :first AND :last AND course_id = :course_id
+        ''', params)
+        # File contents too; the attachments rows follow in the final phase
+        self._copy_blobs(conn, "AND message_id BETWEEN :first AND :last", params)
+        return ids[-1]
+
+    @staticmethod
+    def _copy_blobs(conn, condition, params):
+        """Stream the blobs of the course's attachments (matching `condition`) the target lacks"""
+        blob_ids = [row[0] for row in conn.execute(f'''
+            SELECT DISTINCT blob_id FROM move_source.attachments WHERE course_id = :course_id {condition}
+        ''', params)]
+        return attachments.copy_blobs(conn, "move_source", blob_ids)
+
+    def _switch(self, source, target, course_id, copied, events_before, batch_size):
+        """Final catch-up with the source locked, then point the directory at the target"""
+        with source.db.writer() as source_conn:
+            # Holds off writers of the source file in every process until the switch commits
+            source_conn.execute("BEGIN IMMEDIATE")
+
+            with target.db.writer() as conn:
+                self._copy_course_rows(conn, course_id)
+                while True:
+                    last_id = self._copy_batch(conn, course_id, copied, batch_size)
+                    if last_id is None:
+                        break
+                    copied = last_id
+
+                # Moderation actions get new ids in the target
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS move_actions (old_id INTEGER PRIMARY KEY, new_id INTEGER)")
+                conn.execute("DELETE FROM temp.move_actions")
+                actions = conn.execute('''
+                    SELECT id, staff_id, criteria, message_count, created_at, restored_at
+                    FROM move_source.moderation_actions WHERE course_id = ?
+                    ORDER BY id
+                ''', (course_id,)).fetchall()
+                for old_id, *action in actions:
+                    new_id = conn.execute('''
+                        INSERT INTO main.moderation_actions
+                            (course_id, staff_id, criteria, message_count, created_at, restored_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [course_id] + action).lastrowid
+                    conn.execute("INSERT INTO temp.move_actions VALUES (?, ?)", (old_id, new_id))
+
+                # Deletes and restores made in the source after a message was copied
+                conn.execute('''
+                    UPDATE main.messages AS m
+                    SET deleted_at = s.deleted_at, deleted_by = s.deleted_by,
+                        moderation_action_id = (
+                            SELECT new_id FROM temp.move_actions WHERE old_id = s.moderation_action_id
+                        )
+                    FROM move_source.messages AS s
+                    WHERE s.deleted_at IS NOT NULL AND s.course_id = ? AND m.id = s.id
+                ''', (course_id,))
+                conn.execute('''
+                    UPDATE main.messages AS m
+                    SET deleted_at = NULL, deleted_by = NULL, moderation_action_id = NULL
+                    FROM move_source.messages AS s
+                    WHERE m.deleted_at IS NOT NULL AND m.course_id = ? AND s.id = m.id AND s.deleted_at IS NULL
+                ''', (course_id,))
+                # Copied, then purged or archived in the source
+                conn.execute('''
+                    DELETE FROM main.messages
+                    WHERE course_id = :course_id AND deleted_at IS NULL AND id NOT IN (
+                        SELECT id FROM move_source.messages WHERE course_id = :course_id AND deleted_at IS NULL
+                    )
+                ''', {"course_id": course_id})
+                # Reply counts as they stand in the source, after the triggers above ran here
+                conn.execute('''
+                    UPDATE main.messages AS m SET reply_count = s.reply_count
+                    FROM move_source.messages AS s
+                    WHERE s.course_id = ? AND m.id = s.id AND m.reply_count != s.reply_count
+                ''', (course_id,))
+
+                # Attachments get new ids in the target, pointing at its copies of the blobs
+                self._copy_blobs(conn, "", {"course_id": course_id})
+                conn.execute('''
+                    INSERT INTO main.attachments
+                        (message_id, course_id, blob_id, filename, content_type, size, created_at)
+                    SELECT a.message_id, a.course_id, t.id, a.filename, a.content_type, a.size, a.created_at
+                    FROM move_source.attachments AS a
+                    JOIN move_source.blobs AS s ON s.id = a.blob_id
+                    JOIN main.blobs AS t ON t.sha256 = s.sha256
+                    WHERE a.course_id = ?
+                    ORDER BY a.id
+                ''', (course_id,))
+                # Copied, then no longer attached in the source
+                conn.execute("DELETE FROM main.blobs WHERE ref_count = 0 AND sha256 IS NOT NULL")
+                conn.execute('''
+                    INSERT OR REPLACE INTO main.export_state (course_id, last_message_id, exported_at)
+                    SELECT course_id, last_message_id, exported_at FROM move_source.export_state
+                    WHERE course_id = ?
+                ''', (course_id,))
+                # The copy fired the feed triggers; clients already saw these changes on the source
+                conn.execute("DELETE FROM main.message_events WHERE course_id = ? AND seq > ?",
+                             (course_id, events_before))
+                conn.execute("DELETE FROM main.course_moves WHERE course_id = ?", (course_id,))
+                moved = conn.execute(
+                    "SELECT COUNT(*) FROM main.messages WHERE course_id = ?", (course_id,)
+                ).fetchone()[0]
+
+            # Target committed: point the directory at it, then close the source
+            with self.global_db.writer() as conn:
+                conn.execute(
+                    "UPDATE course_directory SET shard = ?, moved_at = CURRENT_TIMESTAMP WHERE course_id = ?",
+                    (target.index, course_id)
+                )
+            source_conn.execute(
+                "INSERT OR REPLACE INTO course_moves (course_id, to_shard) VALUES (?, ?)",
+                (course_id, target.index)
+            )
+            # Never hand out the moved ids again, even once they are deleted here
+            source_conn.execute('''
+                UPDATE shard_info SET message_id_floor = MAX(
+                    message_id_floor,
+                    COALESCE((SELECT MAX(id) FROM messages WHERE id BETWEEN ? AND ?), 0)
+                )
+            ''', (source.id_base, source.id_top))
+        return moved
+
+    def _remove_course(self, shard, course_id, batch_size=DEFAULT_MOVE_BATCH):
+        """Delete every row of a course from a shard that does not hold it"""
+        with shard.db.reader() as conn:
+            present = conn.execute("SELECT 1 FROM courses WHERE id = ?", (course_id,)).fetchone()
+
+        if present:
+            # Messages first, in batches, so the writer is free in between
+            after_id = 0
+            while True:
+                with shard.db.writer() as conn:
+                    ids = [row[0] for row in conn.execute('''
+                        SELECT id FROM messages WHERE id > ? AND +course_id = ? ORDER BY id LIMIT ?
+                    ''', (after_id, course_id, batch_size))]
+                    if not ids:
+                        break
+                    conn.execute(f"DELETE FROM messages WHERE id IN ({', '.join('?' * len(ids))})", ids)
+                after_id = ids[-1]
+
+        with shard.db.writer() as conn:
+            for table in ("attachments", "message_events", "moderation_actions", "enrollments", "export_state",
+                          "course_stats", "activity_hourly", "activity_daily", "activity_user_daily"):
+                conn.execute(f"DELETE FROM {table} WHERE course_id = ?", (course_id,))
+            conn.execute("DELETE FROM courses WHERE id = ?", (course_id,))
+
+    def finish_moves(self, batch_size=DEFAULT_MOVE_BATCH):
+        """Delete leftover copies of courses from shards that do not hold them, return how many"""
+        self.refresh()
+        removed = 0
+        for shard in self.shards:
+            with shard.db.reader() as conn:
+                course_ids = [row[0] for row in conn.execute("SELECT id FROM courses")]
+            for course_id in course_ids:
+                if not self.holds(shard, course_id):
+                    self._remove_course(shard, course_id, batch_size)
+                    removed += 1
+        return removed
+
+
+class ShardedForumService(ForumService):
+    """ForumService over a global database plus course shards
+
+    Takes the arguments of ForumService plus `shards`. Write-behind and
+    the purge job run per shard.
+    """
+
+    def __init__(self, db_path='course_forum.db', shards=DEFAULT_SHARDS, write_behind=False,
+                 group_commit_size=DEFAULT_MAX_BATCH, group_commit_ms=DEFAULT_MAX_DELAY_MS,
+                 purge_interval=None, purge_after=DEFAULT_PURGE_AFTER, **options):
+        """Open the global database and every shard"""
+        started = time.perf_counter()
+        super().__init__(db_path, **options)
+        self.router = ShardRouter(self.db, db_path, shards, self._open_shard, global_archive=self.archive)
+
+        for shard in self.router.shards:
+            if write_behind:
+                shard.write_queue = GroupCommitWriter(
+                    shard.db,
+                    max_batch=group_commit_size,
+                    max_delay_ms=group_commit_ms,
+                    on_commit=lambda posts: self.notifier.publish({course_id for _, course_id, _ in posts}),
+                    insert=shard.insert_message
+                )
+            if purge_interval:
+                shard.purge_job = PurgeJob(shard.db, interval=purge_interval, older_than=purge_after)
+        self._record_startup(started)
+
+    def setup_database(self, read_pool_size=4, busy_timeout=5000, synchronous="NORMAL"):
+        """Open the global database (shard 0); the others are opened with the same settings"""
+        self._shard_settings = (read_pool_size, busy_timeout, synchronous)
+        return super().setup_database(read_pool_size, busy_timeout, synchronous)
+
+    def _open_shard(self, path):
+        db, _ = self._open_database(path, *self._shard_settings)
+        return db
+
+    def _db_for(self, course_id):
+        return self.router.shard_of(course_id).db
+
+    def _archive_for(self, course_id):
+        return self.router.shard_of(course_id).archive
+
+    @contextmanager
+    def _course_writer(self, course_id):
+        """Writer of the course's shard, refusing with CourseMoved once the course has left it"""
+        shard = self.router.shard_of(course_id)
+        with shard.db.writer() as conn:
+            # Lock first: a move's switch has either committed its marker or waits for us
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            shard.check_holds(conn, course_id)
+            yield conn
+
+    def _retry_moved(self, write, *args, **kwargs):
+        """Run a course write; if the course has moved meanwhile, reload the directory and run it again"""
+        try:
+            return write(*args, **kwargs)
+        except CourseMoved:
+            self.router.refresh()
+            return write(*args, **kwargs)
+
+    def close(self):
+        """Close every shard, then the global database"""
+        for shard in self.router.shards:
+            if shard.write_queue is not None:
+                shard.write_queue.close()
+            if shard.purge_job is not None:
+                shard.purge_job.close()
+        self.router.close()
+        super().close()
+
+    def _ensure_user(self, shard, user_id):
+        """Copy a stub of a global user into a shard before it is referenced there"""
+        if shard.index == 0 or user_id in shard.known_users:
+            return
+        with self.db.reader() as conn:
+            row = conn.execute(
+                "SELECT id, username, role, full_name, created_at FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+        if row is None:
+            raise LookupError(f"No user {user_id}")
+        with shard.db.writer() as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO users (id, username, password_hash, role, full_name, created_at)
+                VALUES (?, ?, '!', ?, ?, ?)
+            ''', (row[0], row[1], row[2], row[3], row[4]))
+        shard.known_users.add(user_id)
+
+    # ================= COURSES =================
+
+    def add_course(self, user_id, course_code, course_name):
+        """Save a new course on its home shard and enroll its creator, return the course id
+
+        Raises sqlite3.IntegrityError if the course code is taken.
+        """
+        course_id, shard = self.router.new_course(course_code)
+        try:
+            self._ensure_user(shard, user_id)
+            with shard.db.writer() as conn:
+                conn.execute(
+                    "INSERT INTO courses (id, course_code, course_name, created_by) VALUES (?, ?, ?, ?)",
+                    (course_id, course_code, course_name, user_id)
+                )
+                conn.execute(
+                    "INSERT INTO enrollments (user_id, course_id) VALUES (?, ?)",
+                    (user_id, course_id)
+                )
+        except BaseException:
+            self.router.forget_course(course_id)
+            raise
+
+        self.invalidate_enrollment(user_id, course_id)
+        return course_id
+
+    def owned_courses(self, staff_id):
+        def query(shard):
+            with shard.db.reader() as conn:
+                return [row for row in conn.execute(
+                    "SELECT id, course_code FROM courses WHERE created_by = ?", (staff_id,)
+                ) if self.router.holds(shard, row[0])]
+        return sorted((row for rows in self.router.fan_out(query) for row in rows), key=lambda row: row[1])
+
+    def course_ids_by_code(self, course_codes):
+        course_ids = []
+        with self.db.reader() as conn:
+            for code in course_codes:
+                row = conn.execute(
+                    "SELECT course_id FROM course_directory WHERE course_code = ?", (code,)
+                ).fetchone()
+                if row is None:
+                    raise LookupError(f"No course with code {code}")
+                course_ids.append(row[0])
+        return course_ids
+
+    def course_activity(self, course_ids):
+        by_shard = {}
+        for course_id in course_ids:
+            try:
+                by_shard.setdefault(self.router.shard_of(course_id), []).append(course_id)
+            except LookupError:
+                continue  # Like the unsharded lookup: unknown courses have no activity
+
+        def query(shard):
+            with shard.db.reader() as conn:
+                return stats.get_stats(conn, by_shard[shard])
+        activity = {}
+        for shard_activity in self.router.fan_out(query, list(by_shard)):
+            activity.update(shard_activity)
+        return activity
+
+    def course_catalog(self, user_id, prefix="", by="code", after=None, page_size=CATALOG_PAGE_SIZE):
+        column = 1 if by == "code" else 2
+
+        def query(shard):
+            with shard.db.reader() as conn:
+                page = catalog.fetch_page(conn, user_id, prefix, by, after, page_size)
+            rows = [row for row in page["courses"] if self.router.holds(shard, row[0])]
+            return rows, page["courses"][-1] if page["next"] else None
+
+        def key(row):
+            return row[column].translate(_ASCII_LOWER), row[0]  # COLLATE NOCASE, then id
+
+        rows, has_more = merge_sorted(self.router.fan_out(query), key, page_size)
+        next_cursor = (rows[-1][column], rows[-1][0]) if rows and has_more else None
+        return {"courses": rows, "next": next_cursor}
+
+    def enroll(self, user_id, course_id):
+        self._retry_moved(self._enroll, user_id, course_id)
+
+    def _enroll(self, user_id, course_id):
+        self._ensure_user(self.router.shard_of(course_id), user_id)
+        super().enroll(user_id, course_id)
+
+    def _load_my_courses(self, user_id):
+        def query(shard):
+            with shard.db.reader() as conn:
+                return [row for row in conn.execute(_MY_COURSES_SQL, (user_id,))
+                        if self.router.holds(shard, row[0])]
+        return tuple(sorted((row for rows in self.router.fan_out(query) for row in rows),
+                            key=lambda row: row[1]))
+
+    # ================= MESSAGES =================
+
+    def submit_message(self, user_id, course_id, message, parent_id=None, retry=True):
+        """Save a message on the course's shard, return a Future for its id
+
+        A post that finds the course moved away is retried once on its
+        new shard.
+        """
+        if parent_id is not None:
+            self._check_parent(course_id, parent_id)
+        shard = self.router.shard_of(course_id)
+        if shard.write_queue is None:
+            future = Future()
+            try:
+                with shard.db.writer() as conn:
+                    message_id = shard.insert_message(conn, course_id, user_id, message, parent_id)
+            except CourseMoved:
+                if not retry:
+                    raise
+                self.router.refresh()
+                return self.submit_message(user_id, course_id, message, parent_id, retry=False)
+            future.set_result(message_id)
+            self.notifier.publish([course_id])
+            return future
+
+        queued = shard.write_queue.submit(course_id, user_id, message, parent_id)
+        if not retry:
+            return queued
+        future = Future()
+
+        def committed(queued):
+            if not isinstance(queued.exception(), CourseMoved):
+                _copy_future(queued, future)
+                return
+            self.router.refresh()
+            try:
+                self.submit_message(user_id, course_id, message, parent_id, retry=False).add_done_callback(
+                    lambda retried: _copy_future(retried, future))
+            except Exception as exc:
+                future.set_exception(exc)
+        queued.add_done_callback(committed)
+        return future
+
+    def flush_writes(self):
+        for shard in self.router.shards:
+            if shard.write_queue is not None:
+                shard.write_queue.flush()
+
+    def attach_file(self, user_id, course_id, message_id, filename, stream, size, content_type=None):
+        # Refused before any byte is read, so the stream is still whole for the retry
+        return self._retry_moved(super().attach_file, user_id, course_id, message_id, filename, stream,
+                                 size, content_type)
+
+    # ================= CHANGE FEED =================
+
+    def feed_head(self):
+        """Cursor for a client that only wants changes from now on: one seq per shard"""
+        def query(shard):
+            with shard.db.reader() as conn:
+                return feed.head(conn)
+        return tuple(self.router.fan_out(query))
+
+    def fetch_feed(self, user_id, cursor, limit=FEED_LIMIT, course_ids=None):
+        """Changes in a user's courses after a cursor from feed_head or an earlier call
+
+        Seqs are only ordered within one shard, so the events of each
+        shard come in order but shards are not interleaved by time.
+        """
+        if not isinstance(cursor, (tuple, list)) or len(cursor) != len(self.router.shards):
+            raise ValueError("Bad feed cursor")
+
+        def query(shard):
+            with shard.db.reader() as conn:
+                events = feed.fetch_events(conn, user_id, cursor[shard.index], limit, course_ids)
+            seq = events[-1][0] if events else cursor[shard.index]
+            return [event for event in events if self.router.holds(shard, event[2])], seq
+
+        results = self.router.fan_out(query)
+        return {"events": [event for events, _ in results for event in events],
+                "cursor": tuple(seq for _, seq in results)}
+
+    # ================= SEARCH =================
+
+    def search_messages(self, user_id, query, page=1, page_size=MESSAGE_PAGE_SIZE):
+        """Full-text search in a user's courses, newest matches first
+
+        Each shard has its own FTS index, and bm25 ranks depend on the
+        statistics of that index, so ranks of different shards cannot be
+        merged. Results are ordered by (posted_at, id) instead.
+        """
+        match = self._fts_query(query)
+        if not match or not user_id:
+            return [], False
+
+        # The newest page * page_size hits overall are among each shard's newest that many
+        def search(shard):
+            with shard.db.reader() as conn:
+                rows = conn.execute(_SHARD_SEARCH_SQL, (user_id, match, page * page_size + 1, 0)).fetchall()
+            return [row for row in rows if self.router.holds(shard, row[6])]
+
+        rows = sorted((row for rows in self.router.fan_out(search) for row in rows),
+                      key=lambda row: (row[3], row[0]), reverse=True)
+        rows = rows[(page - 1) * page_size:]
+        return [row[:5] for row in rows[:page_size]], len(rows) > page_size
+
+    # ================= MODERATION =================
+
+    def moderate_messages(self, staff_id, course_id, **filters):
+        return self._retry_moved(super().moderate_messages, staff_id, course_id, **filters)
+
+    def restore_moderation(self, staff_id, action_id, course_id=None):
+        if course_id is None:
+            raise ValueError("Give the course the moderation action was taken in")
+        try:
+            return super().restore_moderation(staff_id, action_id, course_id)
+        except CourseMoved:
+            # Moderation actions are renumbered by a move, so this id means nothing there
+            self.router.refresh()
+            raise LookupError(f"Course {course_id} has moved; reload its moderation history") from None
+
+    def delete_message(self, message_id, staff_id):
+        def query(shard):
+            with shard.db.reader() as conn:
+                row = conn.execute(
+                    "SELECT course_id FROM messages WHERE id = ? AND deleted_at IS NULL", (message_id,)
+                ).fetchone()
+            return row[0] if row and self.router.holds(shard, row[0]) else None
+
+        course_ids = [course_id for course_id in self.router.fan_out(query) if course_id is not None]
+        if not course_ids:
+            return None
+        action_id, _ = self.moderate_messages(staff_id, course_ids[0], message_id=message_id)
+        return action_id
+
+    # ================= MAINTENANCE =================
+
+    def move_course(self, course_id, target_index, batch_size=DEFAULT_MOVE_BATCH, cleanup_delay=DIRECTORY_TTL):
+        """Move a course to another shard online, see ShardRouter.move_course"""
+        self.flush_writes()
+        moved = self.router.move_course(course_id, target_index, batch_size, cleanup_delay)
+        self._cache_generation += 1
+        self.course_cache.clear()
+        self.enrollment_cache.clear()
+        return moved
+
+    def rebuild_search_index(self):
+        def rebuild(shard):
+            with shard.db.writer() as conn:
+                conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        self.router.fan_out(rebuild)
+
+    def archive_messages(self, before=None, course_codes=(), batch_size=DEFAULT_BATCH_SIZE, compact=False):
+        course_ids = self.course_ids_by_code(course_codes)
+        moved = 0
+        for shard in self.router.shards:
+            shard_course_ids = [course_id for course_id in course_ids if self.router.holds(shard, course_id)]
+            if course_ids and not shard_course_ids:
+                continue
+            moved += shard.archive.archive_messages(before=before, course_ids=shard_course_ids,
+                                                    batch_size=batch_size)
+            if compact:
+                shard.archive.compact()
+        return moved
+
+    def verify_course_stats(self, repair=False):
+        def verify(shard):
+            if shard.archive.exists():
+                mismatches = shard.archive.verify_stats()
+            else:
+                with shard.db.reader() as conn:
+                    mismatches = stats.verify(conn)
+            if mismatches and repair:
+                if shard.archive.exists():
+                    shard.archive.backfill_stats()
+                else:
+                    with shard.db.writer() as conn:
+                        stats.backfill(conn)
+            return mismatches
+        return [mismatch for mismatches in self.router.fan_out(verify) for mismatch in mismatches]
+
+    def refresh_analytics(self, batch_size=DEFAULT_REFRESH_BATCH):
+        return sum(self.router.fan_out(lambda shard: analytics.refresh(shard.db, batch_size)))
+
+    def verify_analytics(self, repair=False):
+        def verify(shard):
+            if shard.archive.exists():
+                mismatches = shard.archive.verify_analytics()
+            else:
+                with shard.db.reader() as conn:
+                    mismatches = analytics.verify(conn)
+            if mismatches and repair:
+                self._rebuild_shard_analytics(shard)
+            return mismatches
+        return [mismatch for mismatches in self.router.fan_out(verify) for mismatch in mismatches]
+
+    def rebuild_analytics(self):
+        self.router.fan_out(self._rebuild_shard_analytics)
+
+    @staticmethod
+    def _rebuild_shard_analytics(shard):
+        if shard.archive.exists():
+            shard.archive.rebuild_analytics()
+        else:
+            with shard.db.writer() as conn:
+                analytics.rebuild(conn)
+
+    def purge_tombstones(self, older_than=DEFAULT_PURGE_AFTER):
+        results = self.router.fan_out(lambda shard: (purge(shard.db, older_than), feed.prune(shard.db)))
+        return sum(purged for purged, _ in results), sum(pruned for _, pruned in results)
+
+
+def print_status(router):
+    """Courses and live messages per shard, and courses away from their home shard"""
+    print(f"{'shard':>5}  {'courses':>8}  {'messages':>10}  file")
+    for shard in router.shards:
+        with shard.db.reader() as conn:
+            rows = conn.execute("SELECT course_id, message_count FROM course_stats").fetchall()
+        held = [(course_id, count) for course_id, count in rows if router.holds(shard, course_id)]
+        print(f"{shard.index:>5}  {len(held):>8}  {sum(count for _, count in held):>10}  {shard.db.path}")
+    misplaced = router.misplaced()
+    if misplaced:
+        print(f"\n{len(misplaced)} course(s) not on their home shard for {router.shard_count} shards "
+              "(run rebalance).")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and rebalance course shards")
+    parser.add_argument("command", choices=["status", "move", "rebalance", "cleanup"])
+    parser.add_argument("course", nargs="?", help="move: course code")
+    parser.add_argument("shard", nargs="?", type=int, help="move: target shard")
+    parser.add_argument("--db", default="course_forum.db", help="global database file")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS, help="number of shards")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_MOVE_BATCH,
+                        help="messages copied per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="rebalance: only list the moves")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")  # Migration and copy progress
+
+    service = ShardedForumService(args.db, shards=args.shards)
+    router = service.router
+    try:
+        if args.command == "status":
+            print_status(router)
+        elif args.command == "move":
+            if args.course is None or args.shard is None:
+                parser.error("move needs a course code and a target shard")
+            try:
+                course_id = service.course_ids_by_code([args.course])[0]
+                moved = service.move_course(course_id, args.shard, args.batch_size)
+            except (LookupError, ValueError) as exc:
+                print(f"❌ {exc}.")
+                return 1
+            print(f"✅ Moved {args.course} ({moved} messages) to shard {args.shard}.")
+        elif args.command == "rebalance":
+            for course_id, code, index, home in router.misplaced():
+                print(f"{code}: shard {index} -> {home}")
+                if not args.dry_run:
+                    try:
+                        moved = service.move_course(course_id, home, args.batch_size, cleanup_delay=None)
+                    except ValueError as exc:
+                        print(f"  ❌ skipped: {exc}.")
+                        continue
+                    print(f"  ✅ {moved} messages moved.")
+            if not args.dry_run:
+                time.sleep(DIRECTORY_TTL)  # Let running servers see the new directory first
+                print(f"✅ Removed {router.finish_moves(args.batch_size)} leftover course copies.")
+        elif args.command == "cleanup":
+            print(f"✅ Removed {router.finish_moves(args.batch_size)} leftover course copies.")
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# stats.py - Group 7
+"""Per-course activity counters kept in the course_stats table
+
+Triggers (see migrations.py) update one course_stats row whenever a
+message is posted, deleted or restored or an enrollment changes, so
+menus can show message count, member count and last post time without
+aggregating over messages and enrollments. Tombstoned messages are not
+counted.
+"""
+
+# The same aggregate the triggers maintain, computed from scratch
+_RAW_STATS_SQL = '''
+    SELECT c.id,
+           (SELECT COUNT(*) FROM messages m WHERE m.course_id = c.id AND m.deleted_at IS NULL),
+           (SELECT COUNT(*) FROM enrollments e WHERE e.course_id = c.id),
+           (SELECT MAX(m.posted_at) FROM messages m WHERE m.course_id = c.id AND m.deleted_at IS NULL)
+    FROM courses c
+'''
+
+# The same, counting messages moved to an attached archive database as well
+_RAW_STATS_WITH_ARCHIVE_SQL = '''
+    SELECT c.id,
+           (SELECT COUNT(*) FROM messages m WHERE m.course_id = c.id AND m.deleted_at IS NULL)
+             + (SELECT COUNT(*) FROM archive.messages a WHERE a.course_id = c.id),
+           (SELECT COUNT(*) FROM enrollments e WHERE e.course_id = c.id),
+           COALESCE((SELECT MAX(m.posted_at) FROM messages m WHERE m.course_id = c.id AND m.deleted_at IS NULL),
+                    (SELECT MAX(a.posted_at) FROM archive.messages a WHERE a.course_id = c.id))
+    FROM courses c
+'''
+
+
+def backfill(conn, archived=False):
+    """Recompute every course's counters from the raw tables
+
+    With archived=True the connection must have the archive attached.
+    Migration 5 runs this before messages has a deleted_at column
+    (migration 7); then there are no tombstones and every post counts.
+    """
+    sql = _RAW_STATS_WITH_ARCHIVE_SQL if archived else _RAW_STATS_SQL
+    columns = {row[1] for row in conn.execute("PRAGMA main.table_info(messages)")}
+    if "deleted_at" not in columns:
+        sql = sql.replace(" AND m.deleted_at IS NULL", "")
+    conn.execute("DELETE FROM course_stats")
+    conn.execute(f'''
+        INSERT INTO course_stats (course_id, message_count, member_count, last_posted_at)
+        {sql}
+    ''')
+
+
+def verify(conn, archived=False):
+    """Compare course_stats with the raw aggregates, return the mismatches
+
+    Each mismatch is (course_id, stored row, expected row).
+    """
+    stored = {row[0]: row for row in conn.execute(
+        "SELECT course_id, message_count, member_count, last_posted_at FROM course_stats"
+    )}
+    mismatches = []
+    for expected in conn.execute(_RAW_STATS_WITH_ARCHIVE_SQL if archived else _RAW_STATS_SQL):
+        actual = stored.get(expected[0])
+        if actual != expected:
+            mismatches.append((expected[0], actual, expected))
+    return mismatches
+
+
+def get_stats(conn, course_ids):
+    """{course_id: (message_count, member_count, last_posted_at)} for some courses"""
+    course_ids = list(course_ids)
+    if not course_ids:
+        return {}
+    placeholders = ", ".join("?" * len(course_ids))
+    rows = conn.execute(f'''
+        SELECT course_id, message_count, member_count, last_posted_at
+        FROM course_stats
+        WHERE course_id IN ({placeholders})
+    ''', course_ids)
+    return {row[0]: row[1:] for row in rows}
+
+
+def describe(course_stats):
+    """Short human-readable summary, e.g. '12 posts, 30 members, last 2026-01-31'"""
+    if not course_stats:
+        return "no activity"
+    message_count, member_count, last_posted_at = course_stats
+    summary = f"{message_count} posts, {member_count} members"
+    if last_posted_at:
+        summary += f", last {last_posted_at.split()[0]}"
+    return summary
+
@@ -0,0 +1,142 @@
+# write_queue.py - Group 7
+"""Group commit for message posts
+
+In write-behind mode posts are put on a bounded queue and a single writer
+thread inserts them in one transaction when either `max_batch` posts are
+waiting or `max_delay_ms` has passed since the first one arrived. Many
+posts then share one commit (and one fsync) instead of paying for one
+each. Every caller gets a Future that resolves to the new message id
+once the transaction holding it has committed.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_MAX_BATCH = 100
+DEFAULT_MAX_DELAY_MS = 10
+DEFAULT_MAX_QUEUE = 10000
+
+_STOP = object()
+
+
+def insert_message(conn, course_id, user_id, message, parent_id=None):
+    """Plain INSERT of one post (a reply if parent_id is given), return its id"""
+    return conn.execute(
+        "INSERT INTO messages (course_id, user_id, message, parent_id) VALUES (?, ?, ?, ?)",
+        (course_id, user_id, message, parent_id)
+    ).lastrowid
+
+
+class GroupCommitWriter:
+    def __init__(self, db, max_batch=DEFAULT_MAX_BATCH, max_delay_ms=DEFAULT_MAX_DELAY_MS,
+                 max_queue=DEFAULT_MAX_QUEUE, on_commit=None, insert=None):
+        """Start the writer thread; `db` is a ConnectionManager
+
+        on_commit(posts) is called after each successful commit with the
+        list of (message_id, course_id, user_id) that became durable.
+        insert(conn, course_id, user_id, message, parent_id) replaces the
+        plain INSERT and returns the new id (sharding.py picks the id
+        itself).
+        """
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.on_commit = on_commit
+        self.insert = insert or insert_message
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, course_id, user_id, message, parent_id=None):
+        """Queue a post, return a Future for its message id
+
+        Blocks while the queue is full, which slows producers down
+        instead of letting memory grow without bound.
+        """
+        if self._closed:
+            raise RuntimeError("Write queue is closed")
+        future = Future()
+        self._queue.put((course_id, user_id, message, parent_id, future))
+        return future
+
+    def _next_batch(self):
+        """Wait for the first post, then collect more until full or out of time"""
+        first = self._queue.get()
+        if first is _STOP:
+            return None, True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._write(batch)
+            for _ in range(len(batch or ()) + (1 if stopping else 0)):
+                self._queue.task_done()
+
+    def _write(self, batch):
+        """Insert a batch in one transaction; a bad post only fails itself"""
+        results = []
+        try:
+            with self.db.writer() as conn:
+                # Open the transaction ourselves: a bare SAVEPOINT/RELEASE would commit each post
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                for course_id, user_id, message, parent_id, future in batch:
+                    # Savepoint per post so e.g. a foreign-key error skips just that one
+                    conn.execute("SAVEPOINT post")
+                    try:
+                        message_id = self.insert(conn, course_id, user_id, message, parent_id)
+                        conn.execute("RELEASE post")
+                        results.append((future, message_id, None, (course_id, user_id)))
+                    except sqlite3.Error as exc:
+                        conn.execute("ROLLBACK TO post")
+                        conn.execute("RELEASE post")
+                        results.append((future, None, exc, None))
+        except Exception as exc:
+            # Commit failed: nothing in the batch is durable
+            for *_, future in batch:
+                future.set_exception(exc)
+            return
+
+        # Only now is every post in the batch durable
+        committed = []
+        for future, message_id, error, post in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(message_id)
+                committed.append((message_id,) + post)
+
+        if committed and self.on_commit is not None:
+            self.on_commit(committed)
+
+    def flush(self):
+        """Wait until every queued post has been committed"""
+        self._queue.join()
+
+    def close(self):
+        """Commit whatever is queued, then stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()